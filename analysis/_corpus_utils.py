@@ -0,0 +1,160 @@
+'''
+This file provides helpers shared by analyses that stream texts from
+elasticsearch and turn them into term counts or sparse document-term
+matrices, without keeping the texts in memory.
+
+'''
+
+import logging
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+import core.database
+from core.basic_utils import dotkeys
+
+logger = logging.getLogger(__name__)
+
+def as_query(query):
+    '''Turns a string query into an elasticsearch query, leaves dicts as they are'''
+    if type(query) == str:
+        return {'query':{'query_string':{'query':query}}}
+    return query
+
+def stream_texts(query, field='text', batchsize=1000):
+    '''Yields batches of (ids, texts) for the documents matching a query
+
+    Parameters
+    ----
+    query : string or dict
+        A string query or elasticsearch query
+    field : string (default='text')
+        The (dotted) field containing the text, documents without it are skipped
+    batchsize : int (default=1000)
+        The number of documents per batch
+    '''
+    if not field.startswith('_source.'):
+        field = '_source.' + field
+    ids, texts = [], []
+    for doc in core.database.scroll_query(as_query(query)):
+        text = dotkeys(doc, field)
+        if not text or type(text) != str:
+            continue
+        ids.append(doc['_id'])
+        texts.append(text)
+        if len(texts) == batchsize:
+            yield ids, texts
+            ids, texts = [], []
+    if texts:
+        yield ids, texts
+
+def make_analyzer(stop_words=None, ngram_range=(1,1), lowercase=True):
+    '''Returns a function that splits a text into terms, as used by CountVectorizer'''
+    return CountVectorizer(stop_words=stop_words, ngram_range=ngram_range, lowercase=lowercase).build_analyzer()
+
+class TermCounter():
+    '''Counts terms and document frequencies over batches of texts
+
+    Terms get an id the first time they are seen. Counters that are given the
+    same `vocabulary` dict share their term ids, so their counts can be
+    compared directly (see `aligned`).
+    '''
+
+    def __init__(self, analyzer=None, vocabulary=None):
+        self.analyzer = analyzer or make_analyzer()
+        self.vocabulary = vocabulary if vocabulary is not None else {}
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.doc_counts = np.zeros(0, dtype=np.int64)
+        self.n_docs = 0
+        self.n_tokens = 0
+
+    def update(self, texts):
+        '''Adds the terms in a batch of texts to the counts'''
+        vocabulary = self.vocabulary
+        token_ids = []
+        doc_ids = []
+        for text in texts:
+            ids = [vocabulary.setdefault(term, len(vocabulary)) for term in self.analyzer(text)]
+            token_ids.extend(ids)
+            doc_ids.extend(set(ids))
+        self.n_docs += len(texts)
+        self.n_tokens += len(token_ids)
+        self.counts = self.aligned(self.counts) + np.bincount(token_ids, minlength=len(vocabulary))
+        self.doc_counts = self.aligned(self.doc_counts) + np.bincount(doc_ids, minlength=len(vocabulary))
+        return self
+
+    def aligned(self, counts=None):
+        '''Returns the counts padded with zeros to the size of the (shared) vocabulary'''
+        if counts is None:
+            counts = self.counts
+        return np.concatenate([counts, np.zeros(len(self.vocabulary) - len(counts), dtype=counts.dtype)])
+
+    def terms(self):
+        '''Returns an array with the terms, ordered by id'''
+        terms = np.empty(len(self.vocabulary), dtype=object)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        return terms
+
+    def top(self, n, min_df=1):
+        '''Returns the ids of the `n` most frequent terms, of those in at least `min_df` documents'''
+        counts = self.aligned()
+        candidates = np.flatnonzero(self.aligned(self.doc_counts) >= min_df)
+        n = min(n, len(candidates))
+        top = candidates[np.argpartition(-counts[candidates], n - 1)[:n]] if n else np.zeros(0, dtype=int)
+        return top[np.argsort(-counts[top], kind='mergesort')]
+
+    def prune(self, n):
+        '''Keeps only the `n` most frequent terms, which get new ids
+
+        The counts of the removed terms are lost, so they are counted from zero if
+        they are seen again. Counters that share their vocabulary cannot be pruned.
+        '''
+        keep = self.top(n)
+        terms = self.terms()[keep]
+        self.counts = self.aligned()[keep]
+        self.doc_counts = self.aligned(self.doc_counts)[keep]
+        self.vocabulary.clear()
+        self.vocabulary.update((term, num) for num, term in enumerate(terms))
+        return self
+
+def count_terms(query, field='text', analyzer=None, vocabulary=None, batchsize=1000, max_terms=None):
+    '''Streams the documents matching a query into a `TermCounter`
+
+    With `max_terms`, the vocabulary is pruned to the `max_terms` most frequent
+    terms whenever it grows beyond twice that size (see `TermCounter.prune`), so
+    memory stays bounded for n-grams. Counts of the less frequent terms are then
+    approximate.
+    '''
+    if max_terms and vocabulary is not None:
+        raise ValueError("A shared vocabulary cannot be pruned")
+    counter = TermCounter(analyzer=analyzer, vocabulary=vocabulary)
+    for ids, texts in stream_texts(query, field, batchsize):
+        counter.update(texts)
+        if max_terms and len(counter.vocabulary) > 2 * max_terms:
+            counter.prune(max_terms)
+            logger.debug("pruned the vocabulary to {max_terms} terms".format(**locals()))
+        logger.info("counted terms in {counter.n_docs} documents".format(**locals()))
+    return counter
+
+def document_term_chunks(query, vocabulary, field='text', analyzer=None, binary=False, batchsize=1000):
+    '''Yields (ids, X) for the documents matching a query, with X a sparse
+    document-term matrix over a fixed vocabulary
+
+    Parameters
+    ----
+    query : string or dict
+        A string query or elasticsearch query
+    vocabulary : dict or list
+        The terms to count (term -> column) or a list of terms
+    field : string (default='text')
+        The field containing the text
+    analyzer : function (default=None)
+        The function splitting texts into terms, see `make_analyzer`
+    binary : bool (default=False)
+        Whether to only record presence (1) instead of counts
+    batchsize : int (default=1000)
+        The number of documents (rows) per chunk
+    '''
+    vectorizer = CountVectorizer(vocabulary=vocabulary, analyzer=analyzer or make_analyzer(),
+                                 binary=binary, dtype=np.int64)
+    for ids, texts in stream_texts(query, field, batchsize):
+        yield ids, vectorizer.transform(texts)
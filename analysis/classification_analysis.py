@@ -5,12 +5,14 @@ import core.database
 import logging
 import numpy as np
 import string
+import hashlib
 import sklearn
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer, HashingVectorizer
 from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import normalize
 
 from core.analysis_base_class import Analysis
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, vstack
 from sklearn.linear_model import SGDClassifier
 from sklearn.metrics import accuracy_score, precision_score, f1_score, recall_score
 from sklearn import svm
@@ -20,12 +22,64 @@ from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+def _held_out(doc_id, testsize):
+    '''Assigns a document to the held-out set based on (a hash of) its id, so the
+    split is the same whenever the document is seen again'''
+    return int(hashlib.md5(str(doc_id).encode('utf-8')).hexdigest()[:8], 16) < testsize * 0xffffffff
+
 class classification(Analysis):
 
+    # the held-out test set and the training documents are not stored
+    _model_state = ['model', 'vectorizer', 'vocab', '_classes', 'streaming', '_df', '_n_docs', 'n_train',
+                    'x_field', 'label_field', 'testsize', '_training_query']
+
     def __init__(self):
-        pass
+        self.streaming = False
 
-    def fit(self, documents, x_field, label_field, add_prediction=False, testsize = 0.2, mindf = 0.0, maxdf = 1.0, rand_shuffle = True, tfidf = True, vocabul = None):
+    def _batches(self, documents, x_field, label_field, batchsize):
+        '''Yields batches of (ids, texts, labels) for documents that have text'''
+        ids, texts, labels = [], [], []
+        for doc in documents:
+            text = core.basic_utils.dotkeys(doc, x_field)
+            if not text:
+                self.invalid_docs.append(doc['_id'])
+                continue
+            ids.append(doc['_id'])
+            texts.append(text)
+            labels.append(core.basic_utils.dotkeys(doc, label_field))
+            if len(ids) == batchsize:
+                yield ids, texts, labels
+                ids, texts, labels = [], [], []
+        if ids:
+            yield ids, texts, labels
+
+    def _weight(self, X, update_idf=False):
+        '''Applies the streaming inverse document frequencies to hashed term counts'''
+        if self._df is None:
+            return X
+        if update_idf:
+            # hashed rows have unique indices, so this counts documents per feature
+            self._df += np.bincount(X.indices, minlength=X.shape[1])
+            self._n_docs += X.shape[0]
+        X = X.tocsr(copy=True)
+        idf = np.log((1. + self._n_docs) / (1. + self._df)) + 1.
+        X.data *= idf[X.indices]
+        return normalize(X)
+
+    def _vectorize(self, texts, update_idf=False):
+        if not self.streaming:
+            return self.vectorizer.transform(texts)
+        return self._weight(self.vectorizer.transform(texts), update_idf=update_idf)
+
+    def _known_labels(self, X, labels):
+        '''Drops examples with labels the model was not set up for'''
+        known = [n for n, label in enumerate(labels) if label in self._classes]
+        if len(known) < len(labels):
+            logger.warning("Ignoring {n} documents with labels that are not in classes".format(n=len(labels)-len(known)))
+        return X[known], [labels[n] for n in known]
+
+    def fit(self, documents, x_field, label_field, add_prediction=False, testsize = 0.2, mindf = 0.0, maxdf = 1.0, rand_shuffle = True, tfidf = True, vocabul = None,
+            streaming = False, batchsize = 1000, n_features = 2**20, classes = None):
         """
         This method should train a Classifier model on the input documents.\n
         @param documents: the documents (stored in elasticsearch) to train on
@@ -69,6 +123,19 @@ class classification(Analysis):
                         encountered in the labeled documents are used to form the vocabulary.
         @type vocabul: list, or None type object
         @param one_pass: Keeps all documents in memory instead of retrieving them twice from ElasticSearch
+        @param streaming: If true, the model is trained out-of-core: documents are hashed (HashingVectorizer) and fed to
+                          the classifier in batches (SGDClassifier.partial_fit), so they are never all kept in memory.
+                          With tfidf, inverse document frequencies are updated as batches come in. Documents are assigned
+                          to the test set based on a hash of their id. 'mindf', 'maxdf', 'vocabul' and 'rand_shuffle' do
+                          not apply. The default is set to False.
+        @type streaming: Boolean
+        @param batchsize: The number of documents per batch in streaming mode. The default is set to 1000.
+        @type batchsize: int
+        @param n_features: The number of hashed features in streaming mode. The default is set to 2**20.
+        @type n_features: int
+        @param classes: All possible labels, needed up-front in streaming mode. If None, the labels in the first batch are used
+                        and documents with other labels are ignored.
+        @type classes: list, or None type object
         """
 
 
@@ -84,21 +151,32 @@ class classification(Analysis):
         self.vectorizer = None
         self.labels = []
         self.documents_fulltext = []
+        self.x_field = x_field
+        self.label_field = label_field
+        self.testsize = testsize
+        self.streaming = streaming
+        self._training_query = None
+
+        if type(documents) == dict:
+            self._training_query = documents
+            documents = core.database.scroll_query(documents)
 
+        if streaming:
+            return self._fit_streaming(documents, tfidf, batchsize, n_features, classes)
 
         counter = 0
         invalidchars = set(string.punctuation)
 
         for doc in documents:
             counter+=1
-            if len(core.basic_utils.dotkeys(doc, x_field))>0:
+            text = core.basic_utils.dotkeys(doc, x_field)
+            if len(text)>0:
                 self.valid_docs.append(doc['_id'])
                 self.labels.append(core.basic_utils.dotkeys(doc, label_field))
-                self.documents_fulltext.append(core.basic_utils.dotkeys(doc, x_field))
+                self.documents_fulltext.append(text)
 
                 if counter <5:
-                    text = core.basic_utils.dotkeys(doc, x_field).lower()
-                    if any(char in invalidchars for char in text):
+                    if any(char in invalidchars for char in text.lower()):
                         logger.info('Punctuation has not been removed. Proceeding without pre-processing.')
 
 
@@ -125,6 +203,7 @@ class classification(Analysis):
         logger.info('{} x entries and {} y entries'.format(self.fitted.shape[0], len(self.labels )))
         X_train, self.X_test, y_train, self.y_test = train_test_split(self.fitted, self.labels, test_size=testsize, shuffle = rand_shuffle, random_state=42)
         self.model =  SGDClassifier(loss='hinge', penalty='l2', alpha=1e-3, max_iter=1000, random_state=42).fit(X_train, y_train)
+        self._classes = set(self.model.classes_)
         if add_prediction ==True:
             self.train_predictions = self.model.predict(X_train)
         else:
@@ -132,6 +211,86 @@ class classification(Analysis):
 
         return (self.vocab, self.fitted, self.labels)
 
+    def _fit_streaming(self, documents, tfidf, batchsize, n_features, classes):
+        '''Trains the model batch by batch, see the `streaming` parameter of `fit`'''
+        self.vectorizer = HashingVectorizer(n_features = n_features, alternate_sign = False, norm = tfidf and None or 'l2')
+        self._df = np.zeros(n_features) if tfidf else None
+        self._n_docs = 0
+        self._classes = classes and set(classes) or None
+        self.model = SGDClassifier(loss='hinge', penalty='l2', alpha=1e-3, random_state=42)
+        self.n_train = 0
+        self.y_test = []
+        test_counts = []
+
+        for ids, texts, labels in self._batches(documents, self.x_field, self.label_field, batchsize):
+            if self._classes is None:
+                self._classes = set(labels)
+                logger.warning("No classes given, using the labels of the first batch: {}".format(sorted(self._classes, key=str)))
+            X = self.vectorizer.transform(texts)
+            held = np.array([_held_out(doc_id, self.testsize) for doc_id in ids])
+            if held.any() and not self._training_query:
+                # the documents cannot be retrieved again, so keep the (sparse) counts of the test set
+                test_counts.append(X[np.flatnonzero(held)])
+                self.y_test.extend(labels[n] for n in np.flatnonzero(held))
+            train = np.flatnonzero(~held)
+            if not len(train):
+                continue
+            X_train, y_train = self._known_labels(self._weight(X[train], update_idf=True), [labels[n] for n in train])
+            if len(y_train):
+                self.model.partial_fit(X_train, y_train, classes=sorted(self._classes, key=str))
+                self.n_train += len(y_train)
+            logger.info('trained on {} documents'.format(self.n_train))
+
+        self._X_test_counts = vstack(test_counts).tocsr() if test_counts else None
+        return self.model
+
+    def _held_out_batches(self, batchsize=1000):
+        '''Yields (X, y) batches of the documents held out for testing'''
+        if not self.streaming:
+            # the test set is not stored with a saved model (see Analysis.save)
+            if getattr(self, 'X_test', None) is not None:
+                yield self.X_test, self.y_test
+        elif self._training_query:
+            for ids, texts, labels in self._batches(core.database.scroll_query(self._training_query),
+                                                    self.x_field, self.label_field, batchsize):
+                held = [n for n, doc_id in enumerate(ids) if _held_out(doc_id, self.testsize)]
+                if held:
+                    yield self._vectorize([texts[n] for n in held]), [labels[n] for n in held]
+        elif getattr(self, '_X_test_counts', None) is not None:
+            yield self._weight(self._X_test_counts), self.y_test
+
+    def update(self, documents, x_field=None, label_field=None, batchsize=1000, **kwargs):
+        """
+        This method continues training the model on new labeled documents (online learning), using SGDClassifier.partial_fit.\n
+        @param documents: the labeled documents, or an ElasticSearch query returning them
+        @type documents: iterable, or dict
+        @param x_field: The nested field name that contains the text. Defaults to the x_field used in fit.
+        @type x_field: str
+        @param label_field: The nested field name that contains the labels. Defaults to the label_field used in fit.
+        @type label_field: str
+        @param batchsize: The number of documents per partial_fit call. The default is set to 1000.
+        @type batchsize: int
+        """
+        x_field = x_field or self.x_field
+        label_field = label_field or self.label_field
+        if type(documents) == dict:
+            documents = core.database.scroll_query(documents)
+
+        updated = 0
+        for ids, texts, labels in self._batches(documents, x_field, label_field, batchsize):
+            if self.streaming:
+                # keep the test set of the streaming mode out of the training data
+                train = [n for n, doc_id in enumerate(ids) if not _held_out(doc_id, self.testsize)]
+                texts, labels = [texts[n] for n in train], [labels[n] for n in train]
+            if not texts:
+                continue
+            X, labels = self._known_labels(self._vectorize(texts, update_idf=True), labels)
+            if len(labels):
+                self.model.partial_fit(X, labels)
+                updated += len(labels)
+        logger.info('updated the model with {} documents'.format(updated))
+        return updated
+
 
 
     def predict(self, documents = None, x_field=None,  **kwargs):
@@ -149,41 +308,53 @@ class classification(Analysis):
         @type doctype: str
         """
 
-        if documents == None:
-            documents = self.X_test
+        if documents is None:
             logger.info('Since no documents were inputted, this shall run the trained model on the test dataset reserved as 20% of the original labeled example dataset.')
+            predictions = [self.model.predict(X) for X, y in self._held_out_batches()]
+            if not predictions:
+                logger.warning('There are no held-out documents to predict')
+            self.predictions = np.concatenate(predictions) if predictions else np.array([])
+            logger.info('no_of predictions : {}'.format(len(self.predictions)))
+            return (self.predictions)
         else:
             if type(documents[0]) is str:
                 logger.info('It seems that the input documents are a list of strings, proceeding without extracting any specific field')
-                documents = self.vectorizer.transform(documents)
+                documents = self._vectorize(documents)
             elif type(documents[0]) is dict and x_field is not None:
                 logger.info('It seems that the input documents are a list of dicts, extracting the provided x_field')
-                documents = self.vectorizer.transform((core.basic_utils.dotkeys(doc, x_field) for doc in documents))
+                documents = self._vectorize([core.basic_utils.dotkeys(doc, x_field) for doc in documents])
             else:
                 raise Exception('You have to input either nothing, or a list of strings, or a list of dicts together with the x_field')
                 
 
         self.predictions = self.model.predict(documents)
-        print('no_of predictions : ',len(self.predictions))
+        logger.info('no_of predictions : {}'.format(len(self.predictions)))
 
         return (self.predictions)
 
 
 
+    def _predict_texts(self, texts, **kwargs):
+        return self.model.predict(self._vectorize(texts))
+
     def quality(self, **kwargs):
         """
         This method has the functionality to report on the quality of the underlying Classification (trained) model which was created as a         random subset as a proportion of the input documents.\n
         The size of the test set is controlled through the parameter 'testsize' of the fit method of the Classification analyser object.           The default proportion is 0.2, with random shuffle set as True.\n
         It calculates the categorization accuracy, precision, recall and f1-score on the test set of examples.\n
+        In streaming mode, the test set is streamed again from ElasticSearch if the model was trained on a query.\n
 
         """
         #make the test predictions as an attribute.
 
-        test_pred = self.model.predict(self.X_test)
-        self.test_accuracy = accuracy_score(self.y_test, test_pred)
-        self.test_precision = precision_score(self.y_test, test_pred, average = 'macro')
-        self.test_recall = recall_score(self.y_test, test_pred, average = 'macro')
-        self.test_f1score = f1_score(self.y_test, test_pred, average = 'macro')
+        y_test, test_pred = [], []
+        for X, y in self._held_out_batches():
+            y_test.extend(y)
+            test_pred.extend(self.model.predict(X))
+        self.test_accuracy = accuracy_score(y_test, test_pred)
+        self.test_precision = precision_score(y_test, test_pred, average = 'macro')
+        self.test_recall = recall_score(y_test, test_pred, average = 'macro')
+        self.test_f1score = f1_score(y_test, test_pred, average = 'macro')
         print("accuracy on test set: ", self.test_accuracy , "\n Precision on test set: " , self.test_precision , "\n Recall on test set: "
              , self.test_recall , "\n f1score : " , self.test_f1score)
         return ({'accuracy':self.test_accuracy, 
@@ -0,0 +1,170 @@
+'''
+This file contains an analysis to cluster documents (k-means) and to find
+components of co-occurring words (SVD/PCA) on a sparse document-term matrix
+
+'''
+
+import logging
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize as l2_normalize
+from core.analysis_base_class import Analysis
+from analysis._corpus_utils import count_terms, document_term_chunks, make_analyzer
+
+logger = logging.getLogger(__name__)
+
+def varimax(Phi, gamma = 1.0, q = 20, tol = 1e-6):
+    '''Rotates a loading matrix (terms x components), as `rotvarimax` in legacy/analysis.py'''
+    # see http://stackoverflow.com/questions/17628589/perform-varimax-rotation-in-python-using-numpy and http://en.wikipedia.org/wiki/Talk%3aVarimax_rotation
+    p,k = Phi.shape
+    R = np.eye(k)
+    d=0
+    for i in range(q):
+        d_old = d
+        Lambda = np.dot(Phi, R)
+        u,s,vh = np.linalg.svd(np.dot(Phi.T,np.asarray(Lambda)**3 - (gamma/p) * np.dot(Lambda, np.diag(np.diag(np.dot(Lambda.T,Lambda))))))
+        R = np.dot(u,vh)
+        d = np.sum(s)
+        if d_old!=0 and d/d_old < tol: break
+    logger.debug("Component transformation matrix for the rotation: {R}".format(**locals()))
+    return np.dot(Phi, R)
+
+class clustering(Analysis):
+    '''Clusters documents with k-means on a sparse document-term matrix of the
+    most frequent words, and optionally finds components of these words
+
+    Documents are streamed twice: once to find the `n` most frequent words,
+    and once to train MiniBatchKMeans chunk by chunk while accumulating the
+    term x term matrix X.T X. The components are the top eigenvectors of that
+    matrix, which are the same as the components of a TruncatedSVD of X.
+    '''
+
+    _model_state = ['terms', 'vectorizer', 'normalize', 'model', 'cluster_sizes', 'n_docs', 'loadings',
+                    'singular_values']
+
+    def __init__(self):
+        self.terms = None
+        self.model = None
+        self.loadings = None
+
+    def _vectorize(self, texts):
+        X = self.vectorizer.transform(texts).astype(float)
+        if self.normalize:
+            X = l2_normalize(X)
+        return X
+
+    def fit(self, documents, add_prediction='', field='text', n=1000, vocabulary=None, n_clusters=10,
+            components=0, rotate=False, normalize=True, stop_words=None, batchsize=5000, processes=1, **kwargs):
+        """
+        This method clusters the documents matching a query, and optionally writes the cluster ids back to them.\n
+        :param documents: the documents to cluster, as an elasticsearch query (dict) or string query
+        :type documents: dict or str
+        :param add_prediction: if given, the cluster id of each document is stored under this key (see bulk_predict)
+        :type add_prediction: str
+        :param field: the field containing the text
+        :type field: str
+        :param n: the number of most frequent words to use as features
+        :type n: int
+        :param vocabulary: a list of words to use as features instead of the most frequent words
+        :type vocabulary: list
+        :param n_clusters: the number of clusters
+        :type n_clusters: int
+        :param components: the number of components (SVD) to compute, 0 for none
+        :type components: int
+        :param rotate: whether to apply a varimax rotation to the components
+        :type rotate: bool
+        :param normalize: whether to normalize the word counts of each document to unit length
+        :type normalize: bool
+        :param stop_words: words to ignore, 'english' or a list
+        :type stop_words: str or list
+        :param batchsize: the number of documents per chunk, should be larger than n_clusters
+        :type batchsize: int
+        :param processes: the number of processes used to write back cluster ids
+        :type processes: int
+        """
+        self.normalize = normalize
+        analyzer = make_analyzer(stop_words=stop_words)
+        if vocabulary is None:
+            logger.info("Determining the {n} most frequent words".format(**locals()))
+            counter = count_terms(documents, field=field, analyzer=analyzer, batchsize=batchsize)
+            vocabulary = counter.terms()[counter.top(n)]
+        self.terms = np.array(vocabulary, dtype=object)
+        columns = {term:num for num, term in enumerate(self.terms)}
+        self.vectorizer = CountVectorizer(vocabulary=columns, analyzer=analyzer)
+
+        self.model = MiniBatchKMeans(n_clusters=n_clusters, init='k-means++', random_state=42)
+        self.cluster_sizes = np.zeros(n_clusters, dtype=int)
+        self.n_docs = 0
+        gram = np.zeros((len(self.terms), len(self.terms)))
+        for ids, X in document_term_chunks(documents, columns, field=field,
+                                           analyzer=analyzer, batchsize=batchsize):
+            X = X.astype(float)
+            if normalize:
+                X = l2_normalize(X)
+            if components:
+                gram += X.T.dot(X).toarray()
+            if X.shape[0] >= n_clusters:
+                self.model.partial_fit(X)
+                self.cluster_sizes += np.bincount(self.model.labels_, minlength=n_clusters)
+            else:
+                logger.info("skipping k-means update for a chunk of {} documents".format(X.shape[0]))
+            self.n_docs += X.shape[0]
+            logger.info("clustered {self.n_docs} documents".format(**locals()))
+
+        if components:
+            eigenvalues, eigenvectors = np.linalg.eigh(gram)
+            order = np.argsort(eigenvalues)[::-1][:components]
+            self.singular_values = np.sqrt(np.clip(eigenvalues[order], 0, None))
+            self.loadings = eigenvectors[:, order]
+            if rotate:
+                self.loadings = varimax(self.loadings)
+
+        if add_prediction:
+            self.bulk_predict(documents, field, add_prediction, batchsize=batchsize, processes=processes)
+        return self
+
+    def _predict_texts(self, texts, **kwargs):
+        return self.model.predict(self._vectorize(texts))
+
+    def predict(self, documents, add_prediction='', field='text', **kwargs):
+        """
+        This method assigns documents to the clusters found by fit.\n
+        :param documents: the documents (dictionaries) or texts to assign
+        :type documents: list
+        :param add_prediction: if given, the cluster id is added to each document under this key
+        :type add_prediction: str
+        :param field: the field containing the text
+        :type field: str
+        :return: the cluster id of each document
+        """
+        texts = [doc if type(doc) == str else doc.get('_source', doc).get(field, '') for doc in documents]
+        clusters = self._predict_texts(texts)
+        if add_prediction:
+            for doc, cluster in zip(documents, clusters):
+                if type(doc) == dict:
+                    doc[add_prediction] = int(cluster)
+        return clusters
+
+    def transform(self, texts):
+        """Returns the component scores of texts (texts x components)"""
+        return self._vectorize(texts).dot(self.loadings)
+
+    def components(self):
+        """Returns the component loadings of the words as a dataframe (words x components)"""
+        return pd.DataFrame(self.loadings, index=self.terms,
+                            columns=['Comp{}'.format(num+1) for num in range(self.loadings.shape[1])])
+
+    def top_terms(self, top=10):
+        """Returns the words closest to each cluster center"""
+        order_centroids = self.model.cluster_centers_.argsort()[:, ::-1]
+        return {cluster: list(self.terms[order_centroids[cluster, :top]]) for cluster in range(len(order_centroids))}
+
+    def interpretation(self, top=10, **kwargs):
+        """Returns a short report of the cluster sizes and the words closest to each cluster center"""
+        report = "Cluster sizes (during training) of {self.n_docs} documents:\n".format(**locals())
+        for cluster, (count, terms) in enumerate(zip(self.cluster_sizes, self.top_terms(top).values())):
+            report += "Cluster {cluster:3}: {count:8} ({pct:.2f}%)  {words}\n".format(
+                pct=100.*count/max(self.n_docs, 1), words=' '.join(terms), **locals())
+        return report
@@ -0,0 +1,148 @@
+'''
+This file contains an analysis to build word co-occurrence networks from
+documents in elasticsearch
+
+'''
+
+import logging
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from xml.sax.saxutils import quoteattr
+from core.analysis_base_class import Analysis
+from analysis._corpus_utils import count_terms, document_term_chunks, make_analyzer
+
+logger = logging.getLogger(__name__)
+
+class cooccurrence(Analysis):
+    '''Builds a network of the most frequent words, with edges weighted by the
+    number of documents in which two words occur together
+
+    Documents are streamed twice: once to find the `n` most frequent words,
+    and once to accumulate co-occurrences as `X.T @ X` over chunks of a
+    binary document-term matrix restricted to these words.
+    '''
+
+    _model_state = ['terms', 'frequencies', 'matrix', 'n_docs', 'min_edge_weight']
+
+    def __init__(self):
+        self.terms = None
+        self.frequencies = None
+        self.matrix = None
+
+    def fit(self, documents, field='text', n=100, min_edge_weight=1, stop_words=None, ngram_range=(1,1),
+            min_df=1, max_features=100000, batchsize=5000, **kwargs):
+        """
+        This method counts the co-occurrences of the `n` most frequent words in the documents matching a query.\n
+        :param documents: the documents to use, as an elasticsearch query (dict) or string query
+        :type documents: dict or str
+        :param field: the field containing the text
+        :type field: str
+        :param n: the number of most frequent words (nodes) to include
+        :type n: int
+        :param min_edge_weight: the minimum number of documents two words should co-occur in to be connected
+        :type min_edge_weight: int
+        :param stop_words: words to ignore, 'english' or a list
+        :type stop_words: str or list
+        :param ngram_range: the (min, max) number of words per term, e.g. (1,2) to include bigrams
+        :type ngram_range: tuple
+        :param min_df: the minimum number of documents a word should occur in to be included
+        :type min_df: int
+        :param max_features: the maximum number of distinct words kept while counting. Beyond twice this number,\
+                             the least frequent words are dropped (see _corpus_utils.count_terms), so it should be\
+                             well above n. None to keep all words.
+        :type max_features: int
+        :param batchsize: the number of documents per chunk of the document-term matrix
+        :type batchsize: int
+        """
+        self.min_edge_weight = min_edge_weight
+        analyzer = make_analyzer(stop_words=stop_words, ngram_range=ngram_range)
+
+        logger.info("Determining the {n} most frequent words".format(**locals()))
+        counter = count_terms(documents, field=field, analyzer=analyzer, batchsize=batchsize, max_terms=max_features)
+        top = counter.top(n, min_df=min_df)
+        self.terms = counter.terms()[top]
+        self.frequencies = counter.aligned()[top]
+        self.n_docs = counter.n_docs
+
+        logger.info("Determining the co-occurrences of these words")
+        vocabulary = {term:num for num, term in enumerate(self.terms)}
+        self.matrix = sparse.csr_matrix((len(self.terms), len(self.terms)), dtype=np.int64)
+        for ids, X in document_term_chunks(documents, vocabulary, field=field, analyzer=analyzer,
+                                           binary=True, batchsize=batchsize):
+            self.matrix = self.matrix + X.T.dot(X).tocsr()
+        return self
+
+    def edges(self, min_edge_weight=None):
+        """
+        Returns the edges of the network as a dataframe with columns node1, node2 and weight, heaviest first.\n
+        :param min_edge_weight: the minimum weight, defaults to the one given to fit
+        :type min_edge_weight: int
+        """
+        if min_edge_weight is None:
+            min_edge_weight = self.min_edge_weight
+        upper = sparse.triu(self.matrix, k=1).tocoo()
+        keep = upper.data >= max(min_edge_weight, 1)
+        edges = pd.DataFrame({'node1':self.terms[upper.row[keep]],
+                              'node2':self.terms[upper.col[keep]],
+                              'weight':upper.data[keep]}, columns=['node1','node2','weight'])
+        return edges.sort_values('weight', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    def nodes(self, edges=None):
+        """Returns the nodes that have at least one edge as a dataframe with columns name and frequency"""
+        if edges is None:
+            edges = self.edges()
+        connected = set(edges['node1']) | set(edges['node2'])
+        return pd.DataFrame([(term, frequency) for term, frequency in zip(self.terms, self.frequencies)
+                             if term in connected], columns=['name','frequency'])
+
+    def to_gdf(self, filename, min_edge_weight=None):
+        """
+        Writes the network to a GDF file, e.g. for use in Gephi. Node width is the word frequency.\n
+        :param filename: the file to write to
+        :type filename: str
+        """
+        edges = self.edges(min_edge_weight)
+        with open(filename, mode='w', encoding='utf-8') as f:
+            f.write("nodedef>name VARCHAR, width DOUBLE\n")
+            for term, frequency in self.nodes(edges).itertuples(index=False):
+                f.write("{term},{frequency}\n".format(**locals()))
+            f.write("edgedef>node1 VARCHAR,node2 VARCHAR, weight DOUBLE\n")
+            for node1, node2, weight in edges.itertuples(index=False):
+                f.write("{node1},{node2},{weight}\n".format(**locals()))
+        logger.info("Network file written to {filename}".format(**locals()))
+
+    def to_gexf(self, filename, min_edge_weight=None):
+        """
+        Writes the network to a GEXF file, e.g. for use in Gephi. Node size is the word frequency.\n
+        :param filename: the file to write to
+        :type filename: str
+        """
+        edges = self.edges(min_edge_weight)
+        nodes = self.nodes(edges)
+        node_ids = {term:num for num, term in enumerate(nodes['name'])}
+        with open(filename, mode='w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<gexf xmlns="http://www.gexf.net/1.2draft" xmlns:viz="http://www.gexf.net/1.2draft/viz" version="1.2">\n'
+                    '<graph mode="static" defaultedgetype="undirected">\n'
+                    '<attributes class="node"><attribute id="0" title="frequency" type="integer"/></attributes>\n'
+                    '<nodes>\n')
+            for term, frequency in nodes.itertuples(index=False):
+                f.write('<node id="{id}" label={label}><attvalues><attvalue for="0" value="{frequency}"/></attvalues>'
+                        '<viz:size value="{frequency}"/></node>\n'.format(id=node_ids[term], label=quoteattr(str(term)),
+                                                                           frequency=frequency))
+            f.write('</nodes>\n<edges>\n')
+            for num, (node1, node2, weight) in enumerate(edges.itertuples(index=False)):
+                f.write('<edge id="{num}" source="{source}" target="{target}" weight="{weight}"/>\n'.format(
+                    source=node_ids[node1], target=node_ids[node2], **locals()))
+            f.write('</edges>\n</graph>\n</gexf>\n')
+        logger.info("Network file written to {filename}".format(**locals()))
+
+    def interpretation(self, top=10, **kwargs):
+        """Returns a short report of the network and its heaviest edges"""
+        edges = self.edges()
+        report = "Co-occurrence network of {n} words in {self.n_docs} documents, {e} edges with weight >= {self.min_edge_weight}\n".format(
+            n=len(self.nodes(edges)), e=len(edges), **locals())
+        for node1, node2, weight in edges.head(top).itertuples(index=False):
+            report += "{node1:20} - {node2:20} : {weight}\n".format(**locals())
+        return report
@@ -0,0 +1,109 @@
+'''
+This file contains an analysis to compare the word frequencies of two sets
+of documents (keyness), such as the coverage of two outlets
+
+'''
+
+import logging
+import numpy as np
+import pandas as pd
+from scipy.special import xlogy
+from core.analysis_base_class import Analysis
+from analysis._corpus_utils import count_terms, make_analyzer
+
+logger = logging.getLogger(__name__)
+
+PCT_DIFF_ZERO = 1e-18 # stands in for a zero frequency in the %DIFF denominator (Gabrielatos & Marchi, 2012)
+
+class keyness(Analysis):
+    '''Compares term frequencies in the documents matching two queries
+
+    For every term in either corpus, this computes the log-likelihood (G2)
+    and chi-squared statistics of Rayson & Garside (2000), and the log ratio
+    and %DIFF effect sizes, for the whole vocabulary at once.
+    '''
+
+    _model_state = ['table', 'n_docs']
+
+    def __init__(self):
+        self.table = None
+
+    def fit(self, documents, documents2, field='text', stop_words=None, ngram_range=(1,1), batchsize=5000, **kwargs):
+        """
+        This method counts the terms in both corpora and computes keyness statistics.\n
+        :param documents: the first corpus, as an elasticsearch query (dict) or string query
+        :type documents: dict or str
+        :param documents2: the corpus to compare with, as an elasticsearch query (dict) or string query
+        :type documents2: dict or str
+        :param field: the field containing the text
+        :type field: str
+        :param stop_words: words to ignore, 'english' or a list
+        :type stop_words: str or list
+        :param ngram_range: the (min, max) number of words per term, e.g. (1,2) to include bigrams
+        :type ngram_range: tuple
+        :param batchsize: the number of documents counted at once
+        :type batchsize: int
+        :return: a dataframe with a row per term, see results
+        """
+        analyzer = make_analyzer(stop_words=stop_words, ngram_range=ngram_range)
+        vocabulary = {}
+        corpus1 = count_terms(documents, field=field, analyzer=analyzer, vocabulary=vocabulary, batchsize=batchsize)
+        corpus2 = count_terms(documents2, field=field, analyzer=analyzer, vocabulary=vocabulary, batchsize=batchsize)
+        self.n_docs = (corpus1.n_docs, corpus2.n_docs)
+
+        # terminology of Rayson & Garside: a and b are the frequencies of a term,
+        # c and d the number of words in corpus 1 and 2
+        a = corpus1.aligned().astype(float)
+        b = corpus2.aligned().astype(float)
+        c = float(corpus1.n_tokens)
+        d = float(corpus2.n_tokens)
+        if not c or not d:
+            logger.warning("At least one of the corpora is empty")
+            self.table = pd.DataFrame()
+            return self.table
+
+        e1 = c * (a + b) / (c + d)
+        e2 = d * (a + b) / (c + d)
+        ll = 2 * (xlogy(a, a / e1) + xlogy(b, b / e2))
+        # chi2 is undefined for a term that is all of both corpora (or in neither), these are ranked last
+        denominator = (a + b) * (c + d - a - b) * c * d
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chi2 = np.where(denominator > 0, (c + d) * (a * (d - b) - b * (c - a)) ** 2 / denominator, np.nan)
+        log_ratio = np.log2((np.where(a > 0, a, .5) / c) / (np.where(b > 0, b, .5) / d))
+        pct_diff = 100 * (a / c - b / d) / np.where(b > 0, b / d, PCT_DIFF_ZERO)
+
+        self.table = pd.DataFrame({'term':corpus1.terms(), 'freqcorp1':a.astype(int), 'expectedcorp1':e1,
+                                   'freqcorp2':b.astype(int), 'expectedcorp2':e2, 'll':ll, 'chi2':chi2,
+                                   'log_ratio':log_ratio, 'pct_diff':pct_diff, 'overrepresented':a > e1},
+                                  columns=['term','freqcorp1','expectedcorp1','freqcorp2','expectedcorp2',
+                                           'll','chi2','log_ratio','pct_diff','overrepresented'])
+        self.table = self.table.sort_values(['ll','term'], ascending=False).reset_index(drop=True)
+        return self.table
+
+    def results(self, sort_by='ll', min_frequency=0, overrepresented_only=False):
+        """
+        Returns the keyness statistics per term.\n
+        :param sort_by: the column to sort by (descending): 'll', 'chi2', 'log_ratio' or 'pct_diff'. Terms without\
+                        a value (chi2 of a term that makes up both corpora) come last.
+        :type sort_by: str
+        :param min_frequency: only include terms occurring at least this often in both corpora together
+        :type min_frequency: int
+        :param overrepresented_only: only include terms that are more frequent than expected in the first corpus
+        :type overrepresented_only: bool
+        """
+        table = self.table[(self.table['freqcorp1'] + self.table['freqcorp2']) >= min_frequency]
+        if overrepresented_only:
+            table = table[table['overrepresented']]
+        return table.sort_values(sort_by, ascending=False, kind='mergesort', na_position='last').reset_index(drop=True)
+
+    def to_csv(self, filename, **kwargs):
+        """Writes the results (see results for the options) to a csv file"""
+        self.results(**kwargs).to_csv(filename, index=False, encoding='utf-8')
+        logger.info("Output written to {filename}".format(**locals()))
+
+    def interpretation(self, top=20, **kwargs):
+        """Returns a short report with the terms most characteristic of the first corpus"""
+        report = "Keyness of {self.n_docs[0]} versus {self.n_docs[1]} documents, {n} terms\n".format(n=len(self.table), **locals())
+        for row in self.results(overrepresented_only=True).head(top).itertuples(index=False):
+            report += "{row.term:20} LL {row.ll:10.2f}  log ratio {row.log_ratio:6.2f}  ({row.freqcorp1} vs {row.freqcorp2})\n".format(**locals())
+        return report
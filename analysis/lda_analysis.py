@@ -36,6 +36,8 @@ def create_corpus(documents, field='text', normalizing='lemmatize'):
 
 class Lda(Analysis):
 
+    _model_state = ['lda', 'vocabulary', 'times_fitted', 'nb_docs_trained', 'selected_clusters']
+
     def __init__(self):
         self.times_fitted = 0
         self.corpus = None
@@ -79,9 +81,15 @@ class Lda(Analysis):
     def predict(self, documents, add_prediction='', field='text'):
         docs_lda = []
         for doc in documents:
-            docs_lda.append(self.lda[get_bow(extract_data(doc, field=field), self.corpus)])
+            docs_lda.append(self.lda[self.vocabulary.doc2bow(list(generate_word(extract_data(doc, field=field))))])
             if add_prediction != '':
                 doc[add_prediction] = str(docs_lda[-1])
+        return docs_lda
+
+    def _predict_texts(self, texts, **kwargs):
+        """Returns the topic distribution of each text as a list of {'topic', 'probability'} dictionaries"""
+        return [[{'topic': int(topic), 'probability': float(probability)} for topic, probability in
+                 self.lda[self.vocabulary.doc2bow(list(generate_word(text)))]] for text in texts]
 
     def update(self, documents, field='text'):
         pass
@@ -0,0 +1,91 @@
+'''
+TESTS FOR classification_analysis
+'''
+import numpy as np
+import pytest
+import core.database
+from core import analysis_base_class
+from analysis import classification_analysis
+from analysis.classification_analysis import classification, _held_out
+
+WORDS = {'sport':['goal', 'match', 'team', 'score', 'league'], 'politics':['vote', 'party', 'minister', 'law', 'election']}
+
+def make_documents(n, seed=0, start=0):
+    generator = np.random.RandomState(seed)
+    documents = []
+    for num in range(start, start + n):
+        label = sorted(WORDS)[num % 2]
+        documents.append({'_id':'doc%d' %num, '_source':{'label':label,
+                          'text':' '.join(generator.choice(WORDS[label], 6))}})
+    return documents
+
+@pytest.fixture
+def corpus(monkeypatch):
+    documents = make_documents(400)
+    queries = []
+    def scroll_query(query):
+        queries.append(query)
+        return iter(documents)
+    monkeypatch.setattr(core.database, 'scroll_query', scroll_query)
+    return documents
+
+def fit_streaming(documents, **kwargs):
+    model = classification()
+    model.fit(documents, '_source.text', '_source.label', streaming=True, batchsize=50,
+              n_features=2**10, classes=sorted(WORDS), **kwargs)
+    return model
+
+def test_held_out_split():
+    ids = ['doc%d' %num for num in range(2000)]
+    held = [doc_id for doc_id in ids if _held_out(doc_id, .2)]
+    assert held == [doc_id for doc_id in ids if _held_out(doc_id, .2)]
+    assert .15 < len(held) / len(ids) < .25
+    assert not any(_held_out(doc_id, 0) for doc_id in ids)
+
+def test_streaming_split_is_disjoint(corpus, monkeypatch):
+    trained = []
+    partial_fit = classification_analysis.SGDClassifier.partial_fit
+    def record(self, X, y, **kwargs):
+        trained.append(X.shape[0])
+        return partial_fit(self, X, y, **kwargs)
+    monkeypatch.setattr(classification_analysis.SGDClassifier, 'partial_fit', record)
+    held = {doc['_id'] for doc in corpus if _held_out(doc['_id'], .2)}
+    for documents in (corpus, {'query':{'match_all':{}}}):
+        model = fit_streaming(documents)
+        assert model.n_train == sum(trained) == len(corpus) - len(held)
+        tested = [len(y) for X, y in model._held_out_batches()]
+        assert sum(tested) == len(held)
+        trained[:] = []
+    # the held-out documents are left out when updating
+    assert model.update(corpus) == len(corpus) - len(held)
+    assert model.quality()['accuracy'] > .9
+
+def test_update_changes_predictions(corpus):
+    model = fit_streaming(corpus[:40])
+    texts = [doc['_source']['text'] for doc in make_documents(20, seed=1)]
+    before = model.predict(texts)
+    weights = model.model.coef_.copy()
+    # new evidence contradicting the labels so far
+    swapped = [dict(doc, _source=dict(doc['_source'], label='politics' if doc['_source']['label'] == 'sport' else 'sport'))
+               for doc in make_documents(400, seed=2, start=1000)]
+    assert model.update(swapped, batchsize=50) > 0
+    assert not np.allclose(model.model.coef_, weights)
+    assert list(model.predict(texts)) != list(before)
+
+def test_no_held_out_documents(corpus):
+    model = fit_streaming(corpus, testsize=0)
+    predictions = model.predict()
+    assert len(predictions) == 0
+    assert model.model.predict(model._vectorize(['goal match'])) == ['sport']
+
+def test_save_and_load(corpus, tmpdir, monkeypatch):
+    monkeypatch.setattr(analysis_base_class, 'MODELPATH', str(tmpdir))
+    monkeypatch.setattr(analysis_base_class, '_loaded_models', {})
+    model = fit_streaming(corpus)
+    model.save('topics')
+    loaded = classification.load('topics', mmap=False)
+    # the held-out counts of the training documents are not stored
+    assert not hasattr(loaded, '_X_test_counts')
+    texts = [doc['_source']['text'] for doc in make_documents(20, seed=1)]
+    assert list(loaded.predict(texts)) == list(model.predict(texts))
+    assert loaded.update(corpus[:100]) > 0
@@ -0,0 +1,79 @@
+'''
+TESTS FOR clustering_analysis
+'''
+import random
+import numpy as np
+import pytest
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+import core.database
+from core import analysis_base_class
+from analysis.clustering_analysis import clustering
+
+TOPICS = [['goal', 'match', 'team', 'score', 'league', 'coach'],
+          ['vote', 'party', 'minister', 'law', 'election', 'senate']]
+
+def make_texts(n, seed=42):
+    generator = random.Random(seed)
+    return [' '.join(generator.choices(TOPICS[num % 2], k=generator.randint(3, 10))) for num in range(n)]
+
+@pytest.fixture
+def corpus(monkeypatch):
+    corpus = {'texts':make_texts(230)}
+    def scroll_query(query):
+        for num, text in enumerate(corpus['texts']):
+            yield {'_id':num, '_type':'news', '_source':{'text':text}}
+    monkeypatch.setattr(core.database, 'scroll_query', scroll_query)
+    return corpus
+
+def test_clusters(corpus):
+    model = clustering().fit('*', n=20, n_clusters=2, batchsize=50)
+    assert sorted(model.terms) == sorted(TOPICS[0] + TOPICS[1])
+    assert model.n_docs == 230
+    assert model.cluster_sizes.sum() == 230
+    # the topics are separated
+    clusters = model.predict(corpus['texts'])
+    assert len(set(clusters[0::2])) == len(set(clusters[1::2])) == 1
+    assert clusters[0] != clusters[1]
+    assert sorted(model.cluster_sizes) == [115, 115]
+    assert set(model.top_terms(6)[clusters[0]]) == set(TOPICS[0])
+    documents = [{'_source':{'text':text}} for text in corpus['texts'][:2]]
+    assert list(model.predict(documents, add_prediction='cluster')) == list(clusters[:2])
+    assert documents[1]['cluster'] == clusters[1]
+    assert '230 documents' in model.interpretation()
+
+def test_small_chunks_are_skipped(corpus):
+    corpus['texts'] = make_texts(203)
+    model = clustering().fit('*', n=20, n_clusters=4, batchsize=50)
+    # the last chunk has fewer documents than clusters
+    assert model.n_docs == 203
+    assert model.cluster_sizes.sum() == 200
+
+@pytest.mark.parametrize('normalized', [True, False])
+def test_components_same_as_svd(corpus, normalized):
+    model = clustering().fit('*', n=20, n_clusters=2, components=3, normalize=normalized, batchsize=50)
+    X = CountVectorizer(vocabulary=list(model.terms)).transform(corpus['texts']).astype(float)
+    if normalized:
+        X = normalize(X)
+    svd = TruncatedSVD(n_components=3, algorithm='arpack').fit(X)
+    assert model.singular_values == pytest.approx(svd.singular_values_)
+    # components are only defined up to their sign
+    for loading, component in zip(model.loadings.T, svd.components_):
+        assert np.abs(loading) == pytest.approx(np.abs(component), abs=1e-6)
+    assert model.transform(corpus['texts'][:5]).shape == (5, 3)
+    assert list(model.components().columns) == ['Comp1', 'Comp2', 'Comp3']
+
+def test_rotated_components(corpus):
+    model = clustering().fit('*', n=20, n_clusters=2, components=2, rotate=True, batchsize=50)
+    # a rotation keeps the loadings orthonormal
+    assert model.loadings.T.dot(model.loadings) == pytest.approx(np.eye(2), abs=1e-6)
+
+def test_save_and_load(corpus, tmpdir, monkeypatch):
+    monkeypatch.setattr(analysis_base_class, 'MODELPATH', str(tmpdir))
+    monkeypatch.setattr(analysis_base_class, '_loaded_models', {})
+    model = clustering().fit('*', n=20, n_clusters=2, components=2, batchsize=50)
+    model.save('topics')
+    loaded = clustering.load('topics')
+    assert list(loaded.predict(corpus['texts'])) == list(model.predict(corpus['texts']))
+    assert loaded.transform(corpus['texts'][:3]) == pytest.approx(model.transform(corpus['texts'][:3]))
@@ -0,0 +1,111 @@
+'''
+TESTS FOR cooccurrence_analysis
+'''
+import random
+import xml.etree.ElementTree as ET
+import numpy as np
+import pytest
+import core.database
+from analysis import _corpus_utils
+from analysis.cooccurrence_analysis import cooccurrence
+
+WORDS = ['trump', 'clinton', 'election', 'vote', 'wall', 'debate', 'poll', 'media', 'campaign', 'rally',
+         'tax', 'border', 'email', 'senate', 'court']
+
+def make_texts(n=300, seed=42):
+    generator = random.Random(seed)
+    # some words are far more frequent than others
+    weights = [1. / (rank + 1) for rank in range(len(WORDS))]
+    return [' '.join(generator.choices(WORDS, weights, k=generator.randint(0, 8))) for i in range(n)]
+
+@pytest.fixture
+def texts(monkeypatch):
+    texts = make_texts()
+    def scroll_query(query):
+        for num, text in enumerate(texts):
+            yield {'_id':num, '_source':{'text':text}}
+    monkeypatch.setattr(core.database, 'scroll_query', scroll_query)
+    return texts
+
+def reference(texts, terms):
+    '''The co-occurrences of terms as a dense matrix, counted document by document'''
+    columns = {term:num for num, term in enumerate(terms)}
+    matrix = np.zeros((len(terms), len(terms)), dtype=int)
+    for text in texts:
+        present = sorted({columns[word] for word in text.split() if word in columns})
+        for i in present:
+            for j in present:
+                matrix[i, j] += 1
+    return matrix
+
+@pytest.mark.parametrize('batchsize', [7, 1000])
+def test_same_as_dense(texts, batchsize):
+    network = cooccurrence().fit('*', n=10, batchsize=batchsize)
+    frequencies = {word:sum(text.split().count(word) for text in texts) for word in WORDS}
+    # the most frequent words (in any order if they are equally frequent)
+    assert list(network.frequencies) == sorted(frequencies.values(), reverse=True)[:10]
+    assert list(network.frequencies) == [frequencies[word] for word in network.terms]
+    assert network.n_docs == sum(1 for text in texts if text)
+    assert (network.matrix.toarray() == reference(texts, network.terms)).all()
+
+def test_edges_and_nodes(texts):
+    network = cooccurrence().fit('*', n=10, min_edge_weight=5)
+    matrix = reference(texts, network.terms)
+    edges = network.edges()
+    assert list(edges['weight']) == sorted(edges['weight'], reverse=True)
+    assert len(edges) == sum(matrix[i, j] >= 5 for i in range(10) for j in range(i + 1, 10))
+    terms = list(network.terms)
+    for node1, node2, weight in edges.itertuples(index=False):
+        assert matrix[terms.index(node1), terms.index(node2)] == weight
+    assert len(network.edges(min_edge_weight=1000)) == 0
+    assert set(network.nodes()['name']) == set(edges['node1']) | set(edges['node2'])
+
+def test_gdf(texts, tmpdir):
+    network = cooccurrence().fit('*', n=5)
+    filename = str(tmpdir.join('network.gdf'))
+    network.to_gdf(filename)
+    with open(filename) as fileobj:
+        lines = fileobj.read().splitlines()
+    edgedef = lines.index("edgedef>node1 VARCHAR,node2 VARCHAR, weight DOUBLE")
+    assert lines[0] == "nodedef>name VARCHAR, width DOUBLE"
+    nodes = [line.split(',') for line in lines[1:edgedef]]
+    edges = [line.split(',') for line in lines[edgedef + 1:]]
+    assert [name for name, width in nodes] == list(network.nodes()['name'])
+    assert [int(width) for name, width in nodes] == list(network.nodes()['frequency'])
+    assert edges == [[node1, node2, str(weight)] for node1, node2, weight in network.edges().itertuples(index=False)]
+
+def test_gexf(texts, tmpdir):
+    network = cooccurrence().fit('*', n=5)
+    filename = str(tmpdir.join('network.gexf'))
+    network.to_gexf(filename)
+    namespace = {'gexf':'http://www.gexf.net/1.2draft'}
+    graph = ET.parse(filename).getroot().find('gexf:graph', namespace)
+    nodes = {node.get('id'):node.get('label') for node in graph.iterfind('gexf:nodes/gexf:node', namespace)}
+    edges = [(nodes[edge.get('source')], nodes[edge.get('target')], int(edge.get('weight')))
+             for edge in graph.iterfind('gexf:edges/gexf:edge', namespace)]
+    assert sorted(nodes.values()) == sorted(network.nodes()['name'])
+    assert edges == list(network.edges().itertuples(index=False, name=None))
+
+def test_min_df(texts):
+    network = cooccurrence().fit('*', n=len(WORDS), min_df=20)
+    doc_frequencies = {word:sum(word in text.split() for text in texts) for word in WORDS}
+    assert set(network.terms) == {word for word in WORDS if doc_frequencies[word] >= 20}
+
+def test_bounded_vocabulary(texts, monkeypatch):
+    sizes = []
+    update = _corpus_utils.TermCounter.update
+    def record(self, texts):
+        update(self, texts)
+        sizes.append(len(self.vocabulary))
+        return self
+    monkeypatch.setattr(_corpus_utils.TermCounter, 'update', record)
+    network = cooccurrence().fit('*', n=4, ngram_range=(1,2), max_features=20, batchsize=10)
+    # the vocabulary is pruned to 20 terms once it holds more than 40
+    assert max(sizes) <= 40 + 10 * 8 * 2
+    assert len(sizes) > 1
+    # the counts of the most frequent terms are exact
+    exact = cooccurrence().fit('*', n=4, ngram_range=(1,2), max_features=None)
+    assert dict(zip(network.terms, network.frequencies)) == dict(zip(exact.terms, exact.frequencies))
+    assert network.edges().to_dict('records') == exact.edges().to_dict('records')
+    with pytest.raises(ValueError):
+        _corpus_utils.count_terms('*', vocabulary={}, max_terms=10)
@@ -0,0 +1,77 @@
+'''
+TESTS FOR keyness_analysis
+'''
+import math
+import numpy as np
+import pytest
+from scipy.stats import chi2_contingency
+import core.database
+from analysis.keyness_analysis import keyness
+
+CORPORA = {
+    'outlet1' : ['Trump wins the election', 'Trump and the wall', 'the election results are in',
+                 'only in corpus one'],
+    'outlet2' : ['Clinton wins the popular vote', 'the election results', 'Clinton concedes the election'],
+}
+
+@pytest.fixture
+def documents(monkeypatch):
+    def scroll_query(query):
+        for num, text in enumerate(CORPORA[query['query']['query_string']['query']]):
+            yield {'_id':num, '_source':{'text':text}}
+    monkeypatch.setattr(core.database, 'scroll_query', scroll_query)
+
+def legacy_ll(a, b, c, d):
+    '''The log-likelihood of Rayson & Garside (2000), as in the original script'''
+    e1 = c * (a + b) / (c + d)
+    e2 = d * (a + b) / (c + d)
+    ll = 0
+    if a: ll += a * math.log(a / e1)
+    if b: ll += b * math.log(b / e2)
+    return 2 * ll
+
+def test_statistics(documents):
+    table = keyness().fit('outlet1', 'outlet2')
+    c = sum(len(text.split()) for text in CORPORA['outlet1'])
+    d = sum(len(text.split()) for text in CORPORA['outlet2'])
+    assert set(table['term']) == {word.lower() for texts in CORPORA.values() for text in texts for word in text.split()}
+    for row in table.itertuples():
+        a, b = row.freqcorp1, row.freqcorp2
+        assert row.ll == pytest.approx(legacy_ll(a, b, c, d))
+        assert row.expectedcorp1 == pytest.approx(c * (a + b) / (c + d))
+        assert row.overrepresented == (a > c * (a + b) / (c + d))
+        statistic = chi2_contingency([[a, b], [c - a, d - b]], correction=False)[0]
+        assert row.chi2 == pytest.approx(statistic)
+    assert list(table['ll']) == sorted(table['ll'], reverse=True)
+
+def test_results(documents):
+    analysis = keyness()
+    analysis.fit('outlet1', 'outlet2')
+    top = analysis.results(overrepresented_only=True)
+    assert top['term'][0] == 'trump'
+    assert top['overrepresented'].all()
+    assert (analysis.results(min_frequency=3)['freqcorp1'] + analysis.results(min_frequency=3)['freqcorp2'] >= 3).all()
+    assert 'trump' in analysis.interpretation()
+
+def test_undefined_chi2(monkeypatch):
+    # 'the' makes up both corpora, so chi2 is undefined for it
+    corpora = {'outlet1':['the', 'the'], 'outlet2':['the']}
+    def scroll_query(query):
+        for num, text in enumerate(corpora[query['query']['query_string']['query']]):
+            yield {'_id':num, '_source':{'text':text}}
+    monkeypatch.setattr(core.database, 'scroll_query', scroll_query)
+    analysis = keyness()
+    table = analysis.fit('outlet1', 'outlet2')
+    assert list(table['term']) == ['the']
+    assert np.isnan(table['chi2'][0])
+    assert table['ll'][0] == 0
+
+def test_ranking_with_undefined_values(documents):
+    analysis = keyness()
+    analysis.fit('outlet1', 'outlet2')
+    analysis.table.loc[analysis.table['term'] == 'the', 'chi2'] = np.nan
+    assert analysis.results(sort_by='chi2')['term'].iloc[-1] == 'the'
+
+def test_empty_corpus(monkeypatch):
+    monkeypatch.setattr(core.database, 'scroll_query', lambda query: iter([]))
+    assert keyness().fit('outlet1', 'outlet2').empty
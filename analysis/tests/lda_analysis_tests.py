@@ -0,0 +1,35 @@
+'''
+TESTS FOR lda_analysis
+'''
+import pytest
+try:
+    from analysis import lda_analysis
+except (ImportError, LookupError) as e: # gensim, nltk or its stopwords are not installed
+    pytest.skip(str(e), allow_module_level=True)
+
+TEXTS = ['goal match team score'] * 10 + ['vote party minister law'] * 10
+
+@pytest.fixture
+def model(monkeypatch):
+    # no lemmatization, which needs the wordnet data of nltk
+    monkeypatch.setattr(lda_analysis, 'generate_word', lambda text, normalize=None: iter(text.split()))
+    model = lda_analysis.Lda()
+    model.fit([{'text':text} for text in TEXTS], nb_topics=2)
+    return model
+
+def test_predict_texts(model):
+    predictions = model._predict_texts(['goal match', 'vote party', ''])
+    assert len(predictions) == 3
+    for prediction in predictions[:2]:
+        assert {topic['topic'] for topic in prediction} <= {0, 1}
+        assert sum(topic['probability'] for topic in prediction) == pytest.approx(1, abs=.02)
+        assert all(type(topic['topic']) is int and type(topic['probability']) is float for topic in prediction)
+
+def test_predict(model):
+    documents = [{'text':'goal match'}, {'text':'vote party'}]
+    predictions = model.predict(documents, add_prediction='topics')
+    # inference starts at a random point, so probabilities differ slightly between calls
+    expected = model._predict_texts(['goal match', 'vote party'])
+    assert [[(topic, pytest.approx(probability, abs=.01)) for topic, probability in prediction] for prediction in predictions] == \
+           [[(topic['topic'], topic['probability']) for topic in prediction] for prediction in expected]
+    assert documents[0]['topics'] == str(predictions[0])
@@ -0,0 +1,97 @@
+'''
+TESTS FOR the timeline store in timeline_analysis
+'''
+import pytest
+from analysis import timeline_analysis
+
+DAY   = 24 * 60 * 60 * 1000 # in milliseconds
+START = 1483228800000       # 2017-01-01
+
+def bucket(day, count):
+    return {'key':START + day * DAY, 'key_as_string':'2017-01-%02dT00:00:00.000Z' %(day + 1), 'doc_count':count,
+            'metric':{'value':count / 2.}}
+
+class _client():
+    '''Answers timeline queries with the buckets in `counts`, {query : {day : count}}'''
+
+    def __init__(self):
+        self.counts = {}
+        self.searches = []
+
+    def msearch(self, body):
+        responses = []
+        for query in body[1::2]:
+            self.searches.append(query)
+            must = query['query']['bool']['must']
+            since = [clause['range']['META.ADDED'].get('gte') for clause in must if 'range' in clause]
+            counts = self.counts.get(must[0]['query_string']['query'], {})
+            buckets = [bucket(day, count) for day, count in sorted(counts.items())
+                       if not since or START + day * DAY >= since[0]]
+            responses.append({'hits':{'total':sum(counts.values())},
+                              'aggregations':{'timeline':{'buckets':buckets}}})
+        return {'responses':responses}
+
+@pytest.fixture
+def client(monkeypatch):
+    client = _client()
+    monkeypatch.setattr(timeline_analysis, 'client', client)
+    monkeypatch.setattr(timeline_analysis, 'index_fingerprint', lambda: None)
+    return client
+
+def test_register(client, tmpdir):
+    store = timeline_analysis.timeline_store(str(tmpdir))
+    series_id = store.register('trump', 'META.ADDED', granularity='day')
+    assert store.register('trump', 'META.ADDED', granularity='day') == series_id
+    assert store.register('clinton', 'META.ADDED', granularity='day') != series_id
+    assert sorted(series['query'] for series in store.list()) == ['clinton', 'trump']
+    store.remove(series_id)
+    assert [series['query'] for series in store.list()] == ['clinton']
+
+def test_round_trip(client, tmpdir):
+    client.counts = {'trump':{0:3, 1:5, 3:1}, 'clinton':{1:2, 2:4}}
+    store = timeline_analysis.timeline_store(str(tmpdir))
+    series = [store.register(q, 'META.ADDED', granularity='day') for q in ['trump', 'clinton']]
+    stored = store.get(series)
+    direct = timeline_analysis.timeline_generator().analyse(['trump', 'clinton'], 'META.ADDED',
+                                                             granularity='day', use_cache=False)
+    assert stored.equals(direct)
+    assert list(stored.iloc[:, 1]) == [3, 5, 0, 1]
+    assert list(stored.iloc[:, 2]) == [0, 2, 4, 0]
+
+    # a new store on the same path reads the stored buckets
+    again = timeline_analysis.timeline_store(str(tmpdir)).get(series, refresh=False)
+    assert again.equals(stored)
+
+def test_incremental_refresh(client, tmpdir):
+    client.counts = {'trump':{0:3, 1:5}}
+    store = timeline_analysis.timeline_store(str(tmpdir))
+    series_id = store.register('trump', 'META.ADDED', granularity='day')
+    assert store.refresh() == 2
+
+    # the last bucket was incomplete, and a new one was added
+    client.counts = {'trump':{0:3, 1:7, 2:2}}
+    assert store.refresh(series_id) == 2
+    assert client.searches[-1]['query']['bool']['must'][-1] == \
+        {'range':{'META.ADDED':{'gte':START + DAY, 'format':'epoch_millis'}}}
+    assert list(store.get(series_id, refresh=False).iloc[:, 1]) == [3, 7, 2]
+
+    # documents added before the last stored bucket only show up after a full refresh
+    client.counts = {'trump':{0:4, 1:7, 2:2}}
+    store.refresh(series_id)
+    assert list(store.get(series_id, refresh=False).iloc[:, 1]) == [3, 7, 2]
+    store.refresh(series_id, full=True)
+    assert list(store.get(series_id, refresh=False).iloc[:, 1]) == [4, 7, 2]
+
+def test_metrics_and_time_range(client, tmpdir):
+    client.counts = {'trump':{0:3, 1:5, 2:1}}
+    store = timeline_analysis.timeline_store(str(tmpdir))
+    series_id = store.register('trump', 'META.ADDED', granularity='day', querytype='avg', field='length')
+    result = store.get(series_id, from_time='2017-01-02', to_time='2017-01-03')
+    assert list(result['timestamp']) == ['2017-01-02T00:00:00.000Z', '2017-01-03T00:00:00.000Z']
+    assert list(result.iloc[:, 1]) == [2.5, 0.5]
+    assert client.searches[0]['aggs']['timeline']['aggs'] == {'metric':{'avg':{'field':'length'}}}
+
+def test_unknown_series(client, tmpdir):
+    store = timeline_analysis.timeline_store(str(tmpdir))
+    with pytest.raises(KeyError):
+        store.get('unknown')
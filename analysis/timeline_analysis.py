@@ -3,19 +3,83 @@ This file contains the basics to generate timelines
 
 '''
 
+import json
+import os
+import hashlib
+import datetime
 import pandas
 import numpy
-from core.database import client, elastic_index
+from core.database import client, elastic_index, index_fingerprint, config
 import logging
 
 logger = logging.getLogger(__name__)
 
+_MAX_CACHE_SIZE = 100
+
 class timeline_generator():
-    '''Generates timelines from elasticsearch string queries'''
+    '''Generates timelines from elasticsearch string queries
+
+    All queries are sent to elasticsearch in a single `msearch` request.
+    Results are cached per set of arguments for as long as no documents are
+    added to or removed from the index.
+    '''
+
+    _cache = {}
+
+    def _build_query(self, query, timefield, granularity, querytype, field,
+                     from_time=None, to_time=None, filter=None, time_format=None):
+        '''returns the elasticsearch query for a single timeline'''
+        # basic elastic query to select documents for each timeseries
+        elastic_query = {'size':0,
+                         'query':{"bool": { 'must': [ {'query_string':{'query':query}}]}},
+                         'aggs':{'timeline' : {"date_histogram": {
+                             "field":timefield,
+                             "interval":granularity
+                         } }}}
+        if querytype!="count":
+            elastic_query['aggs']['timeline'].update(
+                {"aggs": {
+                "metric": {
+                    querytype: {
+                        "field": field
+                    }
+                }
+            }}
+            )
+
+        # apply filter if specified
+        if type(filter)==str:
+            elastic_query['query']['bool']['must'].append({'query_string':{'query':filter}})
+        elif type(filter)==dict:
+            elastic_query['query']['bool']['must'].append({"match":filter})
+
+        # add time range if from or to time is specified
+        if from_time or to_time:
+            time_range = {timefield:{}}
+            if from_time : time_range[timefield].update({ 'gte' : from_time })
+            if to_time   : time_range[timefield].update({ 'lte' : to_time   })
+            if time_format : time_range[timefield].update({ 'format' : time_format })
+            elastic_query['query']['bool']['must'].append({'range':time_range})
+
+        return elastic_query
+
+    def _parse_buckets(self, response, querytype):
+        '''returns the buckets of a single response as {key : (timestamp, value)}'''
+        buckets = response.get('aggregations',{}).get('timeline',{}).get('buckets',[])
+        if querytype=='count':
+            return {b['key']:(b['key_as_string'], b['doc_count']) for b in buckets}
+        return {b['key']:(b['key_as_string'], b['metric']['value']) for b in buckets}
 
     def analyse(self, queries, timefield, granularity="week", querytype="count", field=None,
-                from_time=None, to_time=None, filter=None):
-        '''returns a pandas dataframe '''
+                from_time=None, to_time=None, filter=None, use_cache=True):
+        '''returns a pandas dataframe with a timestamp column and a column per query
+
+        Parameters
+        ----
+        use_cache : bool (default=True)
+            Whether to re-use the result of an earlier call with the same
+            arguments if the index did not change in between
+        '''
         if type(queries)==str:
             queries = [queries]
         if type(querytype)==str:
@@ -26,85 +90,245 @@ class timeline_generator():
         assert len(queries)==len(querytype), "there should be one querytype for each query"
         if field: assert len(queries)==len(field), "if specified, there should be a field for each query"
 
-        target_dataframe = False
-        prepend = []
+        cache_key = json.dumps([queries, timefield, granularity, querytype, field,
+                                from_time, to_time, filter], sort_keys=True, default=str)
+        if use_cache:
+            fingerprint = index_fingerprint()
+            cached = self._cache.get(cache_key)
+            if cached and cached[0]==fingerprint:
+                logger.debug("returning cached timeline")
+                return cached[1].copy()
 
-        for num, q, qt, f in zip(range(len(queries)),queries, querytype, field):
-            logger.debug(num,q,qt,f)
-            if qt!='count' and not field:
+        search_body = []
+        for q, qt, f in zip(queries, querytype, field):
+            if qt!='count' and not f:
                 logger.info("metrics require a field to which the metric should be applied!,"
                             "which field should be {qt}-ed".format(**locals()))
+            search_body.append({'index':elastic_index})
+            search_body.append(self._build_query(q, timefield, granularity, qt, f,
+                                                 from_time, to_time, filter))
+        logger.debug("elastic queries = {search_body}".format(**locals()))
+        responses = client.msearch(body=search_body)['responses']
 
-            # basic elastic query to select documents for each timeseries
-            elastic_query = {'query':{"bool": { 'must': [ {'query_string':{'query':q}}]}},
-                             'aggs':{'timeline' : {"date_histogram": {
-                                 "field":timefield,
-                                 "interval":granularity
-                             } }}}
-            if qt!="count":
-                elastic_query['aggs']['timeline'].update(
-                    {"aggs": {
-                    "metric": {
-                        qt: {
-                            "field": f
-                        }
-                    }
-                }}
-                )
+        failed = False
+        timestamps = {}
+        columns = []
+        for num, q, qt, response in zip(range(len(queries)), queries, querytype, responses):
+            if 'error' in response:
+                logger.warning("query {q} failed: {response[error]}".format(**locals()))
+                failed = True
+                buckets = {}
+            else:
+                logger.debug("found {response[hits][total]} results in total".format(**locals()))
+                buckets = self._parse_buckets(response, qt)
+            timestamps.update({key:bucket[0] for key, bucket in buckets.items()})
+            num +=1
+            longer = len(q)>10 and '...' or '   '
+            new_name = "{num}. {q:.10}{longer}".format(**locals())
+            columns.append(pandas.Series({key:bucket[1] for key, bucket in buckets.items()},
+                                         name=new_name, dtype=float))
 
+        if timestamps:
+            keys = sorted(timestamps)
+            target_dataframe = pandas.concat([column.reindex(keys) for column in columns], axis=1)
+            target_dataframe = target_dataframe.replace(numpy.nan, 0)
+            for column, qt in zip(columns, querytype):
+                if qt=='count':
+                    target_dataframe[column.name] = target_dataframe[column.name].astype(int)
+            target_dataframe.insert(0, 'timestamp', [timestamps[key] for key in keys])
+            target_dataframe = target_dataframe.reset_index(drop=True)
+        else:
+            logger.info("Empty result")
+            target_dataframe = pandas.DataFrame()
 
-            # add time range if from or to time is specified
-            time_range = {timefield:{}}
-            if from_time : time_range[timefield].update({ 'gte' : from_time })
-            if to_time   : time_range[timefield].update({ 'lte' : to_time   })
+        if use_cache and not failed:
+            if len(self._cache) >= _MAX_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[cache_key] = (fingerprint, target_dataframe.copy())
+        return target_dataframe
 
-            # apply filter if specified
-            if type(filter)==str:
-                elastic_query['query']['bool']['must'].append({'query_string':{'query':filter}})
-            elif type(filter)==dict:
-                elastic_query['query']['bool']['must'].append({"match":filter})
 
-            if from_time or to_time:
-                elastic_query['query']['bool']['must'].append({'range':time_range})
+class timeline_store():
+    '''Keeps materialized timelines for frequently monitored queries
 
-            logger.debug("elastic query = {elastic_query}".format(**locals()))
-            res = client.search(elastic_index, body=elastic_query, size=0)
-            logger.debug("found {res[hits][total]} results in total".format(**locals()))
+    A series (query, timefield, granularity, ...) is registered once and its
+    buckets are stored as a JSON file in the timeline store (`timelinepath`
+    in the `[timelinestore]` section of settings.cfg). Refreshing a series
+    only asks elasticsearch for the buckets from the last stored bucket
+    onwards, as that bucket may not have been complete when it was stored.
 
-            if qt=='count':
-                df = pandas.DataFrame(res['aggregations']['timeline']['buckets'])
-            else:
-                df = pandas.DataFrame([{'doc_count':b['metric']['value'],'key_as_string':b['key_as_string']} for b in res['aggregations']['timeline']['buckets']])
-            logger.debug("dataframe: {df}".format(**locals()))
-            num +=1
-            longer = len(q)>10 and '...' or '   '
-            new_name = "{num}. {q:.10}{longer}".format(**locals())
+    Note that documents added with a `timefield` value before the last stored
+    bucket are only picked up by a full refresh (`refresh(full=True)`), which
+    is mostly relevant for fields like `publication_date`, not `META.ADDED`.
+    '''
 
-            df = df.rename(columns={"doc_count": new_name, "key_as_string":"timestamp"})
+    def __init__(self, path=None):
+        if not path:
+            path = config.get('timelinestore', 'timelinepath', fallback='~/Downloads/incatimelines')
+        self.path = os.path.expanduser(path)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self._generator = timeline_generator()
 
-            if type(target_dataframe)==bool and target_dataframe==False:
-                if df.empty:
-                    prepend.append(new_name)
-                    continue
-                else:
-                    target_dataframe = df[["timestamp",new_name]]
-            elif df.empty:
-                target_dataframe[new_name] = numpy.nan
-            else:
-                target_dataframe = target_dataframe.merge(df[["timestamp",new_name]], on='timestamp', how='outer')
+    def _filename(self, series_id):
+        return os.path.join(self.path, '{series_id}.json'.format(**locals()))
 
-            if prepend:
-                colnames = [name for name in target_dataframe.columns if name!="timestamp"]
-                for empty_column in prepend:
-                    target_dataframe[empty_column] = numpy.nan
-                ordered_cols = ["timestamp"] + prepend + list(colnames)
-                target_dataframe = target_dataframe[ordered_cols]
-                prepend = []
+    def _load(self, series_id):
+        try:
+            with open(self._filename(series_id)) as fileobj:
+                return json.load(fileobj)
+        except (IOError, OSError):
+            raise KeyError("No timeline {series_id} in the timeline store".format(**locals()))
 
+    def _save(self, series):
+        filename = self._filename(series['id'])
+        with open(filename + '.tmp', 'w') as fileobj:
+            json.dump(series, fileobj)
+        os.replace(filename + '.tmp', filename)
 
-        if not (type(target_dataframe)==bool and target_dataframe==False):
-            target_dataframe = target_dataframe.replace(numpy.nan, 0)
-            return target_dataframe
-        else:
+    def register(self, query, timefield, granularity="week", querytype="count", field=None, filter=None):
+        '''Adds a series to the store, if it is not already there
+
+        Parameters
+        ----
+        query : string
+            An elasticsearch string query selecting the documents to count
+        timefield : string
+            The date field used to bucket documents, such as 'META.ADDED'
+        granularity : string (default="week")
+            The size of the buckets, such as 'day', 'week' or 'month'
+        querytype : string (default="count")
+            'count', or a metric aggregation (e.g. 'avg') applied to `field`
+        field : string (default=None)
+            The field to apply the metric to
+        filter : string or dict (default=None)
+            An additional filter, as in `timeline_generator.analyse`
+
+        Returns
+        ----
+        string
+            The id of the series, to be used in `refresh`, `get` and `remove`
+        '''
+        definition = {'query':query, 'timefield':timefield, 'granularity':granularity,
+                      'querytype':querytype, 'field':field, 'filter':filter}
+        series_id = hashlib.md5(json.dumps(definition, sort_keys=True).encode('utf-8')).hexdigest()
+        if not os.path.exists(self._filename(series_id)):
+            definition.update({'id':series_id, 'buckets':[], 'refreshed':None})
+            self._save(definition)
+            logger.info("Registered timeline {series_id} for {query}".format(**locals()))
+        return series_id
+
+    def remove(self, series_id):
+        '''Removes a series from the store'''
+        os.remove(self._filename(series_id))
+
+    def list(self):
+        '''Returns a list with the definition of all stored series'''
+        overview = []
+        for filename in sorted(os.listdir(self.path)):
+            if not filename.endswith('.json'): continue
+            series = self._load(filename[:-len('.json')])
+            series['last'] = series['buckets'] and series['buckets'][-1][1] or None
+            series['buckets'] = len(series['buckets'])
+            overview.append(series)
+        return overview
+
+    def refresh(self, series_ids=None, full=False):
+        '''Updates stored series with the latest buckets from elasticsearch
+
+        Parameters
+        ----
+        series_ids : string or list (default=None)
+            The series to refresh, all series if not given
+        full : bool (default=False)
+            Re-aggregate the whole history instead of only the latest buckets
+
+        Returns
+        ----
+        int
+            The number of buckets that were fetched
+        '''
+        if series_ids is None:
+            series_ids = [series['id'] for series in self.list()]
+        elif type(series_ids)==str:
+            series_ids = [series_ids]
+        if not series_ids:
+            return 0
+
+        all_series = [self._load(series_id) for series_id in series_ids]
+        search_body = []
+        for series in all_series:
+            if full:
+                series['buckets'] = []
+            since = series['buckets'] and series['buckets'][-1][0] or None
+            search_body.append({'index':elastic_index})
+            search_body.append(self._generator._build_query(series['query'], series['timefield'],
+                series['granularity'], series['querytype'], series['field'],
+                from_time=since, filter=series['filter'], time_format=since and 'epoch_millis' or None))
+        responses = client.msearch(body=search_body)['responses']
+
+        fetched = 0
+        for series, response in zip(all_series, responses):
+            if 'error' in response:
+                logger.warning("Could not refresh {series[id]}: {response[error]}".format(**locals()))
+                continue
+            buckets = self._generator._parse_buckets(response, series['querytype'])
+            if buckets:
+                # the overlapping bucket is replaced by its complete version
+                first = min(buckets)
+                kept = [bucket for bucket in series['buckets'] if bucket[0] < first]
+                series['buckets'] = kept + [[key, buckets[key][0], buckets[key][1]] for key in sorted(buckets)]
+            series['refreshed'] = datetime.datetime.now().isoformat()
+            self._save(series)
+            fetched += len(buckets)
+        logger.info("Fetched {fetched} buckets for {n} timelines".format(n=len(all_series), **locals()))
+        return fetched
+
+    def get(self, series_ids, from_time=None, to_time=None, refresh=True):
+        '''Returns stored series in the format of `timeline_generator.analyse`
+
+        Parameters
+        ----
+        series_ids : string or list
+            The series to return
+        from_time, to_time : string (default=None)
+            Only return buckets in this (inclusive) range
+        refresh : bool (default=True)
+            Whether to fetch the latest buckets first
+
+        Returns
+        ----
+        pandas.DataFrame
+            A timestamp column and a column for each series
+        '''
+        if type(series_ids)==str:
+            series_ids = [series_ids]
+        if refresh:
+            self.refresh(series_ids)
+
+        timestamps = {}
+        columns = []
+        counts = []
+        for num, series_id in enumerate(series_ids, 1):
+            series = self._load(series_id)
+            q = series['query']
+            longer = len(q)>10 and '...' or '   '
+            new_name = "{num}. {q:.10}{longer}".format(**locals())
+            timestamps.update({key:timestamp for key, timestamp, value in series['buckets']})
+            columns.append(pandas.Series({key:value for key, timestamp, value in series['buckets']},
+                                         name=new_name, dtype=float))
+            if series['querytype']=='count':
+                counts.append(new_name)
+
+        keys = sorted(timestamps)
+        if from_time: keys = [key for key in keys if key >= pandas.Timestamp(from_time).value // 10**6]
+        if to_time:   keys = [key for key in keys if key <= pandas.Timestamp(to_time).value // 10**6]
+        if not keys:
             logger.info("Empty result")
             return pandas.DataFrame()
+        target_dataframe = pandas.concat([column.reindex(keys) for column in columns], axis=1)
+        target_dataframe = target_dataframe.replace(numpy.nan, 0)
+        for column in counts:
+            target_dataframe[column] = target_dataframe[column].astype(int)
+        target_dataframe.insert(0, 'timestamp', [timestamps[key] for key in keys])
+        return target_dataframe.reset_index(drop=True)
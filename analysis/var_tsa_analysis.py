@@ -1,7 +1,11 @@
 import pandas as pd
 import numpy as np
 import logging
+import hashlib
+import itertools
+import multiprocessing
 from os import environ
+from concurrent.futures import ProcessPoolExecutor
 from core.analysis_base_class import Analysis
 from analysis import timeline_analysis as ta
 from statsmodels.tsa.api import VAR as var 
@@ -24,6 +28,73 @@ else:
     from matplotlib import pyplot
 
 
+STATIONARITY_COLUMNS = {
+    'adf'  : ['ADF_Stat','p-value','Critical_val_1%','Critical_val_5%','Critical_val_10%'],
+    'kpss' : ['KPSS_Stat','p-value','Critical_val_1%','Critical_val_5%','Critical_val_10%'],
+}
+GRANGER_COLUMNS = ['F-val', 'p-val', 'df_denom', 'df_num']
+MIN_PARALLEL_TESTS = 8 # below this, starting worker processes costs more than it saves
+
+_test_cache = {}
+_MAX_CACHE_SIZE = 10000
+
+def _stationarity_test(test, values):
+    if test == 'adf':
+        result = adfuller(values)
+        critical = result[4]
+    else:
+        result = kpss(values)
+        critical = result[3]
+    return [result[0], result[1], critical['1%'], critical['5%'], critical['10%']]
+
+def _granger_test(values, lag):
+    return list(grangercausalitytests(values, maxlag=lag, verbose=False)[lag][0]['ssr_ftest'])
+
+def _run_tests(function, argument_lists, processes=None):
+    '''Runs a test function for each list of arguments, in worker processes if there are enough of them'''
+    if processes == 1 or len(argument_lists) < MIN_PARALLEL_TESTS:
+        return [function(*arguments) for arguments in argument_lists]
+    if multiprocessing.current_process().daemon:
+        # e.g. celery workers, which are not allowed to fork
+        return [function(*arguments) for arguments in argument_lists]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(function, *zip(*argument_lists), chunksize=4))
+
+def stationarity_tests(df, test='adf', processes=None):
+    """ Runs the ADF or KPSS test on every column of df, in parallel worker processes.
+        Results are cached per (test, values), so re-testing unchanged or previously transformed series is free.
+
+        @df - dataframe with a time series per column
+        @test - 'adf' or 'kpss'
+        @processes - number of worker processes, defaults to the number of CPUs
+        Returns: dataframe with a row per time series
+    """
+    values = [np.ascontiguousarray(df[name].values, dtype=float) for name in df.columns]
+    keys = [hashlib.md5(test.encode('utf-8') + series.tobytes()).hexdigest() for series in values]
+    missing = [n for n, key in enumerate(keys) if key not in _test_cache]
+    results = _run_tests(_stationarity_test, [(test, values[n]) for n in missing], processes)
+    computed = dict(zip((keys[n] for n in missing), results))
+    rows = [computed[key] if key in computed else _test_cache[key] for key in keys]
+    if len(_test_cache) + len(computed) > _MAX_CACHE_SIZE:
+        _test_cache.clear()
+    _test_cache.update(computed)
+    return pd.DataFrame(rows, index=df.columns, columns=STATIONARITY_COLUMNS[test])
+
+def granger_matrix(df, lag, processes=None):
+    """ Runs the Granger causality (ssr F) test for every ordered pair of columns of df, in parallel worker processes.
+
+        @df - dataframe with a time series per column
+        @lag - lag at which we want the test
+        @processes - number of worker processes, defaults to the number of CPUs
+        Returns: tidy dataframe with a row per (cause, effect) pair. H_0 is that cause does NOT Granger cause effect.
+    """
+    pairs = list(itertools.permutations(df.columns, 2))
+    results = _run_tests(_granger_test, [(df[[effect, cause]].values, lag) for cause, effect in pairs], processes)
+    table = pd.DataFrame(results, columns=GRANGER_COLUMNS)
+    table.insert(0, 'effect', [effect for cause, effect in pairs])
+    table.insert(0, 'cause', [cause for cause, effect in pairs])
+    return table
+
 class VAR(Analysis):
     """ When creating var model we first generate a timeline in the form of pandas df. Then feed it to VAR method in statsmodels.
         We can save the names of the variables(queries) this way so no need of mapping (var to name) on the later stages,
@@ -47,6 +118,9 @@ class VAR(Analysis):
                 @level = confidence level for all your test (!) , default = 5%
                 @from_time - 
                 @to_time -
+                @use_store = True/False, False is default. If True, the timelines are
+                    registered in (and read from) the timeline store, so only new buckets
+                    are fetched from elasticsearch
                 @do_assump_check = True/False    ##
                 @do_transfomations = True/False   ##
                 @max_order_diff = maximum order of differencing, default = 2  
@@ -62,9 +136,14 @@ class VAR(Analysis):
         self.to_time = kwargs.get('to_time',None)
         self.ic = kwargs.get('ic','aic')
         
-        timeline = ta.timeline_generator()
-        df_raw = timeline.analyse(queries=queries,timefield = timefield, granularity = granularity,
-                                 from_time=self.from_time,to_time=self.to_time)
+        if kwargs.get('use_store',False):
+            store = ta.timeline_store()
+            series = [store.register(q, timefield, granularity=granularity, querytype=querytype) for q in queries]
+            df_raw = store.get(series, from_time=self.from_time, to_time=self.to_time)
+        else:
+            timeline = ta.timeline_generator()
+            df_raw = timeline.analyse(queries=queries,timefield = timefield, granularity = granularity,
+                                     querytype=querytype, from_time=self.from_time,to_time=self.to_time)
         df_raw.index = df_raw.timestamp
         df_raw = df_raw.drop('timestamp',axis=1) 
         self.df_raw = df_raw
@@ -95,7 +174,9 @@ class VAR(Analysis):
         @level -  this is the level you are testing your asusmptions on. 
                   NOTE: when test_assump called from fit method level is set by kwarg or default is 5%
         @test_type - either adf or kpss
+        @processes - number of worker processes for the tests (kwarg), defaults to the number of CPUs
         """
+        self.processes = kwargs.get('processes', None)
         self.diff_order  = 0
         self.detrend_order = 0
         def _adf_test(df):
@@ -103,32 +184,14 @@ class VAR(Analysis):
             H_0: the observed time series is stationary 
             Returns: dataframe of summary of the test 
             """
-            summary_adf = pd.DataFrame(columns=['ADF_Stat','p-value','Critical_val_1%','Critical_val_5%','Critical_val_10%'])
-            for name in df.columns:
-                series = df[name]
-                result = adfuller(series)
-                dic = {'ADF_Stat':result[0],'p-value':result[1],'Critical_val_1%':result[4]['1%'],'Critical_val_5%':result[4]['5%'],
-                       'Critical_val_10%':result[4]['10%']}
-                summary_adf = summary_adf.append(dic,ignore_index=True)
-            summary_adf.set_index(df.columns,inplace=True)  
-
-            return summary_adf 
+            return stationarity_tests(df, test='adf', processes=self.processes)
         
         def _kpss_test(df):
             """ 
             H_0: there is a unit root in time series, hence stochastic trend with drift, hence non-stationary
             Returns: dataframe of summary of the test
             """
-            summary_kpss = pd.DataFrame(columns=['KPSS_Stat','p-value','Critical_val_1%','Critical_val_5%','Critical_val_10%'])
-            for name in df.columns:
-                series = df[name]
-                result = kpss(series)
-                dic = {'KPSS_Stat':result[0],'p-value':result[1],'Critical_val_1%':result[3]['1%'],'Critical_val_5%':result[3]['5%'],
-                       'Critical_val_10%':result[3]['10%']}
-                summary_kpss = summary_kpss.append(dic,ignore_index=True)
-            summary_kpss.set_index(df.columns,inplace=True)  
-
-            return summary_kpss
+            return stationarity_tests(df, test='kpss', processes=self.processes)
         
         def _stationary(df):
             """ 
@@ -157,11 +220,7 @@ class VAR(Analysis):
             """  
             helped = False   
             def _perform_differencing():
-                df_diff = pd.DataFrame(columns=df.columns)
-                for name in df.columns:
-                    series = df[name]
-                    series = series.diff(order)
-                    df_diff[name] = series.dropna(axis=0)
+                df_diff = df.diff(order).dropna(axis=0)
                 
                 return _stationary(df_diff), df_diff   
             
@@ -179,11 +238,7 @@ class VAR(Analysis):
             """     
             helped = False  
             def _perform_detrending(): 
-                df_res = pd.DataFrame(columns=df.columns)
-                for name in df.columns:
-                    series = df[name]
-                    res = detrend(series,order)
-                    df_res[name] = series.dropna(axis=0)
+                df_res = pd.DataFrame(detrend(df.values,order,axis=0), index=df.index, columns=df.columns)
                 
                 return _stationary(df_res), df_res  
             
@@ -208,6 +263,7 @@ class VAR(Analysis):
             
             if self.flag_stationarity == False: 
                 for i in range(1,self.max_order_detrend + 1):
+                    self.detrend_order = i
                     detrend_helped = detrending(df,order=i)
                     if detrend_helped == True:
                         self.flag_stationarity = detrend_helped 
@@ -290,6 +346,18 @@ class VAR(Analysis):
         
         return granger_flag # for granger 
 
+    def granger_matrix(self, lag, level='5%', processes=None):
+        """ Runs the Granger causality test for all ordered pairs of time series at once (see granger)
+
+            @lag - lag at which we want the test
+            @level - confidence level of ssr f test
+            @processes - number of worker processes, defaults to the number of CPUs
+            Returns: tidy dataframe with a row per (cause, effect) pair and a 'granger_causes' flag
+        """
+        self.granger_table = granger_matrix(self.df, lag, processes=processes)
+        self.granger_table['granger_causes'] = self.granger_table['p-val'] < float(level[:-1])/100
+        return self.granger_table
+
     def plot(self, plot_type=None, lag = 1):
         """ Ploting graphs for df """
         def lag_scatter():
@@ -0,0 +1,134 @@
+'''
+This file provides pooled, retrying and concurrent HTTP requests for API clients.
+
+Sessions: a requests session with a connection pool, shared by all threads
+Authorized http: one OAuth2-authorized httplib2.Http per thread and credentials,
+    so credentials are parsed (and refreshed) once instead of per request
+Retries : exponential backoff on connection errors, rate limiting and server errors
+Concurrency : mapping a request over items with a bounded number of threads,
+    to stay within the rate limits of an API
+
+'''
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from core.database import config
+
+logger = logging.getLogger(__name__)
+
+THREADS = int(config.get('clients', 'threads', fallback='4'))
+RETRIES = int(config.get('clients', 'retries', fallback='3'))
+BACKOFF = float(config.get('clients', 'backoff', fallback='1')) # seconds before the first retry, doubled for every next retry
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+try:
+    import httplib2
+    TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError,
+                        httplib2.HttpLib2Error)
+except ImportError:
+    httplib2 = None
+    TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+class RetryableError(Exception):
+    '''Raise this in a request function passed to `with_retries` to retry it'''
+    pass
+
+_session = None
+_session_pid = None
+_lock = threading.Lock()
+_local = threading.local()
+
+def get_session():
+    '''Returns a requests session that keeps connections to API hosts open'''
+    global _session, _session_pid
+    with _lock:
+        # connections should not be shared with (forked) processes
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=THREADS, pool_maxsize=THREADS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+            _session_pid = os.getpid()
+    return _session
+
+def authorized_http(credentials_json, timeout=None):
+    '''Returns an httplib2.Http authorized with OAuth2 credentials (as stored by a client)
+
+    httplib2 is not thread-safe, so every thread gets its own Http per credentials.
+    '''
+    from oauth2client.client import GoogleCredentials
+    https = getattr(_local, 'https', None)
+    if https is None:
+        https = _local.https = {}
+    if credentials_json not in https:
+        credentials = GoogleCredentials.from_json(credentials_json)
+        https[credentials_json] = credentials.authorize(httplib2.Http(timeout=timeout))
+    return https[credentials_json]
+
+def is_rate_limited(status, content):
+    '''Whether a response (status code and body) asks to slow down'''
+    if int(status) in RETRY_STATUS:
+        return True
+    if int(status) == 403:
+        try:
+            errors = json.loads(content).get('error', {}).get('errors', [])
+        except (ValueError, AttributeError):
+            return False
+        return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+    return False
+
+def with_retries(request, retries=RETRIES, backoff=BACKOFF, description=''):
+    '''
+    Calls request() and returns its result, retrying with exponential backoff (and jitter)
+    when it raises a connection error or RetryableError. The last error is raised when
+    all retries fail.
+    '''
+    for attempt in range(retries + 1):
+        try:
+            return request()
+        except TRANSIENT_ERRORS + (RetryableError,) as e:
+            if attempt == retries:
+                logger.warning('retries for {description} exceeded: {e}'.format(**locals()))
+                raise
+            wait = backoff * 2 ** attempt * (1 + random.random() / 2)
+            logger.info('retrying {description} in {wait:.1f}s: {e}'.format(**locals()))
+            time.sleep(wait)
+
+_executor = None
+_executor_pid = None
+
+def _in_worker(function, item):
+    _local.worker = True
+    return function(item)
+
+def concurrent_map(function, items, threads=THREADS):
+    '''Returns [function(item) for item in items], computed by at most `threads` threads at a time
+
+    The threads are shared by all calls (so authorized sessions are reused), calls from
+    within these threads are computed one by one.
+    '''
+    global _executor, _executor_pid
+    items = list(items)
+    if threads <= 1 or len(items) <= 1 or getattr(_local, 'worker', False):
+        return [function(item) for item in items]
+    with _lock:
+        # the threads of a parent process do not exist in a forked process
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=threads)
+            _executor_pid = os.getpid()
+    return list(_executor.map(lambda item: _in_worker(function, item), items))
+
+def chunks(items, size):
+    '''Splits a list into lists of at most size items, e.g. for APIs that accept a limited number of ids'''
+    items = list(items)
+    return [items[start:start + size] for start in range(0, len(items), size)]
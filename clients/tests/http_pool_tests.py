@@ -0,0 +1,88 @@
+'''
+TESTS FOR _http_pool
+'''
+import os
+import threading
+import pytest
+import requests
+from clients import _http_pool
+from clients._http_pool import with_retries, chunks, concurrent_map, RetryableError
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(_http_pool.time, 'sleep', sleeps.append)
+    return sleeps
+
+def failing(errors, result='ok'):
+    '''Returns a request that raises the errors one by one, and then returns result'''
+    errors = list(errors)
+    calls = []
+    def request():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    request.calls = calls
+    return request
+
+def test_with_retries_succeeds_after_retries(sleeps):
+    request = failing([RetryableError('429'), requests.ConnectionError('reset')])
+    assert with_retries(request, retries=3, backoff=1) == 'ok'
+    assert len(request.calls) == 3
+    # exponential backoff with up to 50% jitter
+    assert len(sleeps) == 2
+    assert 1 <= sleeps[0] <= 1.5
+    assert 2 <= sleeps[1] <= 3
+
+def test_with_retries_raises_the_last_error(sleeps):
+    request = failing([RetryableError('first'), RetryableError('second'), RetryableError('last')])
+    with pytest.raises(RetryableError, match='last'):
+        with_retries(request, retries=2, backoff=0)
+    assert len(request.calls) == 3
+    assert sleeps == [0, 0]
+
+def test_with_retries_does_not_retry_other_errors(sleeps):
+    request = failing([ValueError('bad request')])
+    with pytest.raises(ValueError):
+        with_retries(request, retries=3)
+    assert len(request.calls) == 1
+    assert sleeps == []
+
+def test_is_rate_limited():
+    assert _http_pool.is_rate_limited('503', '')
+    assert _http_pool.is_rate_limited(403, '{"error":{"errors":[{"reason":"rateLimitExceeded"}]}}')
+    assert not _http_pool.is_rate_limited(403, '{"error":{"errors":[{"reason":"forbidden"}]}}')
+    assert not _http_pool.is_rate_limited(403, 'not json')
+    assert not _http_pool.is_rate_limited(200, '')
+
+def test_chunks():
+    assert chunks(range(7), 3) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert chunks([1, 2], 50) == [[1, 2]]
+    assert chunks([], 50) == []
+
+def test_concurrent_map_keeps_order():
+    items = list(range(50))
+    assert concurrent_map(lambda item: item * 2, items, threads=4) == [item * 2 for item in items]
+    assert concurrent_map(lambda item: item, iter([1]), threads=4) == [1]
+
+def test_concurrent_map_nested():
+    # calls from within the threads are computed one by one, so they cannot wait on each other
+    threads = set()
+    def inner(item):
+        threads.add(threading.get_ident())
+        return item + 1
+    result = concurrent_map(lambda items: concurrent_map(inner, items, threads=2), [[1, 2], [3, 4], [5]], threads=2)
+    assert result == [[2, 3], [4, 5], [6]]
+    assert threading.get_ident() not in threads
+
+def test_pools_per_process(monkeypatch):
+    concurrent_map(str, [1, 2], threads=2)
+    executor, session = _http_pool._executor, _http_pool.get_session()
+    concurrent_map(str, [1, 2], threads=2)
+    assert _http_pool._executor is executor
+    assert _http_pool.get_session() is session
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert concurrent_map(str, [1, 2], threads=2) == ['1', '2']
+    assert _http_pool._executor is not executor
+    assert _http_pool.get_session() is not session
@@ -0,0 +1,40 @@
+'''
+TESTS FOR the requests of youtube_client
+'''
+import pytest
+from clients import _http_pool, youtube_client
+
+class _response():
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.data = data
+        self.text = ''
+    def json(self):
+        return self.data
+
+class _session():
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+    def get(self, url, params=None, data=None, timeout=None):
+        self.calls += 1
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(_http_pool.time, 'sleep', lambda seconds: None)
+    return youtube_client.youtube.__new__(youtube_client.youtube)
+
+def test_get_retries_server_errors(client, monkeypatch):
+    session = _session([_response(503), _response(500), _response(200, {'items':[]})])
+    monkeypatch.setattr(youtube_client, 'get_session', lambda: session)
+    assert client._get('https://example.com', oauth=False) == {'items':[]}
+    assert session.calls == 3
+
+def test_get_raises_when_retries_are_exceeded(client, monkeypatch):
+    session = _session([_response(503)])
+    monkeypatch.setattr(youtube_client, 'get_session', lambda: session)
+    with pytest.raises(_http_pool.RetryableError):
+        client._get('https://example.com', oauth=False, retries=2)
+    assert session.calls == 3
+    assert client._get('https://example.com', oauth=False, retries=2, ignore_errors=True) == {}
@@ -2,15 +2,16 @@ from core.client_class import Client, elasticsearch_required
 from core.basic_utils  import dotkeys
 from core.search_utils import doctype_first
 
+from clients._http_pool import (authorized_http, get_session, with_retries, is_rate_limited, concurrent_map,
+                                chunks, RetryableError, TRANSIENT_ERRORS)
+
 import logging
 import json
-import httplib2
-import requests
-from requests import ConnectionError, ConnectTimeout
 import oauth2client
 from oauth2client import client
 from oauth2client.client import Credentials
 from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger("INCA.%s" %__name__)
 
@@ -154,69 +155,76 @@ class youtube(Client):
 
     def _get(self, url, params=None, data=None, retries=3, timeout=20, oauth=True, ignore_errors=False):
         '''
-        This function wraps requests.get to handle the YouTube API specific error codes that may pop up.
+        This function wraps the (pooled, see clients._http_pool) requests to handle the YouTube API
+        specific error codes that may pop up. Connection errors, rate limiting and server errors are
+        retried with exponential backoff.
         '''
 
         third_party_warning = "might not have enabled third-party contributions for this caption"
 
-        try:
+        def request():
             if oauth:
-                http_auth = self._credentials['_source']['credentials']
-                credentials = oauth2client.client.GoogleCredentials.from_json(http_auth)
-                http = httplib2.Http()
-                http = credentials.authorize(http)
-                params = params and "?"+urlencode(params) or ""
-                response = http.request(url+"{params}".format(params=params), 'GET', body=data)
-
-
-                if type(response)==tuple and response[0]['status']=="200":
-                    try:
-                        res = json.loads(response[1].decode('utf-8','ignore'))
-                    except ValueError:
-                        logger.debug("response is not JSON")
-                        res = response[1].decode('utf-8','ignore')
-                    return res
-                elif type(response)==tuple and response[0]['status']=="403" and third_party_warning in str(response[1]):
-                    logger.debug("Third party blocked warning")
-                    return {}
-                elif type(response)==tuple and response[0]['status']!="200":
-                    if ignore_errors:
-                        return {}
-                    else:
-                        raise Exception("bad response!")
+                http = authorized_http(self._credentials['_source']['credentials'], timeout=timeout)
+                query = params and "?"+urlencode(params) or ""
+                headers, content = http.request(url+"{query}".format(query=query), 'GET', body=data)
+                if is_rate_limited(headers['status'], content.decode('utf-8','ignore')):
+                    raise RetryableError("status {status}".format(status=headers['status']))
+                return headers, content
+            response = get_session().get(url, params=params, data=data, timeout=self.timeout)
+            if is_rate_limited(response.status_code, response.text):
+                raise RetryableError("status {response.status_code}".format(**locals()))
+            return response
+
+        try:
+            response = with_retries(request, retries=retries, description=url)
+        except (RetryableError,) + TRANSIENT_ERRORS:
+            if not ignore_errors:
+                raise
+            logger.warning('retries for {url} exceeded (params={params}, data={data})'.format(**locals()))
+            return {}
+
+        if oauth:
+            headers, content = response
+            if headers['status']=="200":
+                try:
+                    res = json.loads(content.decode('utf-8','ignore'))
+                except ValueError:
+                    logger.debug("response is not JSON")
+                    res = content.decode('utf-8','ignore')
+                return res
+            elif headers['status']=="403" and third_party_warning in str(content):
+                logger.debug("Third party blocked warning")
+                return {}
+            elif ignore_errors:
+                return {}
             else:
-                response = requests.get(url,params=params, data=data, timeout=self.timeout)
-            if response.status_code==200:
-                return response.json()
-            elif response.status_code == 404 :
-                logger.info("No items found for {data}".format(**locals))
+                raise Exception("bad response!")
+
+        if response.status_code==200:
+            return response.json()
+        elif response.status_code == 404 :
+            logger.info("No items found for {data}".format(**locals()))
+            return {}
+        elif response.status_code == 400 :
+            if not ignore_errors:
+                raise Exception("Bad Request: you probably have incorrect parameter (values), refer to the API documentation")
+            else:
+                logger.warn("400 exception!")
                 return {}
-            elif response.status_code == 400 :
-                if not ignore_errors:
-                    raise Exception("Bad Request: you probably have incorrect parameter (values), refer to the API documentation")
-                else:
-                    logger.warn("400 exception!")
-                    return {}
-            elif response.status_code == 403 :
-                if not ignore_errors:
-                    raise Exception("Forbidden status code (403): your API Key is wrong or your options require OAuth! (not supported here)")
-                else:
-                    logger.warn('403: forbidden')
-                    return {'status':'forbidden'}
-            elif response.status_code == 401 :
-                if not ignore_errors:
-                    raise Exception("You misspelled a parameter, have a bad API key or require (new) OAuth (try reset_oauth?) ")
-                else:
-                    logger.warn('401 error!')
-                    return {}
+        elif response.status_code == 403 :
+            if not ignore_errors:
+                raise Exception("Forbidden status code (403): your API Key is wrong or your options require OAuth! (not supported here)")
             else:
-                raise Exception("incorrect status code! {response.status_code} : {response.reason}".format(**locals()))
-        except (ConnectTimeout, ConnectionError):
-            if retries > 0:
-                return self._get(url, params, data, retries-1, timeout)
+                logger.warn('403: forbidden')
+                return {'status':'forbidden'}
+        elif response.status_code == 401 :
+            if not ignore_errors:
+                raise Exception("You misspelled a parameter, have a bad API key or require (new) OAuth (try reset_oauth?) ")
             else:
-                logger.warning('retries for {url} exceeded (params={params}, data={data})'.format(**locals()))
+                logger.warn('401 error!')
                 return {}
+        else:
+            raise Exception("incorrect status code! {response.status_code} : {response.reason}".format(**locals()))
 
 class youtube_videos_search(youtube):
     """class to retrieve YouTube videos based on search queries"""
@@ -268,26 +276,26 @@ class youtube_videos_search(youtube):
         }
 
         data.update({k:v for k,v in kwargs.items() if v})
-        res = self._get(url, params=data)
-        if expand and res:
-            res['items'] = self.expand_videos(res['items'])
-        if captions and res:
-            res['items'] = self.get_captions(res['items'],**kwargs)
-        for item in res.get('items',[]):
-            yield self._standardize_id(item)
-        maxpages -= 1
-        while maxpages!=0 and res.get('nextPageToken',0):
-            maxpages -= 1
-            item['PAGE'] = data.get('nextPageToken','')
-            data.update({'pageToken':res['nextPageToken']})
-            logger.info('searchpage = %s' %res['nextPageToken'])
+        # the next page is fetched while the videos of the current page are expanded
+        with ThreadPoolExecutor(max_workers=1) as prefetch:
             res = self._get(url, params=data)
-            if expand and res:
-                res['items'] = self.expand_videos(res['items'])
-            if captions and res:
-                res['items'] = self.get_captions(res['items'],**kwargs)
-            for item in res.get('items',[]):
-                yield self._standardize_id(item)
+            maxpages -= 1
+            while True:
+                next_page = None
+                if maxpages!=0 and res.get('nextPageToken',0):
+                    maxpages -= 1
+                    data.update({'pageToken':res['nextPageToken']})
+                    logger.info('searchpage = %s' %res['nextPageToken'])
+                    next_page = prefetch.submit(self._get, url, params=dict(data))
+                if expand and res:
+                    res['items'] = self.expand_videos(res['items'])
+                if captions and res:
+                    res['items'] = self.get_captions(res['items'],**kwargs)
+                for item in res.get('items',[]):
+                    yield self._standardize_id(item)
+                if next_page is None:
+                    break
+                res = next_page.result()
 
     def expand_videos(self, vids, **kwargs ):
         if not vids:
@@ -337,23 +345,27 @@ class youtube_videos_search(youtube):
             parts = ','.join(parts)
 
         if type(videos)==list and videos and type(videos[0])==dict:
-            ids = ','.join([vid.get('id',{}).get('videoId') for vid in videos])
+            ids = [vid.get('id',{}).get('videoId') for vid in videos]
         elif type(videos)==list and videos and type(videos[0])==str:
-            ids = ','.join(videos)
-        elif type(videos)==str:
             ids = videos
+        elif type(videos)==str:
+            ids = videos.split(',')
         else:
             raise Exception("Unknown videos type!")
 
         data = {
         'key': self.API_KEY,
         'part':parts,
-        'id':','.join([vid.get('id',{}).get('videoId') for vid in videos])
         }
         data.update({k:v for k,v in kwargs.items() if v})
-        res = self._get('https://www.googleapis.com/youtube/v3/videos', params=data)
-        for vid in res.get('items',[]):
-            yield vid
+
+        # the API accepts at most 50 ids per request
+        def request(batch):
+            return self._get('https://www.googleapis.com/youtube/v3/videos', params=dict(data, id=','.join(batch)))
+
+        for res in concurrent_map(request, chunks(ids, 50)):
+            for vid in res.get('items',[]):
+                yield vid
 
     def get_captions(self, vids, part="id, snippet", language='en', *args, **kwargs):
         if type(vids)==str:
@@ -368,24 +380,26 @@ class youtube_videos_search(youtube):
         'part': part
         }
 
-        for vid in vids:
+        def add_captions(vid):
             if not vid['kind'] == "youtube#video":
                 logger.debug("not a video, no captions retrieved")
-                continue
+                return
             if vid.get('contentDetails',{}).get('caption','true')=='true':
                 if type(vid['id'])== str:
-                    data.update({'videoId':vid['id']})
+                    params = dict(data, videoId=vid['id'])
                 elif type(vid['id']) == dict:
-                    data.update({'videoId':vid['id']['videoId']})
-                captions = self._get(url, params=data).get('items',[])
+                    params = dict(data, videoId=vid['id']['videoId'])
+                captions = self._get(url, params=params).get('items',[])
             else:
-                continue # if captions are known not to exist, skip them
+                return # if captions are known not to exist, skip them
             vid['captions'] = captions
             cap = self.get_caption(vid,language=language, **kwargs)
             if type(cap)==dict and not cap:
                 cap = ""
             vid['caption']  = cap
 
+        # the caption tracks of the videos are retrieved concurrently
+        concurrent_map(add_captions, vids)
         return vids
 
     def get_caption(self, vid, language, types=['standard','ASR'], *args, **kwargs):
@@ -474,35 +488,28 @@ class youtube_comments(youtube):
 
 
         res  = self._get(url, params=data)
-        for item in res.get('items',[]):
-            repliespresent = item['snippet']['totalReplyCount']
-            parent_id = item['id']
-            item['commenttype'] = "toplevelcomment"
+        for item in self._with_replies(res.get('items',[]), include_replies):
             yield item
-            if repliespresent == 0:
-                pass
-            elif repliespresent > 0 and include_replies:
-                for reply in self._get_replies(parent_id):
-                    reply['commenttype'] = 'reply'
-                    yield reply
-
 
         while  maxpages!=0 and res.get('nextPageToken',False):
             maxpages -= 1
             data.update({'pageToken':res.get('nextPageToken',False) or None})
             res = self._get(url, params=data)
-            for item in res.get('items',[]):
-                repliespresent = item['snippet']['totalReplyCount']
-                parent_id = item['id']
-                item['commenttype'] = "toplevelcomment"
+            for item in self._with_replies(res.get('items',[]), include_replies):
                 yield item
 
-                if repliespresent == 0:
-                    continue
-                elif repliespresent > 0 and include_replies:
-                    for reply in self._get_replies(parent_id):
-                        reply['commenttype'] = 'reply'
-                        yield reply
+    def _with_replies(self, items, include_replies=True):
+        """Internal method that yields a page of topLevelComments, each followed by its replies.
+        The replies of the comments on a page are retrieved concurrently.
+        """
+        parent_ids = [item['id'] for item in items if include_replies and item['snippet']['totalReplyCount'] > 0]
+        replies = dict(zip(parent_ids, concurrent_map(lambda parent_id: list(self._get_replies(parent_id)), parent_ids)))
+        for item in items:
+            item['commenttype'] = "toplevelcomment"
+            yield item
+            for reply in replies.get(item['id'],[]):
+                reply['commenttype'] = 'reply'
+                yield reply
 
     def _get_replies(self, parent_id, maxpages=-1):
         """Internal method to retrieve replies to topLevelComments
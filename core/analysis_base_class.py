@@ -1,8 +1,65 @@
 from celery import Task
+import collections
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import numpy as np
+import core.database
+from core.basic_utils import dotkeys
+try:
+    import joblib
+except ImportError:
+    from sklearn.externals import joblib
 
+logger = logging.getLogger("INCA."+__name__)
+
+MODELPATH = os.path.expanduser(core.database.config.get('modelstore', 'modelpath', fallback='~/Downloads/incamodels'))
+_loaded_models = {}
+
+_bulk_model = None # the model used by bulk_predict worker processes, inherited when forking
+
+def _predict_batch(texts, kwargs):
+    return _bulk_model._predict_texts(texts, **kwargs)
+
+def _to_json(value):
+    '''converts (numpy) predictions to values elasticsearch can store'''
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    if isinstance(value, dict):
+        return {k:_to_json(v) for k, v in value.items()}
+    return value
+
+def _model_versions(name):
+    path = os.path.join(MODELPATH, name)
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(version) for version in os.listdir(path) if version.isdigit())
+
+def list_models():
+    """Lists the models in the model store\n
+    :return: per model name, the metadata of each saved version
+    :rtype: dict
+    """
+    if not os.path.isdir(MODELPATH):
+        return {}
+    models = {}
+    for name in sorted(os.listdir(MODELPATH)):
+        for version in _model_versions(name):
+            with open(os.path.join(MODELPATH, name, str(version), 'meta.json')) as fileobj:
+                models.setdefault(name, []).append(json.load(fileobj))
+    return models
 
 class Analysis(Task):
 
+    _model_state = None # the attributes that make up a fitted model, see save
+
     def fit(self, documents, add_prediction='', **kwargs):
         """
         This method should train a model on the input documents.\n
@@ -29,6 +86,179 @@ class Analysis(Task):
         """
         raise NotImplementedError
 
+    def _predict_texts(self, texts, **kwargs):
+        """
+        This method should return the model's output for a batch of texts, one (JSON-serializable) value per text.\
+        It is used by bulk_predict.\n
+        :param texts: the texts to perform inference on
+        :type texts: list
+        """
+        raise NotImplementedError
+
+    def bulk_predict(self, query, x_field, add_prediction, batchsize=1000, processes=1, **kwargs):
+        """
+        This method applies the trained model to all documents matching a query and stores the model's output in the\
+        documents, using partial bulk updates. Documents are streamed from elasticsearch and predicted in batches,\
+        optionally in parallel worker processes that share the (memory-mapped) model with this process.\n
+        :param query: the documents to perform inference on, as an elasticsearch query (dict) or string query
+        :type query: dict or str
+        :param x_field: the nested field name that contains the input of the model, e.g. 'text' or '_source.text'
+        :type x_field: str
+        :param add_prediction: the key under which the model's output is stored
+        :type add_prediction: str
+        :param batchsize: the number of documents predicted and written back at once
+        :type batchsize: int
+        :param processes: the number of worker processes. Parallel prediction requires the 'fork' start method.
+        :type processes: int
+        :return: the number of updated documents
+        :rtype: int
+        """
+        global _bulk_model
+        if type(query) == str:
+            query = {'query':{'query_string':{'query':query}}}
+        if not x_field.startswith('_source.'):
+            x_field = '_source.' + x_field
+
+        pool = None
+        if processes > 1 and multiprocessing.current_process().daemon:
+            # e.g. celery workers, which are not allowed to fork
+            logger.info("Cannot start worker processes from a daemonic process, predicting in this process")
+        elif processes > 1:
+            try:
+                _bulk_model = self
+                pool = multiprocessing.get_context('fork').Pool(processes)
+            except (ValueError, AssertionError):
+                logger.warning("Cannot fork worker processes on this platform, predicting in this process")
+
+        meta = dict(ADDED_AT=datetime.datetime.now(), ADDED_USING=str(self.__class__).split(' ')[1],
+                    FUNCTION_TYPE='analysis')
+        updated = 0
+        failures = 0
+
+        def write(docs, predictions):
+            updates = ({'_id':doc['_id'], '_type':doc['_type'],
+                        'doc':{add_prediction:_to_json(prediction), 'META':{add_prediction:meta}}}
+                       for doc, prediction in zip(docs, predictions))
+            success, errors = core.database.bulk_update_fields(updates)
+            return success, len(errors)
+
+        def batches():
+            batch = []
+            for doc in core.database.scroll_query(query):
+                text = dotkeys(doc, x_field)
+                if not text: continue
+                batch.append(({'_id':doc['_id'], '_type':doc['_type']}, text))
+                if len(batch) == batchsize:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        try:
+            if pool is None:
+                for batch in batches():
+                    docs, texts = zip(*batch)
+                    success, errors = write(docs, self._predict_texts(list(texts), **kwargs))
+                    updated += success
+                    failures += errors
+                    logger.info("updated {updated} documents".format(**locals()))
+            else:
+                # keep a bounded number of batches in flight, so documents are not all read into memory
+                pending = collections.deque()
+                for batch in batches():
+                    docs, texts = zip(*batch)
+                    pending.append((docs, pool.apply_async(_predict_batch, (list(texts), kwargs))))
+                    while len(pending) >= 2 * processes or (pending and pending[0][1].ready()):
+                        docs, result = pending.popleft()
+                        success, errors = write(docs, result.get())
+                        updated += success
+                        failures += errors
+                        logger.info("updated {updated} documents".format(**locals()))
+                while pending:
+                    docs, result = pending.popleft()
+                    success, errors = write(docs, result.get())
+                    updated += success
+                    failures += errors
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+                _bulk_model = None
+        if failures:
+            logger.warning("{failures} documents could not be updated".format(**locals()))
+        logger.info("stored predictions of {updated} documents in {add_prediction}".format(**locals()))
+        return updated
+
+    def save(self, name, training_query=None, doctype=None, **meta):
+        """
+        This method stores the fitted model as a new version in the model store (`modelpath` in the `[modelstore]` section\
+        of settings.cfg), so it can be loaded by other sessions and workers without fitting it again. Only the attributes\
+        listed in the `_model_state` of the analysis are stored, not the documents it was trained on.\n
+        :param name: the name under which to store the model
+        :type name: str
+        :param training_query: the query the model was trained on, stored in the metadata. Defaults to the query given to fit,\
+                               if any
+        :type training_query: dict or str
+        :param doctype: the doctype the model was trained on, stored in the metadata
+        :type doctype: str
+        :param meta: any other (JSON-serializable) information to store with the model
+        :return: the version of the stored model
+        :rtype: int
+        """
+        if self._model_state is None:
+            raise NotImplementedError("{cls} does not declare a _model_state, so it cannot be saved".format(
+                cls=self.__class__.__name__))
+        state = {key:value for key, value in self.__dict__.items() if key in self._model_state}
+        versions = _model_versions(name)
+        version = versions and versions[-1] + 1 or 1
+        target = os.path.join(MODELPATH, name, str(version))
+        tmp = '{target}.{pid}.tmp'.format(pid=os.getpid(), **locals()) # left behind if saving is interrupted
+        os.makedirs(tmp)
+        meta.update(name=name, version=version, model=self.__class__.__module__ + '.' + self.__class__.__name__,
+                    saved_at=datetime.datetime.now().isoformat(), doctype=doctype,
+                    training_query=training_query or getattr(self, '_training_query', None))
+        try:
+            # the state is stored rather than the object, as celery pickles tasks by name only.
+            # Arrays are stored uncompressed so they can be memory-mapped when loading.
+            joblib.dump(state, os.path.join(tmp, 'model.joblib'))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as fileobj:
+                json.dump(meta, fileobj, default=str)
+            os.rename(tmp, target)
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        logger.info("saved {name} version {version} to {target}".format(**locals()))
+        return version
+
+    @classmethod
+    def load(cls, name, version=None, mmap=True):
+        """
+        This method loads a model from the model store. Loaded models are kept per process, and with mmap the arrays of the\
+        model are memory-mapped read-only, so loading is fast and processes share the same memory pages. Load with mmap=False\
+        to continue training (update) the model.\n
+        :param name: the name under which the model was stored
+        :type name: str
+        :param version: the version to load, the latest if not given
+        :type version: int
+        :param mmap: whether to memory-map the arrays of the model
+        :type mmap: bool
+        :return: the model
+        """
+        versions = _model_versions(name)
+        if not versions:
+            raise KeyError("No model named {name} in {MODELPATH}".format(MODELPATH=MODELPATH, **locals()))
+        version = version or versions[-1]
+        key = (cls, name, version, mmap)
+        if key not in _loaded_models:
+            path = os.path.join(MODELPATH, name, str(version))
+            model = cls()
+            model.__dict__.update(joblib.load(os.path.join(path, 'model.joblib'), mmap_mode=mmap and 'r' or None))
+            with open(os.path.join(path, 'meta.json')) as fileobj:
+                model.model_meta = json.load(fileobj)
+            _loaded_models[key] = model
+            logger.info("loaded {name} version {version}".format(**locals()))
+        return _loaded_models[key]
+
     def update(self, documents, **kwargs):
         """
         This method should provide online training functionality. In most cases this should basically result in some weight updating based on new evidence.\n
@@ -36,7 +266,6 @@ class Analysis(Task):
         :type documents: iterable
         """
         raise NotImplementedError
-
     def interpretation(self, **kwargs):
         """
         This method should have the functionality to interpret the status of the model after being trained and also document the various design choices\
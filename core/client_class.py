@@ -8,10 +8,8 @@ requires a functioning elasticsearch instance.
 '''
 from core.scraper_class import Scraper
 from clients._general_utils import *
-from core.database import DATABASE_AVAILABLE
-if DATABASE_AVAILABLE:
-    from core.database import client
-    from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, NotFoundError, RequestError
+from core.database import DATABASE_AVAILABLE, client
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, NotFoundError, RequestError
 import time
 import datetime
 import logging
@@ -198,7 +196,7 @@ class Client(Scraper):
             return []
 
         logger.info("Starting client")
-        if DATABASE_AVAILABLE == True and kwargs.get('database',True):
+        if DATABASE_AVAILABLE and kwargs.get('database',True):
             for docs in self.get(credentials = usable_credentials, *args, **kwargs):
                 # in case the function yields individual rather than batch results
                 if type(docs) == dict:
@@ -28,25 +28,61 @@ config.read('settings.cfg')
 logger = logging.getLogger("INCA"+__name__)
 logging.getLogger("elasticsearch").setLevel(logging.CRITICAL)
 
-try:
-    client = Elasticsearch(
-        host=config.get('elasticsearch','%s.host' %config.get('inca','dependencies')),
-        port=int(config.get('elasticsearch','%s.port'%config.get('inca','dependencies') )),
-        timeout=60
-    )   # should be updated to reflect config
-    elastic_index  = config.get("elasticsearch","document_index")
-    DATABASE_AVAILABLE = True
-
-    # initialize mappings if index does not yet exist
-    try:
-        #if not elastic_index in client.indices.get_aliases().keys():
-        if not client.indices.exists(elastic_index):
-            client.indices.create(elastic_index, json.load(open('schema.json')))
-    except Exception as e:
-        raise Exception("Unable to communicate with elasticsearch, {}".format(e))
-except:
-    logger.warning("No database functionality available")
-    DATABASE_AVAILABLE = False
+elastic_index = config.get("elasticsearch", "document_index", fallback="inca")
+
+_SCHEMA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.json')
+_elasticsearch = None
+_available = None
+
+def _get_client():
+    '''Creates the elasticsearch client on first use'''
+    global _elasticsearch
+    if _elasticsearch is None:
+        _elasticsearch = Elasticsearch(
+            host=config.get('elasticsearch','%s.host' %config.get('inca','dependencies')),
+            port=int(config.get('elasticsearch','%s.port'%config.get('inca','dependencies') )),
+            timeout=60
+        )   # should be updated to reflect config
+    return _elasticsearch
+
+def _check_database():
+    '''Checks (once per process) whether elasticsearch can be reached, and
+    initializes the mappings if the index does not yet exist'''
+    global _available
+    if _available is None:
+        try:
+            es = _get_client()
+            try:
+                #if not elastic_index in client.indices.get_aliases().keys():
+                if not es.indices.exists(elastic_index):
+                    es.indices.create(elastic_index, json.load(open(_SCHEMA)))
+            except Exception as e:
+                raise Exception("Unable to communicate with elasticsearch, {}".format(e))
+            _available = True
+        except:
+            logger.warning("No database functionality available")
+            _available = False
+    return _available
+
+class _LazyClient():
+    '''Stands in for the elasticsearch client, so importing INCA does not
+    connect to elasticsearch. The client is created on first use.'''
+
+    def __getattr__(self, name):
+        _check_database()
+        return getattr(_get_client(), name)
+
+class _DatabaseAvailable():
+    '''Evaluates to whether elasticsearch is available, checked on first use'''
+
+    def __bool__(self):
+        return _check_database()
+
+    def __repr__(self):
+        return repr(bool(self))
+
+client = _LazyClient()
+DATABASE_AVAILABLE = _DatabaseAvailable()
 
 def get_document(doc_id):
     if not check_exists(doc_id)[0]:
@@ -127,12 +163,69 @@ def update_document(document, force=False, retry=0, max_retries=10):
         insert_document(document)
     pass
 
+MAPPING_TTL = 60 # seconds to keep the index mapping before asking elasticsearch again
+_mapping_cache = {'mappings': None, 'fetched': 0}
+
+def get_mapping(doctype=None, refresh=False):
+    '''Returns the mapping of the INCA index
+
+    The mapping is cached for `MAPPING_TTL` seconds, as it grows to several
+    megabytes for indices with many fields.
+
+    Parameters
+    ----
+    doctype : string (default=None)
+        Return only the mapping of this doctype (an empty dict if the doctype
+        is unknown). If not given, a dictionary of all doctype mappings is
+        returned.
+    refresh : bool (default=False)
+        Ignore the cached mapping and ask elasticsearch
+
+    Returns
+    ----
+    dict
+    '''
+    if refresh or _mapping_cache['mappings'] is None or time.time() - _mapping_cache['fetched'] > MAPPING_TTL:
+        _mapping_cache['mappings'] = client.indices.get_mapping(elastic_index).get(elastic_index,{}).get('mappings',{})
+        _mapping_cache['fetched'] = time.time()
+    if doctype is None:
+        return _mapping_cache['mappings']
+    return _mapping_cache['mappings'].get(doctype, {})
+
+def invalidate_mapping_cache():
+    '''Forget the cached mapping, so the next call to `get_mapping` asks elasticsearch'''
+    _mapping_cache['mappings'] = None
+
+def _note_doctypes(doctypes):
+    '''Invalidates the cached mapping when documents of unseen doctypes were inserted'''
+    known = _mapping_cache['mappings']
+    if known is not None and any(doctype not in known for doctype in doctypes):
+        logger.debug("New doctype inserted, invalidating mapping cache")
+        invalidate_mapping_cache()
+
+def index_fingerprint():
+    '''Returns a value that changes whenever documents are added, changed or
+    removed from the INCA index, to check whether cached results are still valid
+
+    Returns
+    ----
+    tuple
+        (number of documents, number of deleted documents, total index
+        operations, total delete operations) on the primary shards
+    '''
+    stats = client.indices.stats(index=elastic_index, metric='docs,indexing')
+    primaries = stats.get('_all',{}).get('primaries',{})
+    return (primaries.get('docs',{}).get('count',0),
+            primaries.get('docs',{}).get('deleted',0),
+            primaries.get('indexing',{}).get('index_total',0),
+            primaries.get('indexing',{}).get('delete_total',0))
+
 def check_mapping(doctype):
     '''
     Checks the way the field "doctype" is mapped to determine whether queries have to use doctype.keyword or doctype.
     Returns the string 'new_mapping' if the mapping of the doctype conforms to the specification as outlined in schema.json, 'mixed_mapping' if the doctype exists, but does not conform to the specification. In other cases, None is returned.
     '''
-    m = client.indices.get_mapping(elastic_index).get(elastic_index,{}).get('mappings',{}).get(doctype, {}).get('properties', {}).get('doctype', {})
+    m = get_mapping(doctype).get('properties', {}).get('doctype', {})
     try: 
         if m['type'] == 'keyword':
             mapping = 'new_mapping'
@@ -173,34 +266,48 @@ def delete_document(document_id):
     response = client.delete(index=elastic_index, id=document['_id'], doc_type=document['_type'])
     return True
 
-def delete_doctype(doctype):
-    '''Delete all documents of a given type'''
-    if check_mapping(doctype) == "mixed_mapping": 
+def delete_doctype(doctype, wait=True, slices=5, timeout=None):
+    '''Delete all documents of a given type
+
+    The documents are deleted by elasticsearch itself (`delete_by_query`),
+    which runs as a task that can be followed with `task_status` and stopped
+    with `cancel_task`.
+
+    Parameters
+    ----
+    doctype : string
+        The doctype to delete
+    wait : bool (default=True)
+        Whether to wait for elasticsearch to finish, logging progress along the
+        way. If False, the task id is returned immediately.
+    slices : int (default=5)
+        The number of slices elasticsearch processes in parallel
+    timeout : int (default=None)
+        The number of seconds to wait at most, see `wait_for_task`
+
+    Returns
+    ----
+    Bool or string
+        Whether the documents were deleted, or the task id if `wait` is False
+    '''
+    mapping = check_mapping(doctype)
+    if mapping == "mixed_mapping":
         field = "doctype.keyword"
-    elif check_mapping(doctype) == "new_mapping": 
+    elif mapping == "new_mapping":
         field = "doctype"
-    elif check_mapping(doctype) == None: 
+    elif mapping == None:
          logger.warning("Could not find mapping of doctype, please check whether you are using the correct doctype")
          return []
-    
-    for doc in scroll_query(
-        {
-        "query":
-            {
-            "bool":
-                {
-                "filter":
-                    {
-                    "term" : {
-                        field : doctype
-                    }
-                    }
-                }
-            }
-        }
-    ):
-        delete_document(doc['_id'])
-    return True
+
+    response = client.delete_by_query(index=elastic_index,
+                                      body={"query":{"bool":{"filter":{"term":{field:doctype}}}}},
+                                      conflicts='proceed', slices=slices,
+                                      wait_for_completion=False)
+    task_id = response['task']
+    logger.info("Deleting documents of {doctype} in task {task_id}".format(**locals()))
+    if not wait:
+        return task_id
+    return _task_succeeded(wait_for_task(task_id, timeout=timeout))
 
 def insert_document(document, custom_identifier=''):
     ''' Insert a new document into the default index '''
@@ -226,6 +333,7 @@ def insert_document(document, custom_identifier=''):
             doc = client.index(index=elastic_index, doc_type=document_type, body=document.get('_source',document), id=custom_identifier)
         except ConnectionTimeout:
             doc= {'_id':insert_document(document['_source'], custom_identifier)}
+    _note_doctypes([document_type])
     logger.debug('added new document, content: {document}'.format(**locals()))
     return doc["_id"]
 
@@ -274,6 +382,7 @@ def insert_documents(documents, identifiers='id'):
         doc['_type']  = doc['doctype']
     # Insert documents
     logger.debug(helpers.bulk(client, documents))
+    _note_doctypes(set(doc['_type'] for doc in documents))
     return [doc.get('_id','random') for doc in documents]
 
 
@@ -313,23 +422,156 @@ def update_or_insert_document(document, force=False, use_url = False):
                         
 
 
-def remove_field(query, field):
-    batch = []
-    for num, document in enumerate(scroll_query(query)):
-        try:
-            document['_source'].pop(field)
-        except:
-            logger.info('skipping {document[_id]}'.format(**locals()))
-            continue
-        try: document['_source']['META'].pop(field)
-        except: pass # This field could be missing
-        batch.append(document)
-        if (num+1) % 50 and batch:
-            logger.info("upserting batch %s" %((num+1) % 50 ))
-            bulk_upsert().run(batch)
-            batch = []
-    if batch: # in case of leftovers
-        bulk_upsert().run(batch)
+def remove_field(query, field, wait=True, slices=5, timeout=None):
+    '''Remove a field from all documents matching a query
+
+    The field (and its entry in META) are removed by elasticsearch itself
+    (`update_by_query`), which runs as a task that can be followed with
+    `task_status` and stopped with `cancel_task`.
+
+    Parameters
+    ----
+    query : dict
+        An elasticsearch query, as given to `scroll_query`
+    field : string
+        The top-level key to remove from the documents
+    wait : bool (default=True)
+        Whether to wait for elasticsearch to finish, logging progress along the
+        way. If False, the task id is returned immediately.
+    slices : int (default=5)
+        The number of slices elasticsearch processes in parallel
+    timeout : int (default=None)
+        The number of seconds to wait at most, see `wait_for_task`
+
+    Returns
+    ----
+    Bool or string
+        Whether the field was removed, or the task id if `wait` is False
+    '''
+    body = {
+        "query": {"bool": {
+            "must"   : query.get('query', {'match_all':{}}),
+            "filter" : {"exists": {"field": field}}
+        }},
+        "script": {
+            "lang"   : "painless",
+            "inline" : "ctx._source.remove(params.field); "
+                       "if (ctx._source.META instanceof Map) { ctx._source.META.remove(params.field) }",
+            "params" : {"field": field}
+        }
+    }
+    response = client.update_by_query(index=elastic_index, body=body,
+                                      conflicts='proceed', slices=slices,
+                                      wait_for_completion=False)
+    task_id = response['task']
+    logger.info("Removing {field} in task {task_id}".format(**locals()))
+    if not wait:
+        return task_id
+    return _task_succeeded(wait_for_task(task_id, timeout=timeout))
+
+def task_status(task_id):
+    '''Returns the status of an elasticsearch task
+
+    Parameters
+    ----
+    task_id : string
+        The id of the task, as returned by `delete_doctype` or `remove_field`
+        with `wait=False`
+
+    Returns
+    ----
+    dict
+        completed : bool
+            Whether the task has finished
+        total, updated, deleted : int
+            Progress of the task, as reported by elasticsearch
+        failures : list
+            Failures reported by elasticsearch once the task completed
+        cancelled : string or None
+            The reason the task was cancelled, if it was
+    '''
+    response = client.tasks.get(task_id=task_id)
+    status = response.get('task',{}).get('status',{})
+    return {
+        'completed' : response.get('completed', False),
+        'total'     : status.get('total', 0),
+        'updated'   : status.get('updated', 0),
+        'deleted'   : status.get('deleted', 0),
+        'failures'  : response.get('response',{}).get('failures',[]) + ([response['error']] if 'error' in response else []),
+        'cancelled' : response.get('response',{}).get('canceled') or status.get('canceled')
+    }
+
+def cancel_task(task_id):
+    '''Cancels a running elasticsearch task, such as a `delete_doctype`'''
+    logger.info("Cancelling task {task_id}".format(**locals()))
+    return client.tasks.cancel(task_id=task_id)
+
+def wait_for_task(task_id, poll_interval=5, timeout=None):
+    '''Blocks until an elasticsearch task has finished, logging its progress
+
+    Parameters
+    ----
+    task_id : string
+        The id of the task
+    poll_interval : int (default=5)
+        The number of seconds between progress checks
+    timeout : int (default=None)
+        The number of seconds after which to stop waiting. The task itself keeps
+        running in elasticsearch (see `cancel_task`).
+
+    Returns
+    ----
+    dict
+        The final status of the task (or the last one, after a timeout), see `task_status`
+    '''
+    started = time.time()
+    while True:
+        status = task_status(task_id)
+        if status['completed']:
+            break
+        if timeout is not None and time.time() - started >= timeout:
+            logger.warning("Stopped waiting for task {task_id} after {timeout} seconds".format(**locals()))
+            return status
+        logger.info("Task {task_id}: {done} of {status[total]} documents".format(
+            done=status['updated']+status['deleted'], **locals()))
+        time.sleep(poll_interval)
+    logger.info("Task {task_id} finished: {status[updated]} updated, {status[deleted]} deleted".format(**locals()))
+    return status
+
+def _task_succeeded(status):
+    if not status['completed']:
+        return False
+    if status['cancelled']:
+        logger.warning("Task was cancelled: {status[cancelled]}".format(**locals()))
+        return False
+    if status['failures']:
+        logger.warning("Task reported {n} failures, first: {first}".format(n=len(status['failures']), first=status['failures'][0]))
+        return False
+    return True
+
+def bulk_update_fields(updates, chunk_size=500):
+    '''Adds or replaces fields of existing documents with partial bulk updates
+
+    Unlike `bulk_upsert`, only the given fields are sent to elasticsearch,
+    not the whole document.
+
+    Parameters
+    ----
+    updates : iterable
+        dictionaries with the `_id` and `_type` of the document and a `doc`
+        key with the fields to set, e.g.
+        `{'_id':'abc', '_type':'nu', 'doc':{'topic':3}}`
+    chunk_size : int (default=500)
+        The number of updates sent to elasticsearch per request
+
+    Returns
+    ----
+    tuple
+        The number of updated documents and a list of errors
+    '''
+    actions = ({'_op_type':'update', '_index':elastic_index, '_type':update['_type'],
+                '_id':update['_id'], 'doc':update['doc']} for update in updates)
+    return helpers.bulk(client, actions, chunk_size=chunk_size, raise_on_error=False)
 
 class bulk_upsert(Task):
     '''Processers can generate far more updates than elasticsearch wants to handle.
@@ -119,22 +119,10 @@ class Document(Task):
         '''
         if type(document)==list:
             return [self._add_metadata(doc) for doc in document]
-        try:    docstring = self.get.__doc__
-        except:
-            try: docstring = self.process.__doc__
-            except: docstring = self.run.__doc__
 
         document['doctype'] = self.doctype
 
-        meta = dict(
-            ADDED_AT              = datetime.datetime.now(),
-            ADDED_USING           =str(self.__class__).split(' ')[1],
-            ADDED_METHOD          = docstring,
-            FUNCTION_VERSION      = self.version,
-            FUNCTION_VERSION_DATE = self.date,
-            FUNCTION_TYPE         = self.functiontype,
-            FUNCTION_ARGUMENTS    = kwargs
-            )
+        meta = self._metadata(**kwargs)
 
         if not document.get('META',False):
             document['META']=dict(ADDED=datetime.datetime.now())
@@ -146,6 +134,27 @@ class Document(Task):
 
         return document
 
+    def _metadata(self, **kwargs):
+        '''
+        DO NOT OVERWRITE THIS METHOD
+
+        Returns the metadata describing keys added by this script (see _add_metadata)
+        '''
+        try:    docstring = self.get.__doc__
+        except:
+            try: docstring = self.process.__doc__
+            except: docstring = self.run.__doc__
+
+        return dict(
+            ADDED_AT              = datetime.datetime.now(),
+            ADDED_USING           =str(self.__class__).split(' ')[1],
+            ADDED_METHOD          = docstring,
+            FUNCTION_VERSION      = self.version,
+            FUNCTION_VERSION_DATE = self.date,
+            FUNCTION_TYPE         = self.functiontype,
+            FUNCTION_ARGUMENTS    = kwargs
+            )
+
     def _verify(self, document):
         '''
         DO NOT OVERWRITE THIS METHOD
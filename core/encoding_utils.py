@@ -0,0 +1,171 @@
+'''
+This file provides encoding detection for files that are imported into INCA.
+
+Detection tries the cheap options first:
+
+1. a byte order mark (BOM)
+2. strict UTF-8 decoding of a sample from the start of the file
+3. an encoding hint, such as the encoding found for a neighbouring file
+4. a compiled detector (cchardet or charset-normalizer), if installed
+5. chardet's incremental UniversalDetector, which stops reading as soon as
+   it is confident
+
+Results are cached per (path, size, modification time), so asking twice for
+the same file is free.
+'''
+
+import codecs
+import logging
+import os
+from chardet.universaldetector import UniversalDetector
+
+logger = logging.getLogger("INCA."+__name__)
+
+try:
+    import cchardet as _compiled_detector
+except ImportError:
+    try:
+        import charset_normalizer as _compiled_detector
+    except ImportError:
+        _compiled_detector = None
+
+SAMPLE_SIZE = 65536            # bytes used for the fast checks
+MAX_DETECTION_SIZE = 10000000  # never feed more than this to chardet
+MIN_CONFIDENCE = 0.9           # below this, compiled detectors are ignored
+
+_BOMS = [
+    # UTF-32 first, as the UTF-32-LE BOM starts with the UTF-16-LE BOM
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8,     'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+_cache = {}
+_MAX_CACHE_SIZE = 100000
+
+
+def _decodes_as(sample, encoding, final=False):
+    '''Checks whether a sample decodes strictly in a given encoding.
+    When `final` is False, a multi-byte character cut off at the end of the
+    sample does not count as a failure.'''
+    try:
+        codecs.getincrementaldecoder(encoding)(errors='strict').decode(sample, final=final)
+        return True
+    except (UnicodeError, LookupError):
+        return False
+
+def _ascii_compatible(encoding):
+    '''Checks whether an encoding reads ascii bytes as ascii (unlike, e.g., utf-16)'''
+    ascii_bytes = bytes(range(128))
+    try:
+        return codecs.decode(ascii_bytes, encoding, 'strict') == ascii_bytes.decode('ascii')
+    except (UnicodeError, LookupError):
+        return False
+
+def _normalize(encoding):
+    # ascii files are valid utf-8, which is more forgiving when non-ascii
+    # characters turn up after the part we looked at
+    if not encoding or encoding.lower() == 'ascii':
+        return 'utf-8'
+    return encoding.lower()
+
+def _universal_detect(filebuf, sample):
+    detector = UniversalDetector()
+    detector.feed(sample)
+    consumed = len(sample)
+    while not detector.done and consumed < MAX_DETECTION_SIZE:
+        chunk = filebuf.read(SAMPLE_SIZE)
+        if not chunk:
+            break
+        detector.feed(chunk)
+        consumed += len(chunk)
+    detector.close()
+    logger.debug("chardet needed {consumed} bytes: {detector.result}".format(**locals()))
+    return detector.result.get('encoding')
+
+def sniff_encoding(filebuf, hint=None, sample_size=SAMPLE_SIZE):
+    '''Detects the encoding of an (binary) file object
+
+    Parameters
+    ----
+    filebuf : file object
+        A file opened in binary mode, positioned at the start
+    hint : string (default=None)
+        An encoding to prefer if the contents decode with it, for instance the
+        encoding of other files from the same source
+    sample_size : int (default=65536)
+        The number of bytes to use for the fast checks
+
+    Returns
+    ----
+    string
+        The name of the encoding, suitable for `open(..., encoding=...)`
+    '''
+    sample = filebuf.read(sample_size)
+    complete = len(sample) < sample_size
+
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    if _decodes_as(sample, 'ascii', final=complete):
+        # nothing to learn from this sample, unless it is all there is
+        if complete:
+            if hint and _decodes_as(sample, hint, final=True) and _ascii_compatible(hint):
+                return _normalize(hint)
+            return 'utf-8'
+    elif _decodes_as(sample, 'utf-8', final=complete):
+        # non-ascii text that happens to be valid utf-8 is almost certainly utf-8
+        return 'utf-8'
+    elif hint and _decodes_as(sample, hint, final=complete):
+        return _normalize(hint)
+    elif _compiled_detector:
+        result = _compiled_detector.detect(sample)
+        if result.get('encoding') and (result.get('confidence') or 0) >= MIN_CONFIDENCE:
+            return _normalize(result['encoding'])
+
+    return _normalize(_universal_detect(filebuf, sample))
+
+def detect_encoding(filename, hint=None, sample_size=SAMPLE_SIZE, cache=True):
+    '''Detects the encoding of a file
+
+    Parameters
+    ----
+    filename : string
+        The file to inspect
+    hint : string (default=None)
+        An encoding to prefer if the contents decode with it
+    sample_size : int (default=65536)
+        The number of bytes to use for the fast checks
+    cache : bool (default=True)
+        Whether to re-use earlier results for unchanged files
+
+    Returns
+    ----
+    string or False
+        The name of the encoding, or False if the file does not exist
+    '''
+    try:
+        stat = os.stat(filename)
+    except (IOError, OSError):
+        logger.warning("File `{filename}` does not seem to exist".format(filename=filename))
+        return False
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+    if cache and key in _cache:
+        return _cache[key]
+
+    with open(filename, mode='rb') as filebuf:
+        encoding = sniff_encoding(filebuf, hint=hint, sample_size=sample_size)
+    logger.debug("detected {encoding} for {filename}".format(**locals()))
+
+    if cache:
+        if len(_cache) >= _MAX_CACHE_SIZE:
+            _cache.clear()
+        _cache[key] = encoding
+    return encoding
+
+def clear_cache():
+    '''Forget all previously detected encodings'''
+    _cache.clear()
@@ -0,0 +1,297 @@
+'''
+This file provides a registry of the tasks (scrapers, processors, analyses,
+clients and importers/exporters) in the INCA packages.
+
+The registry reads the source files instead of importing them, so INCA can
+list its tasks without importing the dependencies of every task. The result
+of reading a file is kept in a manifest file, and files are only read again
+when they change. The module of a task is imported when the task is first
+used (see `get_task`).
+'''
+
+import ast
+import configparser
+import importlib
+import json
+import logging
+import os
+
+logger = logging.getLogger("INCA."+__name__)
+
+INCADIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+config = configparser.ConfigParser()
+config.read(os.path.join(INCADIR, 'settings.cfg'))
+
+MANIFEST = os.path.join(INCADIR, os.path.expanduser(
+    config.get('inca', 'plugin_manifest', fallback='plugin_manifest.json')))
+
+MANIFEST_VERSION = 1
+
+# the packages containing tasks, with the file ending of their modules
+PACKAGES = {
+    'scrapers'            : '_scraper.py',
+    'rssscrapers'         : '_scraper.py',
+    'processing'          : '_processing.py',
+    'analysis'            : '_analysis.py',
+    'clients'             : '_client.py',
+    'importers_exporters' : '.py',
+}
+
+# the methods that document a task, per package, see `Inca._construct_tasks`
+DOC_METHODS = {
+    'scrapers'            : ['get'],
+    'rssscrapers'         : ['get'],
+    'processing'          : ['process'],
+    'importers_exporters' : ['load', 'save'],
+}
+
+TASK_BASES = [('celery', 'Task'), ('celery.app.task', 'Task')]
+
+_tasks = None
+
+def _package_modules(package):
+    '''Lists the modules of a package as its __init__ used to import them'''
+    ending = PACKAGES[package]
+    return sorted('.'.join([package, fname[:-3]]) for fname in os.listdir(os.path.join(INCADIR, package))
+                  if fname.endswith(ending) and not fname.startswith('.') and fname != '__init__.py')
+
+def _module_file(module):
+    path = os.path.join(INCADIR, *module.split('.')) + '.py'
+    if os.path.isfile(path):
+        return path
+    path = os.path.join(INCADIR, *module.split('.') + ['__init__.py'])
+    if os.path.isfile(path):
+        return path
+
+def _dotted(node):
+    '''Turns a base class expression (`Task`, `celery.Task`) into a string'''
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        value = _dotted(node.value)
+        return value and "{value}.{node.attr}".format(**locals())
+
+def _constant(node):
+    if isinstance(node, getattr(ast, 'Constant', ())):
+        return node.value
+    if isinstance(node, getattr(ast, 'Str', ())):
+        return node.s
+    if isinstance(node, getattr(ast, 'NameConstant', ())):
+        return node.value
+
+def _scan(module, path):
+    '''Reads the classes and imports of a module without importing it
+
+    Returns
+    ----
+    dict
+        `classes` maps class names to their bases, docstring, method
+        docstrings and (string or boolean) class attributes, `imports` maps
+        imported names to [module, name] and `star` lists the modules
+        imported with `*`
+    '''
+    package = module.rsplit('.', 1)[0] if not path.endswith('__init__.py') else module
+    with open(path, encoding='utf-8') as fileobj:
+        tree = ast.parse(fileobj.read(), path)
+    scan = {'classes':{}, 'imports':{}, 'star':[]}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            attributes, methods = {}, {}
+            for item in node.body:
+                if isinstance(item, ast.FunctionDef):
+                    methods[item.name] = ast.get_docstring(item, clean=False) or ''
+                elif isinstance(item, ast.Assign) and len(item.targets) == 1 and isinstance(item.targets[0], ast.Name):
+                    value = _constant(item.value)
+                    if isinstance(value, (str, bool)):
+                        attributes[item.targets[0].id] = value
+            scan['classes'][node.name] = {'bases':[_dotted(base) for base in node.bases],
+                                          'doc':ast.get_docstring(node, clean=False),
+                                          'methods':methods, 'attributes':attributes}
+        elif isinstance(node, ast.ImportFrom):
+            source = node.module or ''
+            if node.level:
+                parent = package.split('.')
+                parent = parent[:len(parent) - node.level + 1]
+                source = '.'.join(parent + ([source] if source else []))
+            for alias in node.names:
+                if alias.name == '*':
+                    scan['star'].append(source)
+                else:
+                    scan['imports'][alias.asname or alias.name] = [source, alias.name]
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                scan['imports'][alias.asname or alias.name.split('.')[0]] = [alias.asname and alias.name or alias.name.split('.')[0], None]
+    return scan
+
+class _Resolver():
+    '''Resolves base classes across (scanned) modules'''
+
+    def __init__(self, files):
+        self.files = files # the manifest entries per file, updated when a file is (re)scanned
+        self.scans = {}
+        self.changed = False
+        self._is_task = {}
+
+    def scan(self, module):
+        if module not in self.scans:
+            path = _module_file(module)
+            if not path:
+                self.scans[module] = None
+                return None
+            relpath = os.path.relpath(path, INCADIR)
+            mtime = os.path.getmtime(path)
+            entry = self.files.get(relpath)
+            if not entry or entry['mtime'] != mtime:
+                try:
+                    entry = {'mtime':mtime, 'scan':_scan(module, path)}
+                except (SyntaxError, UnicodeDecodeError, ValueError) as e:
+                    logger.warning("Could not read {path}: {e}".format(**locals()))
+                    entry = {'mtime':mtime, 'scan':None}
+                self.files[relpath] = entry
+                self.changed = True
+            self.scans[module] = entry['scan']
+        return self.scans[module]
+
+    def resolve(self, module, name, seen=None):
+        '''Returns the (module, name) where a class used in a module is defined'''
+        seen = seen or set()
+        if (module, name) in seen:
+            return None
+        seen.add((module, name))
+        scan = self.scan(module)
+        if scan is None:
+            return (module, name) # not part of INCA, e.g. celery
+        if '.' in name:
+            head, rest = name.split('.', 1)
+            target = scan['imports'].get(head)
+            if target and target[1] is not None and _module_file('.'.join(target)):
+                target = ['.'.join(target), None] # from package import module
+            if target and target[1] is None:
+                submodule, name = rest.rsplit('.', 1) if '.' in rest else ('', rest)
+                return self.resolve('.'.join(filter(None, [target[0], submodule])), name, seen)
+            return None
+        if name in scan['classes']:
+            return (module, name)
+        if name in scan['imports']:
+            source, imported = scan['imports'][name]
+            return imported and self.resolve(source, imported, seen)
+        for source in scan['star']:
+            found = self.resolve(source, name, seen)
+            if found and (self.scan(found[0]) is None or name in self.scan(found[0])['classes']):
+                return found
+
+    def bases(self, module, name):
+        cls = self.scan(module)['classes'][name]
+        return [self.resolve(module, base) for base in cls['bases'] if base]
+
+    def is_task(self, module, name):
+        key = (module, name)
+        if key not in self._is_task:
+            self._is_task[key] = False # guards against circular definitions
+            scan = self.scan(module)
+            if key in TASK_BASES:
+                self._is_task[key] = True
+            elif scan and name in scan['classes']:
+                self._is_task[key] = any(base and self.is_task(*base) for base in self.bases(module, name))
+        return self._is_task[key]
+
+    def lookup(self, module, name, key, what='methods', seen=None):
+        '''Returns a method docstring or class attribute, following the base classes'''
+        seen = seen or set()
+        scan = self.scan(module)
+        if (module, name) in seen or not scan or name not in scan['classes']:
+            return None
+        seen.add((module, name))
+        cls = scan['classes'][name]
+        if key in cls[what]:
+            return cls[what][key]
+        for base in self.bases(module, name):
+            if base:
+                value = self.lookup(base[0], base[1], key, what, seen)
+                if value is not None:
+                    return value
+
+def _load_manifest():
+    try:
+        with open(MANIFEST) as fileobj:
+            manifest = json.load(fileobj)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (IOError, OSError, ValueError):
+        pass
+    return {'version':MANIFEST_VERSION, 'files':{}}
+
+def _save_manifest(manifest):
+    tmp = MANIFEST + '.tmp'
+    try:
+        with open(tmp, 'w') as fileobj:
+            json.dump(manifest, fileobj)
+        os.replace(tmp, MANIFEST)
+    except (IOError, OSError) as e:
+        logger.debug("Could not write the plugin manifest {MANIFEST}: {e}".format(MANIFEST=MANIFEST, **locals()))
+
+def tasks(package=None, refresh=False):
+    '''Lists the tasks in the INCA packages
+
+    Parameters
+    ----
+    package : string (default=None)
+        Only list the tasks of this package, e.g. 'scrapers'
+    refresh : bool (default=False)
+        Re-read all files instead of using the manifest
+
+    Returns
+    ----
+    list
+        A dictionary per task with its (celery) `name`, `module`, `classname`,
+        `package`, `doc` (as shown for the task by Inca) and `service_name`
+        (for the main class of a client)
+    '''
+    global _tasks
+    if _tasks is None or refresh:
+        manifest = refresh and {'version':MANIFEST_VERSION, 'files':{}} or _load_manifest()
+        resolver = _Resolver(manifest['files'])
+        found = []
+        for pkg in sorted(PACKAGES):
+            for module in _package_modules(pkg):
+                scan = resolver.scan(module)
+                if not scan: continue
+                for classname, cls in sorted(scan['classes'].items()):
+                    if cls['attributes'].get('abstract') or not resolver.is_task(module, classname):
+                        continue
+                    doc = cls['doc']
+                    for method in DOC_METHODS.get(pkg, []):
+                        doc = resolver.lookup(module, classname, method)
+                        if doc is not None: break
+                    service_name = resolver.lookup(module, classname, 'service_name', 'attributes')
+                    name = cls['attributes'].get('name') or '.'.join([module, classname])
+                    found.append({'name':name, 'module':module,
+                                  'classname':classname, 'package':pkg, 'doc':doc,
+                                  'service_name':service_name == classname and service_name or None})
+        if resolver.changed or refresh:
+            _save_manifest(manifest)
+        _tasks = found
+    return [task for task in _tasks if package is None or task['package'] == package]
+
+def modules():
+    '''Lists the modules containing tasks, e.g. for celery workers to import'''
+    return sorted(set(task['module'] for task in tasks()))
+
+def get_task(name, app):
+    '''Returns the celery task with this name, importing its module if needed
+
+    Parameters
+    ----
+    name : string
+        The name of the task, e.g. 'scrapers.nu_scraper.nu'
+    app : Celery
+        The celery app with which tasks are registered
+    '''
+    if name not in app.tasks:
+        # tasks can set their own name, so the module is looked up
+        modules = [task['module'] for task in tasks() if task['name'] == name]
+        module = modules and modules[0] or name.rsplit('.', 1)[0]
+        logger.debug("importing {module}".format(**locals()))
+        importlib.import_module(module)
+    return app.tasks[name]
@@ -10,13 +10,20 @@ yields a key:value pair per document, but does not need to return the old docume
 
 '''
 
+import datetime
+import json
 import logging
+import os
 from core.document_class import Document
 from core.database import get_document, update_document, check_exists, config
+from core import result_cache
 import core
 
 logger = logging.getLogger(__name__)
 
+WATERMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          os.path.expanduser(config.get('inca', 'processor_watermarks', fallback='processor_watermarks.json')))
+
 class Processer(Document):
     '''
     Processors change individual documents, for example by tokenizing, lemmatizing
@@ -28,6 +35,7 @@ class Processer(Document):
     '''
 
     functiontype = 'processing'
+    cacheable    = False # set to True for deterministic processors, to reuse results of identical input (see core.result_cache)
 
     def __init__(self, test=True, async=True):
         '''Override test to save results and return an ID list instead of updated documents'''
@@ -42,6 +50,68 @@ class Processer(Document):
         '''CHANGE THIS METHOD, should return the changed document'''
         return updated_field
 
+    def process_batch(self, document_fields, *args, **kwargs):
+        '''Processes the fields of a batch of documents at once, overwrite this method if
+        a batch can be processed faster than the fields one by one'''
+        return [self.process(document_field, *args, **kwargs) for document_field in document_fields]
+
+    def _use_cache(self, cache=None):
+        '''Whether to use the result cache, by default as set in the [processorcache] section of settings.cfg'''
+        if cache is None:
+            cache = result_cache.ENABLED
+        return bool(cache) and self.cacheable
+
+    def _cache_key(self, document_field, args, kwargs):
+        processor = "{}.{}".format(type(self).__module__, type(self).__name__)
+        return result_cache.ResultCache.key(processor, result_cache.code_version(type(self)),
+                                            document_field, args, kwargs)
+
+    def _process_cached(self, document_field, *args, **kwargs):
+        '''Returns the cached result for this input, or processes and caches it'''
+        cache  = result_cache.get_cache()
+        key    = self._cache_key(document_field, args, kwargs)
+        result = cache.get(key)
+        if result is result_cache.MISSING:
+            result = self.process(document_field, *args, **kwargs)
+            if result is not None: # processors return None on failure
+                cache.set(key, result)
+        return result
+
+    def _process_batch_cached(self, document_fields, *args, **kwargs):
+        '''As process_batch, but only processes (unique) fields without a cached result'''
+        cache   = result_cache.get_cache()
+        keys    = [self._cache_key(document_field, args, kwargs) for document_field in document_fields]
+        results = {}
+        todo    = {}
+        for key, document_field in zip(keys, document_fields):
+            if key in results or key in todo: continue
+            result = cache.get(key)
+            if result is result_cache.MISSING:
+                todo[key] = document_field
+            else:
+                results[key] = result
+        if todo:
+            logger.debug("{hits} of {total} fields found in the result cache".format(
+                hits=len(document_fields)-len(todo), total=len(document_fields)))
+            for key, result in zip(todo, self.process_batch(list(todo.values()), *args, **kwargs)):
+                results[key] = result
+                if result is not None:
+                    cache.set(key, result)
+        return [results[key] for key in keys]
+
+    def _is_done(self, source, new_key):
+        '''Whether a document already has the result of this version of the processor under new_key
+
+        A result of None (processors return None on failure) is not done, as in the selection
+        of documents in _doctype_query_or_list.
+        '''
+        if source.get(new_key) is None:
+            return False
+        if not self.version:
+            return True
+        meta = source.get('META', {}).get(new_key, {})
+        return meta.get('FUNCTION_VERSION') == self.version
+
     def runwrap(self, docs_or_query,action='run' , *args, **kwargs):
         '''
         Run a processor by supplying a list of documents, a query or a doctype .
@@ -52,9 +122,19 @@ class Processer(Document):
         docs_or_query:
             either a list of documents, an elasticsearch query or a string specifying the doctype
         action: on of ['run','delay', 'batch' ]
+        incremental: bool (keyword only, default=False)
+            only process documents added since the last run with the same selection,
+            see _doctype_query_or_list
 
         '''
-        documents = _doctype_query_or_list(docs_or_query)
+        # the arguments of run that determine which documents need processing
+        positional = ['field'] if action == 'batch' else ['field', 'new_key', 'save', 'force']
+        selection = dict(zip(positional, args))
+        selection.update({key:kwargs[key] for key in ['field', 'new_key', 'force'] if key in kwargs})
+        documents = _doctype_query_or_list(docs_or_query, force=selection.get('force', False),
+                                           field=selection.get('field'), task=self.__name__,
+                                           new_key=selection.get('new_key'), version=self.version,
+                                           incremental=kwargs.pop('incremental', False))
 
         if action == 'run':
             for doc in documents:
@@ -65,15 +145,34 @@ class Processer(Document):
                 for placeholder in self.delay(doc,*args,**kwargs):
                     yield placeholder
         elif action == 'batch':
+            # processes the field of bulksize documents at once (see process_batch) and saves them together
+            if 'field' in kwargs:
+                field = kwargs.pop('field')
+            else:
+                field, args = args[0], args[1:]
+            bulksize = kwargs.pop('bulksize', 500)
+            force    = kwargs.pop('force', False)
+            new_key  = kwargs.pop('new_key', None) or "%s_%s" %(field, self.__name__)
+            kwargs.pop('save', None)
+            if self._use_cache(kwargs.pop('cache', None)):
+                process_batch = self._process_batch_cached
+            else:
+                process_batch = self.process_batch
             for num, batch in enumerate(_batcher(documents, batchsize=bulksize)):
-                core.database.bulk_upsert().run(documents=[target_func.run(document=doc,
-                                        field=field, force=force, *args, **kwargs) for
-                                       doc in batch ] )
+                batch = [doc if type(doc)==dict else get_document(doc) for doc in batch]
+                todo  = [doc for doc in batch if field in doc['_source'] and
+                         (force or not self._is_done(doc['_source'], new_key))]
+                if todo:
+                    results = process_batch([doc['_source'][field] for doc in todo], *args, **kwargs)
+                    for doc, result in zip(todo, results):
+                        doc['_source'][new_key] = result
+                        doc['_source'].get('META', {}).pop(new_key, None) # replaced by the metadata of this version
+                        doc['_source'] = self._add_metadata(doc['_source'])
+                    core.database.bulk_upsert().run(documents=todo)
                 now = datetime.datetime.now()
                 logger.info("processed batch {num} {now}".format(**locals()))
                 yield batch
 
-
         elif action == 'celery_batch':
             for batch in _batcher(documents, batchsize=bulksize):
                 if not batch: continue #ignore empty batches
@@ -105,7 +204,12 @@ class Processer(Document):
             indicates whether the document should replace (true) or only
             expand existing documents (false). Note that partial updates
             are not supported when forcing.
+        cache: boolean (keyword only)
+            whether to reuse the result of identical input from the result cache,
+            by default as set in the [processorcache] section of settings.cfg.
+            Only used by processors that are `cacheable`.
         '''
+        cache = kwargs.pop('cache', None)
 
         # 1. check if document or id --> return doc
         logger.debug("trying to process: ",document)
@@ -125,7 +229,9 @@ class Processer(Document):
         if not new_key:
             new_key =  "%s_%s" %(field, self.__name__)
         # 2. check whether processing can be skipped
-        if not force and new_key in document['_source'].keys(): return document
+        if not force and self._is_done(document['_source'], new_key): return document
+        # the result of another version is replaced, not expanded
+        outdated = new_key in document['_source']
         # 3. return None if key is missing
         if not field in document['_source'].keys():
             print(document['_source'].keys())
@@ -134,20 +240,26 @@ class Processer(Document):
                 document = document['_source']
             return document
         # 4. process document
-        document['_source'][new_key] = self.process(document['_source'][field], *args, **kwargs)
+        if self._use_cache(cache):
+            document['_source'][new_key] = self._process_cached(document['_source'][field], *args, **kwargs)
+        else:
+            document['_source'][new_key] = self.process(document['_source'][field], *args, **kwargs)
         # 3. add metadata
+        if outdated:
+            document['_source'].get('META', {}).pop(new_key, None)
         document['_source'] = self._add_metadata(document['_source'])
         # 4. check metadata
         self._verify(document['_source'])
         # 5. save if requested
-        if save: update_document(document, force=force)
+        if save: update_document(document, force=force or outdated)
         # 6. emit dotkey-field
         if masked:
             document = document['_source']
         return document
 
 
-def _doctype_query_or_list(doctype_query_or_list, force=False, field=None, task=None):
+def _doctype_query_or_list(doctype_query_or_list, force=False, field=None, task=None, new_key=None,
+                           version=None, incremental=False):
     '''
     This function helps other functions dynamically interpret the argument for document selection.
     It allows for either a list of documents, an elasticsearch query, a string-query or a doctype
@@ -168,42 +280,84 @@ def _doctype_query_or_list(doctype_query_or_list, force=False, field=None, task=
     task: string (default=None)
         Function for which the documents are used. Argument is used only to generate the expected outcome
         fieldname, i.e. <field>_<function>
+    new_key: string (default=None)
+        The expected outcome fieldname, if it is not <field>_<function>
+    version: string (default=None)
+        The version of the function. If given (and force=False), documents where the outcome field was
+        added by another version (according to META.<outcome>.FUNCTION_VERSION) are selected as well
+    incremental: bool (default=False)
+        Only select documents added (META.ADDED) since the last run with the same selection, task and
+        outcome field. The time of the last added document is stored once all documents are iterated.
+        Documents added before that time are not selected again, also when their result failed (is None)
+        or was written by another version; run without incremental to process these.
 
     Returns
     -------
     Iterable
     '''
     if type(doctype_query_or_list)==list:
-        documents = doctype_query_or_list
-    elif type(doctype_query_or_list)==str:
-        if doctype_query_or_list in core.database.client.indices.get_mapping()[config.get('elasticsearch','document_index')]['mappings'].keys():
+        return doctype_query_or_list
+
+    if type(doctype_query_or_list)==str:
+        if doctype_query_or_list in core.database.get_mapping():
             logger.info("assuming documents of given type should be processed")
-            if force or not field:
-                documents = core.database.scroll_query({'query':{'match':{'doctype':"%s"%doctype_query_or_list}}})
-            elif not force and field:
-                logger.info("force=False, ignoring documents where the result key exists (and has non-NULL value)")
-                documents = core.database.scroll_query(
-                    {'filter':{'and': [
-                            {'match':{'doctype':doctype_query_or_list}},
-                            {'missing':{'field': '%s_%s' %(field, task)}}]
-                               }})
+            body = {'query':{'match':{'doctype':"%s"%doctype_query_or_list}}}
         else:
             logger.info("assuming input is a query_string")
-            if force or not field:
-                documents = core.database.scroll_query({'query':{'query_string':{'query': doctype_query_or_list}}})
-            elif not force and field:
-                logger.info("force=False, ignoring documents where the result key exists (and has non-NULL value)")
-                documents = core.database.scroll_query({'query':{'and':[
-                    {'missing':{'field':'%s_%s' %(field, task)}},
-                    {'query_string':{'query':doctype_query_or_list}}
-                ]}})
+            body = {'query':{'query_string':{'query': doctype_query_or_list}}}
     else:
-        if not force and field and task and not doctype_query_or_list:
-            field = '%s_%s' %(field, task)
-            doctype_query_or_list.update({'query':{'missing':{'field':field}}})
-        documents = core.database.scroll_query(doctype_query_or_list)
+        body = dict(doctype_query_or_list)
+
+    must_not = []
+    filters  = []
+    key = new_key or (field and task and '%s_%s' %(field, task))
+    if not force and key:
+        logger.info("force=False, ignoring documents where the result key exists (and has non-NULL value)")
+        if version:
+            must_not.append({'bool':{'must':[{'exists':{'field':key}},
+                                             {'match_phrase':{'META.%s.FUNCTION_VERSION' %key:version}}]}})
+        else:
+            must_not.append({'exists':{'field':key}})
+    if incremental:
+        watermark_key = json.dumps([body, key, task], sort_keys=True, default=str)
+        since = _load_watermarks().get(watermark_key)
+        if since is not None:
+            logger.info("only selecting documents added after {since}".format(
+                since=datetime.datetime.utcfromtimestamp(since/1000.)))
+            filters.append({'range':{'META.ADDED':{'gt':int(since), 'format':'epoch_millis'}}})
+
+    if must_not or filters:
+        body['query'] = {'bool':{'must':[body.get('query', {'match_all':{}})],
+                                 'must_not':must_not, 'filter':filters}}
+    documents = core.database.scroll_query(body)
+
+    if incremental:
+        # the watermark is determined before scrolling, so documents added during this run are selected next time
+        last = core.database.client.search(body={'query':body.get('query', {'match_all':{}}), 'size':0,
+                                                 'aggs':{'last_added':{'max':{'field':'META.ADDED'}}}})
+        last = last['aggregations']['last_added']['value']
+        if last is not None:
+            last = int(last) # elasticsearch returns a float, which epoch_millis does not accept
+        documents = _update_watermark(documents, watermark_key, last)
     return documents
 
+def _load_watermarks():
+    try:
+        with open(WATERMARKS) as fileobj:
+            return json.load(fileobj)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _update_watermark(documents, watermark_key, last):
+    '''Yields the documents, and stores the watermark of the selection once all are yielded'''
+    for document in documents:
+        yield document
+    if last is None: return
+    watermarks = _load_watermarks()
+    watermarks[watermark_key] = max(last, watermarks.get(watermark_key) or last)
+    with open(WATERMARKS, 'w') as fileobj:
+        json.dump(watermarks, fileobj)
+
 def _batcher(stuff, batchsize=10):
     batch = []
     for num,thing in enumerate(stuff):
@@ -0,0 +1,147 @@
+'''
+This file provides an on-disk cache of processor results.
+
+Results are stored by a hash of the processor, its version, its arguments
+and the content of the processed field, so identical inputs (such as
+syndicated or re-scraped texts) are only processed once. The cache is an
+SQLite file that is shared by processes, and the least recently used
+results are removed when it exceeds its maximum size.
+
+Caching is configured in the `[processorcache]` section of settings.cfg and
+only applies to processors with `cacheable = True`. Results are invalidated
+when the `version` of a processor or the source file defining it changes.
+'''
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from core.database import config
+
+logger = logging.getLogger("INCA."+__name__)
+
+ENABLED   = config.getboolean('processorcache', 'enabled', fallback=False)
+CACHEPATH = os.path.expanduser(config.get('processorcache', 'cachepath', fallback='~/Downloads/incacache/processors.sqlite'))
+MAXSIZE   = int(config.get('processorcache', 'maxsize', fallback='1024')) * 1024 * 1024 # in MB
+CHECK_EVERY = 1000 # the number of stored results between checks of the cache size
+
+MISSING = object()
+
+class ResultCache():
+    '''
+    A size-bounded key-value store of (pickled) results in an SQLite file
+
+    Parameters
+    ----
+    path : string (default=CACHEPATH)
+        The SQLite file, created if it does not exist
+    maxsize : int (default=MAXSIZE)
+        The maximum size of the stored results in bytes
+    '''
+
+    def __init__(self, path=CACHEPATH, maxsize=MAXSIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._stored = 0
+
+    def _connection(self):
+        # sqlite connections should not be shared between threads or (forked) processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS results "
+                               "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+            connection.commit()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    @staticmethod
+    def key(processor, version, value, args=(), kwargs={}):
+        '''Returns the key of a result, a hash of the processor, its version and arguments and the input value'''
+        description = json.dumps([processor, version, args, kwargs, value], sort_keys=True, default=str)
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''Returns the result stored under a key, or MISSING'''
+        connection = self._connection()
+        row = connection.execute("SELECT value FROM results WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return MISSING
+        with connection:
+            connection.execute("UPDATE results SET used=? WHERE key=?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def set(self, key, result):
+        '''Stores a result, results that cannot be pickled are not stored'''
+        try:
+            value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.debug("Not caching an unpicklable result: {e}".format(**locals()))
+            return
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?,?,?,?)",
+                               (key, sqlite3.Binary(value), len(value), time.time()))
+        self._stored += 1
+        if self._stored % CHECK_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        '''Removes the least recently used results until the cache is below 90% of its maximum size'''
+        connection = self._connection()
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.maxsize:
+            return 0
+        excess = total - .9 * self.maxsize
+        freed, cutoff = 0, None
+        for size, used in connection.execute("SELECT size, used FROM results ORDER BY used"):
+            freed += size
+            cutoff = used
+            if freed >= excess: break
+        with connection:
+            removed = connection.execute("DELETE FROM results WHERE used <= ?", (cutoff,)).rowcount
+        logger.info("removed {removed} results from the processor cache".format(**locals()))
+        return removed
+
+    def clear(self):
+        '''Removes all results'''
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM results")
+
+    def stats(self):
+        '''Returns the number of results and their total size in bytes'''
+        count, size = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {'results':count, 'size':size, 'maxsize':self.maxsize, 'path':self.path}
+
+_cache = None
+_code_versions = {}
+
+def code_version(cls):
+    '''Returns the version of a task class combined with a hash of the file defining it'''
+    if cls not in _code_versions:
+        try:
+            with open(inspect.getfile(cls), 'rb') as fileobj:
+                source = hashlib.sha1(fileobj.read()).hexdigest()
+        except (IOError, OSError, TypeError):
+            source = ''
+        _code_versions[cls] = "{version}-{source}".format(version=getattr(cls, 'version', ''), **locals())
+    return _code_versions[cls]
+
+def get_cache():
+    '''Returns the (per process) result cache configured in settings.cfg'''
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
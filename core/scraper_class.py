@@ -70,7 +70,7 @@ class Scraper(Document):
         resulting documents.
         '''
         logger.info("Started scraping")
-        if DATABASE_AVAILABLE == True and self.database==True:
+        if DATABASE_AVAILABLE and self.database==True:
             for doc in self.get(*args, **kwargs):
                 if type(doc)==dict:
                     doc = self._add_metadata(doc)
@@ -5,7 +5,8 @@ from core.database import client as _client
 from core.database import scroll_query as _scroll_query
 from core.database import elastic_index as _elastic_index
 from core.database import DATABASE_AVAILABLE as _DATABASE_AVAILABLE
-from core.database import delete_doctype, delete_document, check_mapping
+from core.database import delete_doctype, delete_document, check_mapping, get_mapping
+from core.database import remove_field, task_status, cancel_task
 import logging as _logging
 from core.basic_utils import dotkeys as _dotkeys
 import _datetime as _datetime
@@ -13,22 +14,28 @@ import json as _json
 
 _logger = _logging.getLogger("INCA.%s" %__name__)
 
+_MAX_DOCTYPES = 10000 # the maximum number of doctypes listed by list_doctypes
+
 def list_doctypes():
+    '''returns the number of documents per doctype, from a single terms aggregation'''
     if not _DATABASE_AVAILABLE:
         _logger.warning("Could not list documents: No database instance available")
         return []
-    existing_doctypes = [key for key in _client.indices.get_mapping(_elastic_index).get(_elastic_index,{}).get('mappings',{}).keys() if
-                         key != '_default_' and key != 'core.document']
-    overview = {doctype:_client.search(index=_elastic_index,doc_type=doctype).get('hits',{}).get('total',"NA") for
-                                                                                        doctype in existing_doctypes}
+    counts = _client.search(index=_elastic_index, body={
+        'size' : 0,
+        'aggs' : {'doctypes' : {'terms' : {'field':'_type', 'size':_MAX_DOCTYPES}}}
+    }).get('aggregations',{}).get('doctypes',{}).get('buckets',[])
+    overview = {bucket['key']:bucket['doc_count'] for bucket in counts if
+                bucket['key'] != '_default_' and bucket['key'] != 'core.document'}
     return overview
 
 def doctype_generator(doctype):
-    if check_mapping(doctype) == "mixed_mapping": 
+    mapping = check_mapping(doctype)
+    if mapping == "mixed_mapping":
         field = "doctype.keyword"
-    elif check_mapping(doctype) == "new_mapping": 
+    elif mapping == "new_mapping":
         field = "doctype"
-    elif check_mapping(doctype) == None: 
+    elif mapping == None:
          _logger.warning("Could not find mapping of doctype, please check whether you are using the correct doctype")
          return []
         
@@ -98,20 +105,19 @@ def doctype_first(doctype, num=1, by_field="META.ADDED",query=None):
 
     exotic_by_field = by_field.replace('.','.properties.')
     _logger.debug("looking for {exotic_by_field}".format(exotic_by_field=exotic_by_field))
-    mapping = _client.indices.get_mapping()
-    _logger.debug("Got mapping {mapping}".format(**locals()))
-    target_key = "{_elastic_index}.mappings.{doctype}.properties.{exotic_by_field}".format(_elastic_index=_elastic_index,**locals())
+    target_key = "properties.{exotic_by_field}".format(**locals())
     _logger.debug("Target key: {target_key}".format(**locals()))
-    found_mapping = _dotkeys(mapping,target_key )
+    found_mapping = _dotkeys(get_mapping(doctype),target_key )
     _logger.debug("found mapping: {found_mapping}".format(**locals()))
     if not found_mapping:
         _logger.debug("Mapping not seen yet")
         return []
-    if check_mapping(doctype) == "mixed_mapping": 
+    mapping = check_mapping(doctype)
+    if mapping == "mixed_mapping":
         field = "doctype.keyword"
-    elif check_mapping(doctype) == "new_mapping": 
+    elif mapping == "new_mapping":
         field = "doctype"
-    elif check_mapping(doctype) == None: 
+    elif mapping == None:
         _logger.warning("Could not find mapping of doctype, please check whether you are using the correct doctype")
         return []
   
@@ -168,20 +174,19 @@ def doctype_last(doctype,num=1, by_field="META.ADDED", query=None):
 
     exotic_by_field = by_field.replace('.','.properties.')
     _logger.debug("looking for {exotic_by_field}".format(exotic_by_field=exotic_by_field))
-    mapping = _client.indices.get_mapping()
-    _logger.debug("Got mapping {mapping}".format(**locals()))
-    target_key = "{_elastic_index}.mappings.{doctype}.properties.{exotic_by_field}".format(_elastic_index=_elastic_index,**locals())
+    target_key = "properties.{exotic_by_field}".format(**locals())
     _logger.debug("Target key: {target_key}".format(**locals()))
-    found_mapping = _dotkeys(mapping,target_key )
+    found_mapping = _dotkeys(get_mapping(doctype),target_key )
     _logger.debug("found mapping: {found_mapping}".format(**locals()))
     if not found_mapping:
         _logger.debug("Mapping not seen yet")
         return []
-    if check_mapping(doctype) == "mixed_mapping": 
+    mapping = check_mapping(doctype)
+    if mapping == "mixed_mapping":
         field = "doctype.keyword"
-    elif check_mapping(doctype) == "new_mapping": 
+    elif mapping == "new_mapping":
         field = "doctype"
-    elif check_mapping(doctype) == None: 
+    elif mapping == None:
         _logger.warning("Could not find mapping of doctype, please check whether you are using the correct doctype")
         return []
         
@@ -221,11 +226,12 @@ def doctype_examples(doctype, field=None, seed=42, num=10):
     if not _DATABASE_AVAILABLE:
         _logger.warning("Could not get example documents: No database instance available")
         return []
-    if check_mapping(doctype) == "mixed_mapping": 
+    mapping = check_mapping(doctype)
+    if mapping == "mixed_mapping":
         field2 = "doctype.keyword"
-    elif check_mapping(doctype) == "new_mapping": 
+    elif mapping == "new_mapping":
         field2 = "doctype"
-    elif check_mapping(doctype) == None: 
+    elif mapping == None:
         return _logger.warning("Could not find mapping of doctype, please check whether you are using the correct doctype")
       
     docs = _client.search(index=_elastic_index, body={
@@ -259,28 +265,32 @@ def doctype_fields(doctype):
     field : type - count (coverage)
 
     note:
-        As elasticsearch does not natively support an 'all fields' query,
-        this function runs a 1000 document sample and takes the union of
-        found keys as a proxy of fields shared by all documents.
+        Coverage is computed for all fields in the mapping of `doctype`
+        with a single `filters` aggregation.
     '''
     if not _DATABASE_AVAILABLE:
         _logger.warning("Could not get document information: No database instance available")
         return []
-    if check_mapping(doctype) == "mixed_mapping": 
+    mapping = check_mapping(doctype)
+    if mapping == "mixed_mapping":
         field = "doctype.keyword"
-    elif check_mapping(doctype) == "new_mapping": 
+    elif mapping == "new_mapping":
         field = "doctype"
-    elif check_mapping(doctype) == None: 
+    elif mapping == None:
         _logger.warning("Could not find mapping of doctype, please check whether you are using the correct doctype")
         return []
       
-    from collections import Counter
-    key_count = Counter()
-    doc_num   = _client.search(index=_elastic_index, body={'query':{"term":{field:doctype}}})['hits']['total']
-    mappings = _client.indices.get_mapping(_elastic_index).get(_elastic_index,{}).get('mappings',{}).get(doctype,{}).get('properties',{})
-    coverage = {key:_client.search(_elastic_index,body={'query': {'bool':{'filter':[{'exists':{'field':key}},{'term':{field:doctype}}]}}}).get('hits',{}).get('total',0) for key in mappings.keys() if key!="META"}
-    summary = {k:{'coverage':coverage.get(k,'unknown')/float(doc_num),'type':mappings[k].get('type','unknown')} for
-               k in mappings.keys() if k!="META"}
+    mappings = get_mapping(doctype).get('properties',{})
+    keys = [key for key in mappings.keys() if key!="META"]
+    body = {'size' : 0, 'query': {'term':{field:doctype}}}
+    if keys:
+        body['aggs'] = {'coverage': {'filters': {'filters': {key:{'exists':{'field':key}} for key in keys}}}}
+    result = _client.search(index=_elastic_index, body=body)
+    doc_num  = result['hits']['total']
+    coverage = {key:bucket['doc_count'] for key, bucket in
+                result.get('aggregations',{}).get('coverage',{}).get('buckets',{}).items()}
+    summary = {k:{'coverage':doc_num and coverage.get(k,0)/float(doc_num) or 0.,'type':mappings[k].get('type','unknown')} for
+               k in keys}
     return summary
 
 def missing_field(doctype=None, field='_source', stats_only=True):
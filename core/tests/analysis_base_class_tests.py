@@ -0,0 +1,136 @@
+'''
+TESTS FOR analysis_base_class
+'''
+import os
+import joblib
+import numpy as np
+import pytest
+from core import analysis_base_class
+from core.analysis_base_class import Analysis
+
+class mean(Analysis):
+    '''predicts the mean of the training values, whatever the text'''
+
+    _model_state = ['mean', 'n']
+
+    def fit(self, documents, **kwargs):
+        self.documents = list(documents)
+        self.mean = np.array([np.mean(self.documents)])
+        self.n = len(self.documents)
+        return self
+
+    def _predict_texts(self, texts, **kwargs):
+        return [float(self.mean[0])] * len(texts)
+
+@pytest.fixture
+def modelpath(tmpdir, monkeypatch):
+    path = str(tmpdir.join('models'))
+    monkeypatch.setattr(analysis_base_class, 'MODELPATH', path)
+    monkeypatch.setattr(analysis_base_class, '_loaded_models', {})
+    return path
+
+def test_save_and_load(modelpath):
+    model = mean().fit([1, 2, 3])
+    assert model.save('means', training_query={'query':{'match_all':{}}}, doctype='news', note='test') == 1
+    loaded = mean.load('means')
+    assert loaded is not model
+    assert loaded.n == 3
+    assert loaded.mean[0] == 2
+    assert loaded._predict_texts(['a']) == [2.0]
+    # only the declared state is stored
+    assert not hasattr(loaded, 'documents')
+    stored = joblib.load(os.path.join(modelpath, 'means', '1', 'model.joblib'))
+    assert sorted(stored) == ['mean', 'n']
+    assert loaded.model_meta['doctype'] == 'news'
+    assert loaded.model_meta['note'] == 'test'
+    assert loaded.model_meta['training_query'] == {'query':{'match_all':{}}}
+    assert loaded.model_meta['model'] == __name__ + '.mean'
+    # arrays are memory-mapped read-only, unless loaded for training
+    assert isinstance(loaded.mean, np.memmap)
+    assert not loaded.mean.flags.writeable
+    assert mean.load('means', mmap=False).mean.flags.writeable
+
+def test_versions(modelpath):
+    for values in ([1], [2, 4], [5, 6, 7]):
+        mean().fit(values).save('means')
+    assert mean.load('means').n == 3
+    assert mean.load('means', version=1).n == 1
+    assert mean.load('means', version=2).mean[0] == 3
+    mean().fit([0]).save('other')
+    models = analysis_base_class.list_models()
+    assert sorted(models) == ['means', 'other']
+    assert [meta['version'] for meta in models['means']] == [1, 2, 3]
+    # unfinished saves are not listed, and do not block saving
+    os.makedirs(os.path.join(modelpath, 'means', '4.tmp'))
+    assert mean().fit([8]).save('means') == 4
+    with pytest.raises(KeyError):
+        mean.load('missing')
+
+def test_loaded_models_are_cached(modelpath):
+    mean().fit([1]).save('means')
+    model = mean.load('means')
+    assert mean.load('means') is model
+    assert mean.load('means', version=1) is model
+    assert mean.load('means', mmap=False) is not model
+    # a new version is loaded once it is saved
+    mean().fit([2]).save('means')
+    assert mean.load('means').n == 1
+    assert mean.load('means') is not model
+
+def test_save_requires_a_model_state(modelpath):
+    class undeclared(mean):
+        _model_state = None
+    with pytest.raises(NotImplementedError):
+        undeclared().fit([1]).save('undeclared')
+    assert analysis_base_class.list_models() == {}
+
+@pytest.fixture
+def updates(monkeypatch):
+    documents = [{'_id':str(num), '_type':'news', '_source':{'text':'text %s' %num if num % 5 else ''}}
+                 for num in range(30)]
+    monkeypatch.setattr(analysis_base_class.core.database, 'scroll_query', lambda query: iter(documents))
+    batches = []
+    def bulk_update_fields(updates):
+        batches.append(list(updates))
+        return len(batches[-1]), []
+    monkeypatch.setattr(analysis_base_class.core.database, 'bulk_update_fields', bulk_update_fields)
+    return batches
+
+def test_bulk_predict(updates):
+    model = mean().fit([1, 2, 3])
+    assert model.bulk_predict('*', 'text', 'average', batchsize=10) == 24
+    # documents without text are skipped
+    assert [len(batch) for batch in updates] == [10, 10, 4]
+    update = updates[0][0]
+    assert (update['_id'], update['_type']) == ('1', 'news')
+    # a partial update of the prediction and its metadata only
+    assert sorted(update['doc']) == ['META', 'average']
+    assert update['doc']['average'] == 2.0
+    assert __name__ + '.mean' in update['doc']['META']['average']['ADDED_USING']
+
+def test_bulk_predict_in_processes(updates):
+    model = mean().fit([1, 2, 3])
+    assert model.bulk_predict({'query':{'match_all':{}}}, '_source.text', 'average', batchsize=5, processes=2) == 24
+    assert sorted(update['_id'] for batch in updates for update in batch) == \
+           sorted(str(num) for num in range(30) if num % 5)
+    assert all(update['doc']['average'] == 2.0 for batch in updates for update in batch)
+    assert analysis_base_class._bulk_model is None
+
+def test_bulk_predict_in_daemonic_process(updates, monkeypatch):
+    class daemon():
+        daemon = True
+    def get_context(method):
+        raise RuntimeError("daemonic processes are not allowed to have children")
+    monkeypatch.setattr(analysis_base_class.multiprocessing, 'current_process', daemon)
+    monkeypatch.setattr(analysis_base_class.multiprocessing, 'get_context', get_context)
+    assert mean().fit([4]).bulk_predict('*', 'text', 'average', batchsize=10, processes=4) == 24
+    assert [len(batch) for batch in updates] == [10, 10, 4]
+
+def test_bulk_predict_errors(monkeypatch, updates):
+    monkeypatch.setattr(analysis_base_class.core.database, 'bulk_update_fields',
+                        lambda updates: (len(list(updates)) - 1, [{'update':{'status':409}}]))
+    assert mean().fit([1]).bulk_predict('*', 'text', 'average', batchsize=10) == 21
+
+def test_to_json():
+    assert analysis_base_class._to_json({'a':np.int64(3), 'b':[np.float32(.5), np.arange(2)]}) == {'a':3, 'b':[.5, [0, 1]]}
+    assert type(analysis_base_class._to_json(np.int64(3))) is int
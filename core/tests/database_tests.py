@@ -0,0 +1,127 @@
+'''
+TESTS FOR the mapping cache and the tasks in database
+'''
+import pytest
+from core import database
+
+class _indices():
+    def __init__(self, mappings):
+        self.mappings = mappings
+        self.requests = 0
+
+    def get_mapping(self, index):
+        self.requests += 1
+        return {index:{'mappings':dict(self.mappings)}}
+
+class _client():
+    def __init__(self, mappings):
+        self.indices = _indices(mappings)
+
+@pytest.fixture
+def client(monkeypatch):
+    client = _client({'nu'       : {'properties':{'doctype':{'type':'keyword'}}},
+                      'telegraaf': {'properties':{'doctype':{'type':'text', 'fields':{'keyword':{'type':'keyword'}}}}}})
+    monkeypatch.setattr(database, 'client', client)
+    database.invalidate_mapping_cache()
+    yield client
+    database.invalidate_mapping_cache()
+
+def test_mapping_is_cached(client):
+    assert sorted(database.get_mapping()) == ['nu', 'telegraaf']
+    assert database.get_mapping('nu') == {'properties':{'doctype':{'type':'keyword'}}}
+    assert database.get_mapping('unknown') == {}
+    assert client.indices.requests == 1
+    database.get_mapping(refresh=True)
+    assert client.indices.requests == 2
+
+def test_mapping_expires(client, monkeypatch):
+    database.get_mapping()
+    monkeypatch.setattr(database, 'MAPPING_TTL', -1)
+    database.get_mapping()
+    assert client.indices.requests == 2
+
+def test_check_mapping(client):
+    assert database.check_mapping('nu') == 'new_mapping'
+    assert database.check_mapping('telegraaf') == 'mixed_mapping'
+    assert database.check_mapping('unknown') is None
+    assert client.indices.requests == 1
+
+def test_new_doctype_invalidates(client):
+    database.get_mapping()
+    database._note_doctypes(['nu'])
+    database.get_mapping()
+    assert client.indices.requests == 1
+    client.indices.mappings['volkskrant'] = {'properties':{'doctype':{'type':'keyword'}}}
+    database._note_doctypes(['nu', 'volkskrant'])
+    assert database.check_mapping('volkskrant') == 'new_mapping'
+    assert client.indices.requests == 2
+
+class _tasks():
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self.cancelled = []
+
+    def get(self, task_id):
+        self.requests += 1
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+    def cancel(self, task_id):
+        self.cancelled.append(task_id)
+        return {'nodes':{}}
+
+def running(total, done):
+    return {'completed':False, 'task':{'status':{'total':total, 'deleted':done, 'updated':0}}}
+
+def finished(total, **response):
+    return {'completed':True, 'task':{'status':{'total':total, 'deleted':total, 'updated':0}}, 'response':response}
+
+@pytest.fixture
+def tasks(client, monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(database.time, 'time', lambda: clock[0])
+    monkeypatch.setattr(database.time, 'sleep', lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    client.by_query = []
+    def by_query(index, body, conflicts, slices, wait_for_completion):
+        client.by_query.append((body, slices, wait_for_completion))
+        return {'task':'node:1'}
+    client.delete_by_query = client.update_by_query = by_query
+    client.tasks = _tasks([running(10, 0), running(10, 5), finished(10, failures=[])])
+    return client.tasks
+
+def test_delete_doctype(client, tasks):
+    assert database.delete_doctype('nu', slices=3)
+    body, slices, wait_for_completion = client.by_query[0]
+    assert body == {'query':{'bool':{'filter':{'term':{'doctype':'nu'}}}}}
+    assert (slices, wait_for_completion) == (3, False)
+    assert tasks.requests == 3
+    assert database.delete_doctype('telegraaf', wait=False) == 'node:1'
+    assert client.by_query[1][0] == {'query':{'bool':{'filter':{'term':{'doctype.keyword':'telegraaf'}}}}}
+    assert database.delete_doctype('unknown') == []
+
+def test_remove_field_failures(client, tasks):
+    failure = {'index':'inca', 'id':'1', 'cause':{'type':'version_conflict_engine_exception'}}
+    tasks.responses = [running(2, 0), finished(2, failures=[failure])]
+    assert not database.remove_field({'query':{'match':{'doctype':'nu'}}}, 'text_lowercase')
+    body, slices, wait_for_completion = client.by_query[0]
+    assert body['query']['bool']['filter'] == {'exists':{'field':'text_lowercase'}}
+    assert body['script']['params'] == {'field':'text_lowercase'}
+    assert database.task_status('node:1')['failures'] == [failure]
+    # errors of the task itself are failures too
+    tasks.responses = [{'completed':True, 'task':{'status':{}}, 'error':{'type':'script_exception'}}]
+    assert database.task_status('node:1')['failures'] == [{'type':'script_exception'}]
+
+def test_cancelled_task(client, tasks):
+    tasks.responses = [running(10, 2), finished(10, failures=[], canceled='by user request')]
+    database.cancel_task('node:1')
+    assert tasks.cancelled == ['node:1']
+    assert not database.delete_doctype('nu')
+    assert database.task_status('node:1')['cancelled'] == 'by user request'
+
+def test_task_timeout(client, tasks):
+    tasks.responses = [running(10, 0)]
+    status = database.wait_for_task('node:1', poll_interval=5, timeout=12)
+    assert not status['completed']
+    assert tasks.requests == 4 # at 0, 5, 10 and 15 seconds
+    assert not database.delete_doctype('nu', timeout=1)
+    assert tasks.cancelled == []
@@ -0,0 +1,52 @@
+'''
+TESTS FOR encoding_utils
+'''
+import codecs
+import io
+from core.encoding_utils import sniff_encoding, detect_encoding, clear_cache
+
+TEXT = 'Het Keulse Oudejaarsgeweld, één miljoen vluchtelingen – een „debat”'
+
+def sniff(data, **kwargs):
+    return sniff_encoding(io.BytesIO(data), **kwargs)
+
+def test_boms():
+    assert sniff(codecs.BOM_UTF8 + TEXT.encode('utf-8')) == 'utf-8-sig'
+    assert sniff(TEXT.encode('utf-16')) == 'utf-16'
+    assert sniff(TEXT.encode('utf-32')) == 'utf-32'
+
+def test_utf8():
+    assert sniff(TEXT.encode('utf-8')) == 'utf-8'
+    assert sniff(TEXT.encode('utf-8'), hint='latin-1') == 'utf-8'
+
+def test_utf8_cut_off_in_sample():
+    # the sample ends halfway a multi-byte character
+    data = ('a' * 9 + 'é' * 100).encode('utf-8')
+    assert sniff(data, sample_size=10) == 'utf-8'
+
+def test_hint():
+    data = TEXT.replace('–', '-').replace('„', '"').replace('”', '"').encode('latin-1')
+    assert sniff(data, hint='latin-1') == 'latin-1'
+
+def test_ascii():
+    assert sniff(b'plain text') == 'utf-8'
+    assert sniff(b'plain text', hint='ASCII') == 'utf-8'
+    assert sniff(b'plain text', hint='latin-1') == 'latin-1'
+
+def test_ascii_with_unusable_hint():
+    # the hint is only returned when it would read the file correctly
+    assert sniff(b'plain text', hint='utf-16') == 'utf-8'
+    assert sniff(b'plain text', hint='cp037') == 'utf-8'
+    assert sniff(b'plain text', hint='no-such-encoding') == 'utf-8'
+
+def test_ascii_sample_of_larger_file():
+    # the start of the file is ascii, so the rest decides
+    data = b'a' * 100 + TEXT.encode('utf-8')
+    assert sniff(data, sample_size=10) == 'utf-8'
+
+def test_detect_encoding(tmpdir):
+    clear_cache()
+    path = tmpdir.join('article.txt')
+    path.write_binary(TEXT.encode('utf-8'))
+    assert detect_encoding(str(path)) == 'utf-8'
+    assert detect_encoding(str(tmpdir.join('missing.txt'))) == False
@@ -0,0 +1,152 @@
+'''
+TESTS FOR plugin_registry
+'''
+import importlib
+import inspect
+import os
+import textwrap
+import pytest
+from core import plugin_registry
+
+FILES = {
+    'core/__init__.py' : '',
+    'core/base.py' : '''
+        from celery import Task
+
+        class Base(Task):
+            """the base of all tasks"""
+            abstract = True
+
+            def process(self, value):
+                """the value was processed"""
+                return value
+        ''',
+    'processing/__init__.py' : '',
+    'processing/first_processing.py' : '''
+        from core.base import Base
+        import core.base
+        import json
+
+        class lowercase(Base):
+            def process(self, value):
+                """the value was lowercased"""
+                return value.lower()
+
+        class inherited(core.base.Base):
+            pass
+
+        class renamed(Base):
+            name = 'custom_name'
+
+        class helper(object):
+            pass
+
+        class not_a_task(json.JSONEncoder):
+            pass
+        ''',
+    'processing/second_processing.py' : '''
+        from .first_processing import *
+        from . import first_processing as first
+
+        class uppercase(lowercase):
+            """uppercases"""
+
+        class via_module(first.lowercase):
+            pass
+
+        class abstract_task(uppercase):
+            abstract = True
+        ''',
+    'processing/_private.py' : '''
+        from core.base import Base
+
+        class hidden(Base):
+            pass
+        ''',
+    'processing/broken_processing.py' : '''
+        class broken(:
+        ''',
+}
+
+@pytest.fixture
+def tree(tmpdir, monkeypatch):
+    for filename, content in FILES.items():
+        path = tmpdir.join(*filename.split('/'))
+        path.dirpath().ensure(dir=True)
+        path.write(textwrap.dedent(content))
+    monkeypatch.setattr(plugin_registry, 'INCADIR', str(tmpdir))
+    monkeypatch.setattr(plugin_registry, 'MANIFEST', str(tmpdir.join('manifest.json')))
+    monkeypatch.setattr(plugin_registry, 'PACKAGES', {'processing':'_processing.py'})
+    monkeypatch.setattr(plugin_registry, '_tasks', None)
+    yield tmpdir
+    plugin_registry._tasks = None
+
+def test_tasks(tree):
+    tasks = {task['classname']:task for task in plugin_registry.tasks(refresh=True)}
+    assert sorted(tasks) == ['inherited', 'lowercase', 'renamed', 'uppercase', 'via_module']
+    assert tasks['lowercase']['name'] == 'processing.first_processing.lowercase'
+    assert tasks['lowercase']['module'] == 'processing.first_processing'
+    assert tasks['renamed']['name'] == 'custom_name'
+    # documented by the (inherited) process method
+    assert tasks['lowercase']['doc'] == 'the value was lowercased'
+    assert tasks['inherited']['doc'] == 'the value was processed'
+    assert tasks['uppercase']['doc'] == 'the value was lowercased'
+    assert plugin_registry.modules() == ['processing.first_processing', 'processing.second_processing']
+    assert plugin_registry.tasks('scrapers') == []
+
+def test_manifest(tree, monkeypatch):
+    plugin_registry.tasks(refresh=True)
+    assert tree.join('manifest.json').check()
+
+    # unchanged files are not read again
+    scanned = []
+    def scan(module, path):
+        scanned.append(module)
+        return original(module, path)
+    original = plugin_registry._scan
+    monkeypatch.setattr(plugin_registry, '_scan', scan)
+    monkeypatch.setattr(plugin_registry, '_tasks', None)
+    before = plugin_registry.tasks()
+    assert scanned == []
+
+    # changed files are
+    path = tree.join('processing', 'second_processing.py')
+    path.write(path.read() + '\nclass added(uppercase):\n    pass\n')
+    os.utime(str(path), (0, 0))
+    monkeypatch.setattr(plugin_registry, '_tasks', None)
+    after = plugin_registry.tasks()
+    assert 'processing.second_processing' in scanned
+    assert len(after) == len(before) + 1
+
+def test_get_task(tree, monkeypatch):
+    class app():
+        tasks = {'registered':'registered task'}
+    imported = []
+    def import_module(module):
+        imported.append(module)
+        for task in plugin_registry.tasks():
+            if task['module'] == module:
+                app.tasks[task['name']] = task['classname']
+    monkeypatch.setattr(plugin_registry.importlib, 'import_module', import_module)
+    assert plugin_registry.get_task('registered', app) == 'registered task'
+    assert plugin_registry.get_task('processing.second_processing.uppercase', app) == 'uppercase'
+    # a task with its own name is imported from its module
+    assert plugin_registry.get_task('custom_name', app) == 'renamed'
+    assert imported == ['processing.second_processing', 'processing.first_processing']
+
+def test_same_tasks_as_importing():
+    '''the registry lists the tasks found by importing the (importable) INCA modules'''
+    celery = pytest.importorskip('celery')
+    plugin_registry._tasks = None
+    for package in ['processing', 'analysis']:
+        for module_name in plugin_registry._package_modules(package):
+            try:
+                module = importlib.import_module(module_name)
+            except Exception:
+                continue # missing (optional) dependencies
+            imported = sorted(name for name, cls in inspect.getmembers(module, inspect.isclass)
+                              if cls.__module__ == module_name and issubclass(cls, celery.Task)
+                              and not cls.__dict__.get('abstract'))
+            registered = sorted(task['classname'] for task in plugin_registry.tasks(package)
+                                if task['module'] == module_name)
+            assert registered == imported, module_name
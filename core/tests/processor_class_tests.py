@@ -0,0 +1,96 @@
+'''
+TESTS FOR processor_class
+'''
+import pytest
+import core.database
+from core import processor_class
+
+class versioned(processor_class.Processer):
+    '''appends the version'''
+    version = '0.1'
+    __name__ = 'versioned'
+
+    def process(self, document_field):
+        '''the field with the version appended'''
+        return '{document_field} {self.version}'.format(**locals())
+
+class _bulk_upsert():
+    saved = []
+    def run(self, documents):
+        self.saved.extend(documents)
+
+@pytest.fixture
+def saved(monkeypatch):
+    updates = []
+    monkeypatch.setattr(processor_class, 'update_document',
+                        lambda document, force=False: updates.append((document, force)))
+    monkeypatch.setattr(_bulk_upsert, 'saved', [])
+    monkeypatch.setattr(core.database, 'bulk_upsert', _bulk_upsert)
+    return updates
+
+def make_documents(n=3):
+    return [{'_id':str(i), '_type':'doc', '_source':{'text':'text %s' %i}} for i in range(n)]
+
+def test_run_skips_results_of_this_version(saved):
+    processor = versioned()
+    document = processor.run(make_documents(1)[0], 'text', save=True)
+    assert document['_source']['text_versioned'] == 'text 0 0.1'
+    assert document['_source']['META']['text_versioned']['FUNCTION_VERSION'] == '0.1'
+    document['_source']['text_versioned'] = 'unchanged'
+    assert processor.run(document, 'text', save=True)['_source']['text_versioned'] == 'unchanged'
+    assert len(saved) == 1
+
+def test_run_reprocesses_results_of_another_version(saved, monkeypatch):
+    document = versioned().run(make_documents(1)[0], 'text')
+    monkeypatch.setattr(versioned, 'version', '0.2')
+    document = versioned().run(document, 'text', save=True)
+    assert document['_source']['text_versioned'] == 'text 0 0.2'
+    assert document['_source']['META']['text_versioned']['FUNCTION_VERSION'] == '0.2'
+    # the old result is replaced instead of merged with the stored document
+    (saved_document, force), = saved
+    assert force
+
+def test_run_without_metadata_of_the_result(saved):
+    document = {'_source':{'text':'text', 'text_versioned':'no metadata'}}
+    assert versioned().run(document, 'text')['_source']['text_versioned'] == 'text 0.1'
+
+def test_batch_reprocesses_results_of_another_version(saved, monkeypatch):
+    documents = make_documents()
+    list(versioned().runwrap(documents, 'batch', 'text'))
+    assert len(_bulk_upsert.saved) == 3
+    monkeypatch.setattr(_bulk_upsert, 'saved', [])
+    # nothing to do for the same version
+    list(versioned().runwrap(documents, 'batch', 'text'))
+    assert _bulk_upsert.saved == []
+    monkeypatch.setattr(versioned, 'version', '0.2')
+    documents[0]['_source']['META']['text_versioned']['FUNCTION_VERSION'] = '0.2'
+    list(versioned().runwrap(documents, 'batch', 'text'))
+    assert [doc['_id'] for doc in _bulk_upsert.saved] == ['1', '2']
+    for document in documents:
+        assert document['_source']['META']['text_versioned']['FUNCTION_VERSION'] == '0.2'
+    assert [doc['_source']['text_versioned'] for doc in documents] == ['text 0 0.1', 'text 1 0.2', 'text 2 0.2']
+
+def test_failed_results_are_not_done(saved):
+    processor = versioned()
+    processor.process = lambda document_field: None
+    document = processor.run(make_documents(1)[0], 'text')
+    assert document['_source']['text_versioned'] is None
+    assert not processor._is_done(document['_source'], 'text_versioned')
+
+def test_incremental_watermark(tmpdir, monkeypatch):
+    monkeypatch.setattr(processor_class, 'WATERMARKS', str(tmpdir.join('watermarks.json')))
+    queries = []
+    monkeypatch.setattr(core.database, 'scroll_query', lambda body: queries.append(body) or iter(make_documents(2)))
+    class client():
+        @staticmethod
+        def search(body):
+            return {'aggregations':{'last_added':{'value':1507000000000.0}}}
+    monkeypatch.setattr(core.database, 'client', client)
+    query = {'query':{'match':{'doctype':'nu'}}}
+    assert len(list(processor_class._doctype_query_or_list(query, field='text', task='versioned', incremental=True))) == 2
+    assert queries[0]['query']['bool']['filter'] == []
+    assert list(processor_class._load_watermarks().values()) == [1507000000000]
+    list(processor_class._doctype_query_or_list(query, field='text', task='versioned', incremental=True))
+    # an integer, as epoch_millis does not accept floats
+    since = queries[1]['query']['bool']['filter'][0]['range']['META.ADDED']['gt']
+    assert since == 1507000000000 and type(since) is int
@@ -0,0 +1,63 @@
+'''
+TESTS FOR result_cache
+'''
+import pytest
+from core import result_cache
+from core.result_cache import ResultCache, MISSING
+
+@pytest.fixture
+def cache(tmpdir):
+    return ResultCache(path=str(tmpdir.join('cache', 'results.sqlite')), maxsize=10000)
+
+def test_get_and_set(cache):
+    key = cache.key('lowercase', '0.1', 'Some Text')
+    assert cache.get(key) is MISSING
+    cache.set(key, 'some text')
+    assert cache.get(key) == 'some text'
+    cache.set(key, None)
+    assert cache.get(key) is None
+    cache.clear()
+    assert cache.get(key) is MISSING
+
+def test_keys():
+    key = ResultCache.key('stemming', '0.1', 'text', kwargs={'language':'dutch'})
+    assert key == ResultCache.key('stemming', '0.1', 'text', kwargs={'language':'dutch'})
+    assert key != ResultCache.key('stemming', '0.2', 'text', kwargs={'language':'dutch'})
+    assert key != ResultCache.key('stemming', '0.1', 'text', kwargs={'language':'english'})
+    assert key != ResultCache.key('lowercase', '0.1', 'text', kwargs={'language':'dutch'})
+    assert key != ResultCache.key('stemming', '0.1', 'Text', kwargs={'language':'dutch'})
+
+def test_unpicklable(cache):
+    key = cache.key('lowercase', '0.1', 'text')
+    cache.set(key, lambda: None)
+    assert cache.get(key) is MISSING
+
+def test_lru_eviction(cache, monkeypatch):
+    times = iter(range(1000))
+    monkeypatch.setattr(result_cache.time, 'time', lambda: next(times))
+    for num in range(10):
+        cache.set(str(num), 'x' * 1000)
+    # use the oldest results, so others are the least recently used
+    assert cache.get('0') is not MISSING
+    assert cache.get('1') is not MISSING
+    cache.set('10', 'x' * 1000)
+    assert cache.stats()['size'] > cache.maxsize
+    removed = cache.evict()
+    assert removed >= 2
+    assert cache.stats()['size'] <= .9 * cache.maxsize
+    assert cache.get('0') is not MISSING and cache.get('1') is not MISSING and cache.get('10') is not MISSING
+    assert cache.get('2') is MISSING and cache.get('3') is MISSING
+    assert cache.evict() == 0
+
+def test_eviction_while_storing(cache, monkeypatch):
+    monkeypatch.setattr(result_cache, 'CHECK_EVERY', 5)
+    for num in range(50):
+        cache.set(str(num), 'x' * 1000)
+    assert cache.stats()['size'] <= cache.maxsize + 5 * 1100
+    assert cache.get('49') is not MISSING
+
+def test_code_version():
+    class processor():
+        version = '0.1'
+    assert result_cache.code_version(processor).startswith('0.1-')
+    assert result_cache.code_version(processor) == result_cache.code_version(processor)
@@ -0,0 +1,68 @@
+'''
+TESTS FOR the doctype statistics in search_utils
+'''
+import pytest
+from core import database, search_utils
+
+MAPPINGS = {
+    'nu'        : {'properties':{'doctype':{'type':'keyword'}, 'text':{'type':'text'},
+                                 'title':{'type':'text'}, 'META':{'properties':{}}}},
+    'telegraaf' : {'properties':{'doctype':{'type':'text', 'fields':{'keyword':{'type':'keyword'}}},
+                                 'text':{'type':'text'}}},
+}
+
+class _indices():
+    def __init__(self):
+        self.requests = 0
+
+    def get_mapping(self, index):
+        self.requests += 1
+        return {index:{'mappings':MAPPINGS}}
+
+class _client():
+    def __init__(self):
+        self.indices = _indices()
+        self.searches = []
+
+    def search(self, index=None, body=None, **kwargs):
+        self.searches.append(body)
+        if 'doctypes' in body.get('aggs', {}):
+            return {'hits':{'total':15}, 'aggregations':{'doctypes':{'buckets':[
+                {'key':'nu', 'doc_count':10}, {'key':'telegraaf', 'doc_count':5}, {'key':'core.document', 'doc_count':1}]}}}
+        filters = body.get('aggs', {}).get('coverage', {}).get('filters', {}).get('filters', {})
+        return {'hits':{'total':4}, 'aggregations':{'coverage':{'buckets':{
+            key:{'doc_count':{'text':4, 'title':1}.get(key, 4)} for key in filters}}}}
+
+@pytest.fixture
+def client(monkeypatch):
+    client = _client()
+    monkeypatch.setattr(database, 'client', client)
+    monkeypatch.setattr(search_utils, '_client', client)
+    monkeypatch.setattr(search_utils, '_DATABASE_AVAILABLE', True)
+    database.invalidate_mapping_cache()
+    yield client
+    database.invalidate_mapping_cache()
+
+def test_list_doctypes(client):
+    assert search_utils.list_doctypes() == {'nu':10, 'telegraaf':5}
+    # a single request, without the mapping
+    assert len(client.searches) == 1
+    assert client.indices.requests == 0
+    assert client.searches[0]['aggs']['doctypes']['terms']['field'] == '_type'
+
+def test_doctype_fields(client):
+    summary = search_utils.doctype_fields('nu')
+    assert summary == {'doctype':{'coverage':1., 'type':'keyword'}, 'text':{'coverage':1., 'type':'text'},
+                       'title':{'coverage':.25, 'type':'text'}}
+    # one search for all fields, and the mapping is only requested once
+    assert len(client.searches) == 1
+    assert client.searches[0]['query'] == {'term':{'doctype':'nu'}}
+    assert client.indices.requests == 1
+    search_utils.doctype_fields('telegraaf')
+    assert client.searches[1]['query'] == {'term':{'doctype.keyword':'telegraaf'}}
+    assert client.indices.requests == 1
+
+def test_doctype_fields_unknown_doctype(client):
+    assert search_utils.doctype_fields('unknown') == []
+    assert client.searches == []
+    assert client.indices.requests == 1
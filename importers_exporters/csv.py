@@ -6,8 +6,8 @@ This file contains the input/output functionality for '.csv' fiels INCA
 
 from core.import_export_classes import Importer, Exporter
 from core.basic_utils import dotkeys
+from core.encoding_utils import detect_encoding
 import csv
-import chardet
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,13 +18,7 @@ class import_csv(Importer):
     version = 0.1
 
     def _detect_encoding(self, filename):
-        try:
-            with open(filename, mode='rb') as filebuf:
-                encoding = chardet.detect(filebuf.peek(10000000))
-        except FileNotFoundError:
-            logger.warning("File `{filename}` does not seem to exist".format(filename=filename))
-            return False
-        return encoding['encoding']
+        return detect_encoding(filename)
 
     def load(self, path, fieldnames=None, *args, **kwargs):
         """Loads a csv file into INCA
@@ -59,6 +53,8 @@ class import_csv(Importer):
 
         """
         encoding = kwargs.pop('encoding','utf-8')
+        if encoding == 'autodetect':
+            encoding = self._detect_encoding(path)
         if encoding:
             with open(path, encoding=encoding) as fileobj:
                 csv_content = csv.DictReader(fileobj, *args, **kwargs)
@@ -6,31 +6,97 @@ This file contains the input/output functionality for Lexis Nexis files
 
 from core.import_export_classes import Importer, Exporter
 from core.basic_utils import dotkeys
+from core.encoding_utils import detect_encoding
 import csv
-import chardet
 import logging
+import json
+import hashlib
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from os import listdir, walk
-from os.path import isfile, join, splitext
+from os.path import isfile, join, splitext, dirname, getsize, getmtime, relpath
 import re
 import datetime
 
 logger = logging.getLogger("INCA."+__name__)
 
+# Name of the file (inside the imported folder) that keeps track of the
+# files that were already imported, see `lnimporter.run`
+MANIFEST_FILENAME = ".inca_lnimporter_manifest.json"
 
-def _detect_encoding(filename):
-    with open(filename, mode='rb') as filebuf:
-        encoding = chardet.detect(filebuf.peek(10000000))
-    return encoding['encoding']
+MONTHMAP={"January":1, "januari": 1, "February":2, "februari":2,"March":3,"maart":3,
+          "April":4, "april":4, "mei":5, "May":5, "June":6,"juni":6, "July":7, "juli":7,
+          "augustus": 8, "August":8,"september":9,"September":9, "oktober":10,"October":10,
+          "November":11,"november":11,"December":12,"december":12}
+
+SOURCENAMEMAP={'ad/algemeen dagblad (print)':'ad (print)',
+               'de telegraaf (print)': 'telegraaf (print)',
+               'de volkskrant (print)': 'volkskrant (print)',
+               'nrc handelsblad (print)': 'nrc (print)'}
+
+RE_NEW_ARTICLE = re.compile(r"\s+(\d+) of (\d+) DOCUMENTS")
+RE_DATE_NL_DAY = re.compile(r"\s+(\d{1,2}) (januari|februari|maart|april|mei|juni|juli|augustus|september|oktober|november|december) (\d{4}) (maandag|dinsdag|woensdag|donderdag|vrijdag|zaterdag|zondag)")
+RE_DATE_NL     = re.compile(r"\s+(\d{1,2}) ([jJ]anuari|[fF]ebruari|[mM]aart|[aA]pril|[mM]ei|[jJ]uni|[jJ]uli|[aA]ugustus|[sS]eptember|[Oo]ktober|[nN]ovember|[dD]ecember) (\d{4}).*")
+RE_DATE_EN_US  = re.compile(r"\s+(January|February|March|April|May|June|July|August|September|October|November|December) (\d{1,2}),? (\d{4})")
+RE_DATE_EN_DAY = re.compile(r"\s+(\d{1,2}) (January|February|March|April|May|June|July|August|September|October|November|December) (\d{4}) (Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)")
+RE_DATE_EN     = re.compile(r"\s+(\d{1,2}) (January|February|March|April|May|June|July|August|September|October|November|December) (\d{4}).*")
+
+
+def _detect_encoding(filename, cache=None):
+    '''Detect the encoding of a file, preferring the encoding found for
+    other files in the same directory
 
+    Parameters
+    ----
+    filename : string
+        The file to inspect
+    cache : dict (optional)
+        A {directory : encoding} mapping, updated in place
+
+    Returns
+    ----
+    string
+        The name of the encoding
+    '''
+    if cache is None:
+        cache = {}
+    directory = dirname(filename)
+    encoding = detect_encoding(filename, hint=cache.get(directory))
+    cache[directory] = encoding
+    return encoding
+
+
+def _detect_has_header(fileobj):
+    '''Checks whether an opened LN file starts with a download request header,
+    rewinding the file object afterwards'''
+    has_header = False
+    for line in fileobj:
+        if line.strip().startswith('Download Request'):
+            has_header = True
+            break
+        if line.strip().startswith('1 of'):
+            break
+    fileobj.seek(0)
+    return has_header
+
+def _file_hash(filename, blocksize=1048576):
+    '''md5 of the file contents, used to recognize files that were touched
+    (or copied) but not changed'''
+    digest = hashlib.md5()
+    with open(filename, mode='rb') as filebuf:
+        for block in iter(lambda: filebuf.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-def _detect_has_header(filename,encoding):
-    with open(filename, mode='r', encoding=encoding) as fi:
-        while True:
-            line=next(fi)
-            if line.strip().startswith('Download Request'):
-                return True
-            if line.strip().startswith('1 of'):
-                return False
+def _find_files(path):
+    '''Returns a sorted list of all LN `.txt` files in path (recursively)'''
+    found = []
+    for directory, subFolders, files in walk(path):
+        for f in files:
+            if isfile(join(directory, f)) and splitext(f)[1].lower() == ".txt" and not f.startswith('.'):
+                found.append(join(directory, f))
+    return sorted(found)
 
 def check_suspicious(text):
     '''checks whether an article is likely to be a real article
@@ -46,22 +112,211 @@ def check_suspicious(text):
     suspicious = jj > .16 * ii
     return suspicious
 
+def _make_article(title, journal, text, pubdate_year, pubdate_month, pubdate_day, section, byline):
+    formattedsource = "{} (print)".format(journal.lower())
+    formattedsource = SOURCENAMEMAP.get(formattedsource, formattedsource) # rename source if necessary
+    # minimal fields to be returned. These really need to be present
+    art = {
+        "title":title.strip(),
+        "doctype": formattedsource,
+        "text":text,
+        "publication_date":datetime.datetime(int(pubdate_year),int(pubdate_month),int(pubdate_day)),
+        "suspicious":check_suspicious(text)
+        }
+    # add fields where it is okay if they are absent
+    if len(section)>0:
+        art["category"] = section.lower()
+    if len(byline)>0:
+        art["byline"] = byline
+    return art
+
+def _parse_file(filename, encoding):
+    '''Parses a single Lexis Nexis file
+
+    This is a module-level function (rather than a method) so it can be
+    shipped to worker processes.
+
+    Parameters
+    ----
+    filename : string
+        The file to parse
+    encoding : string
+        The encoding of the file
+
+    Returns
+    ----
+    list
+        One dict per article
+    '''
+    articles = []
+    artikel = 0
+    with open(filename, "r", encoding=encoding, errors="replace") as f:
+        if _detect_has_header(f):
+            for skiplines in range(22):
+                next(f)
+        for line in f:
+            line = line.replace("\r", " ")
+            if line == "\n":
+                continue
+            matchObj = RE_NEW_ARTICLE.match(line)
+            matchObj2 = RE_DATE_NL_DAY.match(line)
+            matchObj2a = RE_DATE_NL.match(line)
+            matchObj3 = RE_DATE_EN_US.match(line)
+            matchObj4 = RE_DATE_EN_DAY.match(line)
+            matchObj4a = RE_DATE_EN.match(line)
+            if matchObj:
+                # new article starts
+                if artikel > 0:
+                    # add article, but not before we processed the first one
+                    articles.append(_make_article(title, journal2, text, pubdate_year,
+                                                  pubdate_month, pubdate_day, section, byline))
+
+                artikel += 1
+                logger.debug('Now processing article {} of {}'.format(artikel, filename))
+
+                istitle=True #to make sure that text before mentioning of SECTION is regarded as title, not as body
+                firstdate=True # flag to make sure that only the first time a date is mentioned it is regarded as _the_ date
+                text = ""
+                title = ""
+                byline = ""
+                section = ""
+                length = ""
+                loaddate = ""
+                language = ""
+                pubtype = ""
+                journal = ""
+                journal2=""
+                pubdate_day = ""
+                pubdate_month = ""
+                pubdate_year = ""
+                pubdate_dayofweek = ""
+
+                for nextline in f:
+                    if nextline.strip()!="":
+                        journal2=nextline.strip()
+                        break
+                continue
+
+            if line.startswith("BYLINE"):
+                byline = line.replace("BYLINE: ", "").rstrip("\n")
+            elif line.startswith("SECTION"):
+                istitle=False # everything that follows will be main text rather than title if no other keyword is mentioned
+                section = line.replace("SECTION: ", "").rstrip("\n")
+            elif line.startswith("LENGTH"):
+                length = line.replace("LENGTH: ", "").rstrip("\n").rstrip(" woorden")
+            elif line.startswith("LOAD-DATE"):
+                loaddate = line.replace("LOAD-DATE: ", "").rstrip("\n")
+            elif matchObj2 and firstdate==True:
+                pubdate_day=matchObj2.group(1)
+                pubdate_month=str(MONTHMAP[matchObj2.group(2)])
+                pubdate_year=matchObj2.group(3)
+                pubdate_dayofweek=matchObj2.group(4)
+                firstdate=False
+            elif matchObj2a and firstdate==True:
+                pubdate_day=matchObj2a.group(1)
+                pubdate_month=str(MONTHMAP[matchObj2a.group(2).lower()])
+                pubdate_year=matchObj2a.group(3)
+                firstdate=False
+            elif matchObj3 and firstdate==True:
+                pubdate_day=matchObj3.group(2)
+                pubdate_month=str(MONTHMAP[matchObj3.group(1)])
+                pubdate_year=matchObj3.group(3)
+                pubdate_dayofweek="NA"
+                firstdate=False
+            elif matchObj4 and firstdate==True:
+                pubdate_day=matchObj4.group(1)
+                pubdate_month=str(MONTHMAP[matchObj4.group(2)])
+                pubdate_year=matchObj4.group(3)
+                pubdate_dayofweek=matchObj4.group(4)
+                firstdate=False
+            elif matchObj4a and firstdate==True:
+                pubdate_day=matchObj4a.group(1)
+                pubdate_month=str(MONTHMAP[matchObj4a.group(2)])
+                pubdate_year=matchObj4a.group(3)
+                firstdate=False
+
+            elif (matchObj2 or matchObj2a or matchObj3 or matchObj4 or matchObj4a) and firstdate==False:
+                # if there is a line starting with a date later in the article, treat it as normal text
+                text = text + " " + line.rstrip("\n")
+            elif line.startswith("LANGUAGE"):
+                language = line.replace("LANGUAGE: ", "").rstrip("\n")
+            elif line.startswith("PUBLICATION-TYPE"):
+                pubtype = line.replace("PUBLICATION-TYPE: ", "").rstrip("\n")
+            elif line.startswith("JOURNAL-CODE"):
+                journal = line.replace("JOURNAL-CODE: ", "").rstrip("\n")
+            elif line.lstrip().startswith("Copyright ") or line.lstrip().startswith("All Rights Reserved"):
+                pass
+            elif line.lstrip().startswith("AD/Algemeen Dagblad") or line.lstrip().startswith(
+                    "De Telegraaf") or line.lstrip().startswith("Trouw") or line.lstrip().startswith(
+                    "de Volkskrant") or line.lstrip().startswith("NRC Handelsblad") or line.lstrip().startswith(
+                    "Metro") or line.lstrip().startswith("Spits"):
+                pass
+            else:
+                if istitle:
+                    title = title + " " + line.rstrip("\n")
+                else:
+                    text = text + " " + line.rstrip("\n")
+
+    # add the very last article of the file
+    if artikel > 0:
+        articles.append(_make_article(title, journal2, text, pubdate_year,
+                                      pubdate_month, pubdate_day, section, byline))
+    return articles
+
 
 class lnimporter(Importer):
     """Read Lexis Nexis files"""
 
-    version = 0.2
+    version = 0.3
+
+    # keep the module-level maps reachable from instances (as before)
+    MONTHMAP = MONTHMAP
+    SOURCENAMEMAP = SOURCENAMEMAP
+
+    def run(self, path, incremental=True, batchsize=100, *args, **kwargs):
+        """uses the documents from the load method in batches
 
-    def run(self, path, *args, **kwargs):
-        """uses the documents from the load method in batches """
+        Parameters
+        ----
+        path : string
+            The folder with Lexis Nexis files to import
+        incremental : bool (default=True)
+            Whether to skip files that were imported before. Imported files are
+            recorded (path, size, modification time and md5 hash) in a
+            `.inca_lnimporter_manifest.json` file in `path`
+        batchsize : int (default=100)
+            The number of articles to index in one bulk request
+        processes : int (optional)
+            The number of worker processes to parse files with, defaults to the
+            number of CPUs. Use 1 to parse in the current process
+        encoding : string (optional)
+            See `load`
+        """
 
         # this method is overwritten because in contrast to
         # other importers, we do not have a single doctype.
         # Each document can have a different one.
-        for doc in self.load(path, *args,**kwargs):
-            self._ingest(iterable=doc, doctype=doc['doctype'])
-            self.processed += 1
-
+        manifest = incremental and self._load_manifest(path) or {}
+        try:
+            for num, (filename, articles) in enumerate(self._parse_files(path, manifest=manifest, **kwargs)):
+                for batch in self._process_by_batch(articles, batchsize=batchsize):
+                    by_doctype = OrderedDict()
+                    for doc in batch:
+                        by_doctype.setdefault(doc['doctype'], []).append(doc)
+                    for doctype, docs in by_doctype.items():
+                        self._ingest(iterable=docs, doctype=doctype)
+                    self.processed += len(batch)
+                if incremental:
+                    entry = self._manifest_entry(filename)
+                    entry['articles'] = len(articles)
+                    manifest[relpath(filename, path)] = entry
+                    # store progress every now and then, so an interrupted import
+                    # does not have to start all over
+                    if not (num+1) % 50:
+                        self._save_manifest(path, manifest)
+        finally:
+            if incremental:
+                self._save_manifest(path, manifest)
 
     def load(self, path, *args, **kwargs):
         """Loads a txt files from Lexis Nexis into INCA
@@ -69,11 +324,14 @@ class lnimporter(Importer):
         Parameters
         ----
         path : string
-            The file to load
+            The folder with files to load (searched recursively)
         encoding ; string (optional)
             The encoding in which a file is, defaults to 'utf-8', but is also
             commonly 'UTF-16','ANSI','WINDOwS-1251'. 'autodetect' will attempt
             to infer encoding from file contents
+        processes : int (optional)
+            The number of worker processes used to parse files, defaults to the
+            number of CPUs. Use 1 to parse in the current process
 
         yields
         ---
@@ -81,174 +339,112 @@ class lnimporter(Importer):
             One dict per article
 
         """
+        for filename, articles in self._parse_files(path, *args, **kwargs):
+            for art in articles:
+                yield art
 
+    def _parse_files(self, path, manifest=None, processes=None, encoding=False, *args, **kwargs):
+        """Parses all (new) files in path, in parallel if possible
 
-        self.MONTHMAP={"January":1, "januari": 1, "February":2, "februari":2,"March":3,"maart":3,
-                        "April":4, "april":4, "mei":5, "May":5, "June":6,"juni":6, "July":7, "juli":7,
-                        "augustus": 8, "August":8,"september":9,"September":9, "oktober":10,"October":10,
-                        "November":11,"november":11,"December":12,"december":12}
-        self.SOURCENAMEMAP={'ad/algemeen dagblad (print)':'ad (print)',
-                                'de telegraaf (print)': 'telegraaf (print)',
-                                'de volkskrant (print)': 'volkskrant (print)',
-                                'nrc handelsblad (print)': 'nrc (print)'}
+        yields
+        ---
+        tuple
+            (filename, list of articles) per file, in order of filename
+        """
+        self.pathwithlnfiles = path
+        alleinputbestanden = _find_files(path)
+        if manifest:
+            alleinputbestanden = [f for f in alleinputbestanden if
+                                  not self._already_imported(f, manifest.get(relpath(f, path)))]
+            logger.info("{n} new or changed files to import".format(n=len(alleinputbestanden)))
+        logger.debug(alleinputbestanden)
 
+        encoding_cache = {}
+        def jobs():
+            for bestand in alleinputbestanden:
+                if encoding and encoding != 'autodetect':
+                    bestand_encoding = encoding
+                else:
+                    bestand_encoding = _detect_encoding(bestand, encoding_cache)
+                yield bestand, bestand_encoding
 
-        self.pathwithlnfiles = path
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if multiprocessing.current_process().daemon:
+            # e.g. celery workers, which are not allowed to fork
+            processes = 1
 
+        if processes <= 1 or len(alleinputbestanden) <= 1:
+            for bestand, bestand_encoding in jobs():
+                logger.info("Now processing {}".format(bestand))
+                articles = self._parse_or_fail(bestand, lambda: _parse_file(bestand, bestand_encoding))
+                if articles is not None:
+                    yield bestand, articles
+            return
 
-        alleinputbestanden = []
-        for path, subFolders, files in walk(self.pathwithlnfiles):
-            for f in files:
-                if isfile(join(path, f)) and splitext(f)[1].lower() == ".txt" and not f.startswith('.'):
-                    alleinputbestanden.append(join(path, f))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            # keep a bounded number of files in flight, so parsed articles
+            # do not pile up in memory when indexing is the bottleneck
+            pending = deque()
+            for bestand, bestand_encoding in jobs():
+                pending.append((bestand, executor.submit(_parse_file, bestand, bestand_encoding)))
+                if len(pending) >= 2 * processes:
+                    bestand_done, future = pending.popleft()
+                    articles = self._parse_or_fail(bestand_done, future.result)
+                    if articles is not None:
+                        yield bestand_done, articles
+            while pending:
+                bestand_done, future = pending.popleft()
+                articles = self._parse_or_fail(bestand_done, future.result)
+                if articles is not None:
+                    yield bestand_done, articles
 
-        artikel = 0
-        logger.debug(alleinputbestanden)
-        for bestand in alleinputbestanden:
-            logger.info("Now processing {}".format(bestand))
-            encoding = kwargs.pop('encoding',False)
-            if not encoding:
-                encoding = _detect_encoding(bestand)
-            with open(bestand, "r", encoding=encoding, errors="replace") as f:
-                if _detect_has_header(bestand, encoding):
-                    for skiplines in range(22):
-                        next(f)
-                i = 0
-                for line in f:
-                    i = i + 1
-                    line = line.replace("\r", " ")
-                    if line == "\n":
-                        continue
-                    matchObj = re.match(r"\s+(\d+) of (\d+) DOCUMENTS", line)
-                    matchObj2 = re.match(r"\s+(\d{1,2}) (januari|februari|maart|april|mei|juni|juli|augustus|september|oktober|november|december) (\d{4}) (maandag|dinsdag|woensdag|donderdag|vrijdag|zaterdag|zondag)", line)
-                    matchObj2a = re.match(r"\s+(\d{1,2}) ([jJ]anuari|[fF]ebruari|[mM]aart|[aA]pril|[mM]ei|[jJ]uni|[jJ]uli|[aA]ugustus|[sS]eptember|[Oo]ktober|[nN]ovember|[dD]ecember) (\d{4}).*", line)
-                    matchObj3 = re.match(r"\s+(January|February|March|April|May|June|July|August|September|October|November|December) (\d{1,2}),? (\d{4})", line)
-                    matchObj4 = re.match(r"\s+(\d{1,2}) (January|February|March|April|May|June|July|August|September|October|November|December) (\d{4}) (Monday|Tuesday|Wednesday|Thursday|Friday|Saturday|Sunday)", line)
-                    matchObj4a = re.match(r"\s+(\d{1,2}) (January|February|March|April|May|June|July|August|September|October|November|December) (\d{4}).*", line)
-                    if matchObj:
-                        # new article starts
-                        if artikel > 0:
-                            # yield article, but not before we processed the first one
-                            formattedsource = "{} (print)".format(journal2.lower())
-                            formattedsource = self.SOURCENAMEMAP.get(formattedsource, formattedsource) # rename source if necessary
-                            # minimal fields to be returned. These really need to be present
-                            art = {
-                                "title":title.strip(),
-                                "doctype": formattedsource,
-                                "text":text,
-                                "publication_date":datetime.datetime(int(pubdate_year),int(pubdate_month),int(pubdate_day)),
-                                "suspicious":check_suspicious(text)
-                                }
-                            # add fields where it is okay if they are absent
-                            if len(section)>0:
-                                art["category"] = section.lower()
-                            if len(byline)>0:
-                                art["byline"] = byline
-                            yield art
-
-                        artikel += 1
-                        logger.info('Now processing article {}'.format(artikel))
-
-                        istitle=True #to make sure that text before mentioning of SECTION is regarded as title, not as body
-                        firstdate=True # flag to make sure that only the first time a date is mentioned it is regarded as _the_ date
-                        text = ""
-                        title = ""
-                        byline = ""
-                        section = ""
-                        length = ""
-                        loaddate = ""
-                        language = ""
-                        pubtype = ""
-                        journal = ""
-                        journal2=""
-                        pubdate_day = ""
-                        pubdate_month = ""
-                        pubdate_year = ""
-                        pubdate_dayofweek = ""
-                        suspicious=True
-                        
-                        while True:
-                            nextline=next(f)
-                            if nextline.strip()!="":
-                                journal2=nextline.strip()
-                                break
-                        continue
-                    
-                    if line.startswith("BYLINE"):
-                        byline = line.replace("BYLINE: ", "").rstrip("\n")
-                    elif line.startswith("SECTION"):
-                        istitle=False # everything that follows will be main text rather than title if no other keyword is mentioned
-                        section = line.replace("SECTION: ", "").rstrip("\n")
-                    elif line.startswith("LENGTH"):
-                        length = line.replace("LENGTH: ", "").rstrip("\n").rstrip(" woorden")
-                    elif line.startswith("LOAD-DATE"):
-                        loaddate = line.replace("LOAD-DATE: ", "").rstrip("\n")
-                    elif matchObj2 and firstdate==True:
-                        # print matchObj2.string
-                        pubdate_day=matchObj2.group(1)
-                        pubdate_month=str(self.MONTHMAP[matchObj2.group(2)])
-                        pubdate_year=matchObj2.group(3)
-                        pubdate_dayofweek=matchObj2.group(4)
-                        firstdate=False
-                    elif matchObj2a and firstdate==True:
-                        # print matchObj2.string
-                        pubdate_day=matchObj2a.group(1)
-                        pubdate_month=str(self.MONTHMAP[matchObj2a.group(2).lower()])
-                        pubdate_year=matchObj2a.group(3)
-                        firstdate=False
-                    elif matchObj3 and firstdate==True:
-                        pubdate_day=matchObj3.group(2)
-                        pubdate_month=str(self.MONTHMAP[matchObj3.group(1)])
-                        pubdate_year=matchObj3.group(3)
-                        pubdate_dayofweek="NA"
-                        firstdate=False
-                    elif matchObj4 and firstdate==True:
-                        pubdate_day=matchObj4.group(1)
-                        pubdate_month=str(self.MONTHMAP[matchObj4.group(2)])
-                        pubdate_year=matchObj4.group(3)
-                        pubdate_dayofweek=matchObj4.group(4)
-                        firstdate=False
-                    elif matchObj4a and firstdate==True:
-                        pubdate_day=matchObj4a.group(1)
-                        pubdate_month=str(self.MONTHMAP[matchObj4a.group(2)])
-                        pubdate_year=matchObj4a.group(3)
-                        firstdate=False
-
-                    elif (matchObj2 or matchObj2a or matchObj3 or matchObj4 or matchObj4a) and firstdate==False:
-                        # if there is a line starting with a date later in the article, treat it as normal text
-                        text = text + " " + line.rstrip("\n")
-                    elif line.startswith("LANGUAGE"):
-                        language = line.replace("LANGUAGE: ", "").rstrip("\n")
-                    elif line.startswith("PUBLICATION-TYPE"):
-                        pubtype = line.replace("PUBLICATION-TYPE: ", "").rstrip("\n")
-                    elif line.startswith("JOURNAL-CODE"):
-                        journal = line.replace("JOURNAL-CODE: ", "").rstrip("\n")
-                    elif line.lstrip().startswith("Copyright ") or line.lstrip().startswith("All Rights Reserved"):
-                        pass
-                    elif line.lstrip().startswith("AD/Algemeen Dagblad") or line.lstrip().startswith(
-                            "De Telegraaf") or line.lstrip().startswith("Trouw") or line.lstrip().startswith(
-                            "de Volkskrant") or line.lstrip().startswith("NRC Handelsblad") or line.lstrip().startswith(
-                            "Metro") or line.lstrip().startswith("Spits"):
-                        pass
-                    else:
-                        if istitle:
-                            title = title + " " + line.rstrip("\n")
-                        else:
-                            text = text + " " + line.rstrip("\n")
-
-        # yield the very last article of the whole set 
-        formattedsource = "{} (print)".format(journal2.lower())
-        formattedsource = self.SOURCENAMEMAP.get(formattedsource, formattedsource) # rename source if necessary
-        # minimal fields to be returned. These really need to be present
-        art = {
-            "title":title.strip(),
-            "doctype": formattedsource,
-            "text":text,
-            "publication_date":datetime.datetime(int(pubdate_year),int(pubdate_month),int(pubdate_day)),
-            }
-        # add fields where it is okay if they are absent
-        if len(section)>0:
-            art["category"] = section.lower()
-        if len(byline)>0:
-            art["byline"] = byline
-        yield art
+    def _parse_or_fail(self, filename, parse):
+        try:
+            articles = parse()
+        except Exception as e:
+            if self.raise_on_fail:
+                raise
+            logger.warning("Could not parse {filename}: {e}".format(**locals()))
+            self.failed += 1
+            self.failed_ids.append(filename)
+            return None
+        logger.info("Parsed {n} articles from {filename}".format(n=len(articles), filename=filename))
+        return articles
+
+    def _manifest_entry(self, filename):
+        return {'size'  : getsize(filename),
+                'mtime' : getmtime(filename),
+                'hash'  : _file_hash(filename),
+                'imported' : datetime.datetime.now().isoformat()}
+
+    def _already_imported(self, filename, entry):
+        '''Checks a file against its manifest entry. Size and modification
+        time are compared first, the (more expensive) hash only when the file
+        was touched since the import.'''
+        if not entry:
+            return False
+        if entry.get('size') != getsize(filename):
+            return False
+        if entry.get('mtime') == getmtime(filename):
+            return True
+        if entry.get('hash') == _file_hash(filename):
+            entry['mtime'] = getmtime(filename)
+            return True
+        return False
+
+    def _load_manifest(self, path):
+        try:
+            with open(join(path, MANIFEST_FILENAME)) as fi:
+                return json.load(fi)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, path, manifest):
+        # failing to record progress (e.g. on a read-only archive) should not hide
+        # the outcome of the import itself
+        try:
+            with open(join(path, MANIFEST_FILENAME), 'w') as fo:
+                json.dump(manifest, fo, indent=1, sort_keys=True)
+        except (IOError, OSError) as e:
+            logger.warning("Could not save the import manifest in {path}: {e}".format(**locals()))
@@ -0,0 +1,108 @@
+'''
+TESTS FOR lexisnexis
+'''
+import os
+from importers_exporters import lexisnexis
+from importers_exporters.lexisnexis import lnimporter, MANIFEST_FILENAME
+
+LNFILE = '''
+                               1 of 2 DOCUMENTS
+
+                                   de Volkskrant
+
+                          12 januari 2016 dinsdag
+
+Het Keulse Oudejaarsgeweld
+
+SECTION: Binnenland; Blz. 3
+
+LENGTH: 120 woorden
+
+De aanrandingen in Keulen zouden het werk kunnen zijn van bendes straatrovers.
+
+LOAD-DATE: 12 januari 2016
+
+LANGUAGE: DUTCH
+
+                               2 of 2 DOCUMENTS
+
+                                      Trouw
+
+                           13 January 2016 Wednesday
+
+Een debat over de grondbeginselen
+
+BYLINE: Jan Jansen
+
+SECTION: Nieuws
+
+Bondskanselier Angela Merkel wil een debat.
+'''
+
+class _importer(lnimporter):
+    '''Collects the documents instead of sending them to elasticsearch'''
+
+    def __init__(self, *args, **kwargs):
+        lnimporter.__init__(self, *args, **kwargs)
+        self.ingested = []
+
+    def _ingest(self, iterable, doctype):
+        self.ingested.extend(iterable)
+
+def write_files(path, n=2):
+    for i in range(n):
+        with open(os.path.join(path, 'file%d.txt' %i), 'w', encoding='utf-8') as fo:
+            fo.write(LNFILE)
+
+def test_parse_file(tmpdir):
+    write_files(str(tmpdir), n=1)
+    articles = lexisnexis._parse_file(str(tmpdir.join('file0.txt')), 'utf-8')
+    assert [article['doctype'] for article in articles] == ['volkskrant (print)', 'trouw (print)']
+    assert articles[0]['title'] == 'Het Keulse Oudejaarsgeweld'
+    assert articles[0]['publication_date'].isoformat() == '2016-01-12T00:00:00'
+    assert articles[1]['publication_date'].isoformat() == '2016-01-13T00:00:00'
+    assert articles[1]['byline'] == 'Jan Jansen'
+
+def test_incremental_run(tmpdir):
+    path = str(tmpdir)
+    write_files(path)
+    importer = _importer()
+    importer.run(path, processes=1)
+    assert len(importer.ingested) == 4
+    assert os.path.exists(os.path.join(path, MANIFEST_FILENAME))
+
+    # nothing changed
+    importer = _importer()
+    importer.run(path, processes=1)
+    assert importer.ingested == []
+
+    # a new file, and a file with new contents
+    write_files(path, n=3)
+    with open(os.path.join(path, 'file0.txt'), 'a', encoding='utf-8') as fo:
+        fo.write('Een laatste zin.\n')
+    importer = _importer()
+    importer.run(path, processes=1)
+    assert len(importer.ingested) == 4
+
+    importer = _importer()
+    importer.run(path, processes=1, incremental=False)
+    assert len(importer.ingested) == 6
+
+def test_touched_file_is_not_imported_again(tmpdir):
+    path = str(tmpdir)
+    write_files(path, n=1)
+    _importer().run(path, processes=1)
+    filename = os.path.join(path, 'file0.txt')
+    os.utime(filename, (0, 0))
+    importer = _importer()
+    importer.run(path, processes=1)
+    assert importer.ingested == []
+
+def test_unsaveable_manifest(tmpdir, monkeypatch):
+    path = str(tmpdir)
+    write_files(path, n=1)
+    # e.g. a read-only archive
+    monkeypatch.setattr(lexisnexis, 'MANIFEST_FILENAME', os.path.join('missing', 'manifest.json'))
+    importer = _importer()
+    importer.run(path, processes=1)
+    assert len(importer.ingested) == 2
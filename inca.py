@@ -21,6 +21,7 @@ running INCA.
 import os
 import logging
 import inspect
+import functools
 
 
 logging.basicConfig(level="WARN")
@@ -41,13 +42,9 @@ import configparser
 import core.search_utils
 import core.taskmanager
 import datetime
+import threading
 
-import processing # helps celery recognize the processing tasks
-import scrapers   # helps celery recognize the scraping tasks
-import rssscrapers
-import clients    # helps celery recognize client tasks
-import analysis   # helps celery recognize analysis tasks
-import importers_exporters # helps celery recognize import/export tasks
+import core.plugin_registry # lists the tasks, which are imported when first used
 
 from optparse import OptionParser
 
@@ -97,23 +94,24 @@ class Inca():
     _taskmaster = Celery(
         backend = config.get('celery', '%s.backend' %config.get('inca','dependencies')),
         broker  = config.get('celery', '%s.broker' %config.get('inca','dependencies')),
+        include = core.plugin_registry.modules(), # helps celery workers recognize all tasks
     )
 
     database = core.search_utils
 
-    _prompt = "Placeholder"
+    _prompt = "Placeholder" # used by endpoints called on the class, Inca objects use their own prompt
+
+    _tasktypes = ['scrapers', 'processing', 'analysis', 'clients', 'importers_exporters', 'rssscrapers']
+
+    _endpoints = None # (tasktype, task) -> endpoint, constructed once per process
+    _endpoints_lock = threading.Lock()
 
     def __init__(self, prompt="TLI", distributed=False, verbose=True, debug=False):
         self._LOCAL_ONLY = distributed
         self._prompt = getattr(make_interface,prompt).prompt
-        self._construct_tasks('scrapers')
-        self._construct_tasks('processing')
-
-        #self._analysis_task_constructor()
-        self._construct_tasks('analysis')
-        self._construct_tasks('clients')
-        self._construct_tasks('importers_exporters')
-        self._construct_tasks('rssscrapers')
+        self._construct_endpoints()
+        for tasktype in self._tasktypes:
+            setattr(self, tasktype, _BoundTasks(getattr(Inca, tasktype), self))
         
         if verbose:
             logger.setLevel('INFO')
@@ -190,12 +188,30 @@ class Inca():
         pass
 
 
-    def _construct_tasks(self, function):
+    @classmethod
+    def _construct_endpoints(cls):
+        """Construct the endpoints of all tasktypes, once per process
+
+        Endpoints are set on the (class) attributes of Inca, such as
+        `Inca.scrapers`, so later Inca objects share them.
+        """
+        with cls._endpoints_lock:
+            if cls._endpoints is not None:
+                return
+            endpoints = {}
+            for function in cls._tasktypes:
+                endpoints.update(cls._construct_tasks(function))
+            cls._endpoints = endpoints
+
+    @classmethod
+    def _construct_tasks(cls, function):
         """Construct the appropriate endoints from Celery tasks
 
         This function serves to create the appropriate functions in the Inca
-        object by intro-specting available functions from the celery taskmaster.
-        Subclasses of Task should then be added automatically.
+        object from the tasks listed by the plugin registry. Subclasses of Task
+        should then be added automatically. The module of a task is imported
+        (and the task registered with the celery taskmaster) when its endpoint
+        is first called.
 
         Parameters
         ----
@@ -203,69 +219,96 @@ class Inca():
             The type of function to add, such as 'scrapers' or 'processors'
 
         Returns
-            None
+            dict
+                The endpoints by (function, name)
 
 
         """
-        for k,v in self._taskmaster.tasks.items():
-            functiontype = k.split('.',1)[0]
-            taskname     = k.rsplit('.',1)[1]
-            if functiontype == function:
-                target_task = self._taskmaster.tasks[k]
-                target_task.prompt = self._prompt
-
-                is_client_main_class = hasattr(target_task,"service_name") and target_task.__name__== target_task.service_name
-                if is_client_main_class:
-                    setattr(getattr(self,function),
-                        "{service_name}_create_app".format(service_name=target_task.service_name), target_task.add_application )
-                    setattr(getattr(self,function),
-                        "{service_name}_remove_app".format(service_name=target_task.service_name), target_task.remove_application )
-                    setattr(getattr(self,function),
-                        "{service_name}_create_credentials".format(service_name=target_task.service_name), target_task.add_credentials )
-                else:
-                    setattr(getattr(self,function),taskname,target_task.runwrap)
-                function_class = getattr(self,function)
-                leaf_class = self._taskmaster.tasks[k]
-                method = leaf_class.runwrap
-                def makefunc(method):
-                    if inspect.isgeneratorfunction(method):
-                        def endpoint(*args, **kwargs):
-                            for i in method(*args, **kwargs):
-                                yield i
-                    else:
-                        def endpoint(*args, **kwargs):
-                            return method(*args, **kwargs)
-                    return endpoint
+        function_class = getattr(cls,function)
+        endpoints = {}
+        for task in core.plugin_registry.tasks(function):
+            if task['service_name']:
+                for name, method in [('create_app', 'add_application'), ('remove_app', 'remove_application'),
+                                     ('create_credentials', 'add_credentials')]:
+                    name = "{service_name}_{name}".format(service_name=task['service_name'], name=name)
+                    endpoints[(function, name)] = cls._make_endpoint(task, method)
+            endpoints[(function, task['classname'])] = cls._make_endpoint(task, 'runwrap', task['doc'])
+        for (_, name), endpoint in endpoints.items():
+            setattr(function_class, name, endpoint)
+        return endpoints
+
+    @classmethod
+    def _make_endpoint(cls, task, method, docstring=None):
+        """Returns a function that loads a task on first use and calls one of its methods"""
+        def call(prompt, *args, **kwargs):
+            target_task = core.plugin_registry.get_task(task['name'], cls._taskmaster)
+            target_task.prompt = prompt
+            return getattr(target_task, method)(*args, **kwargs)
+        def endpoint(*args, **kwargs):
+            return call(cls._prompt, *args, **kwargs)
+        endpoint.__doc__  = docstring
+        endpoint.__name__ = task['classname']
+        endpoint.call     = call
+        return endpoint
+
+    def _bind(self, endpoint):
+        """Returns an endpoint that calls its task with the prompt of this Inca object"""
+        prompt = self._prompt
+        def bound(*args, **kwargs):
+            return endpoint.call(prompt, *args, **kwargs)
+        return functools.update_wrapper(bound, endpoint)
+
+    def endpoint(self, tasktype, task):
+        """Returns the endpoint of a task
 
-                endpoint = makefunc(method)
-                if function == 'scrapers' or function =='rssscrapers':
-                    docstring = self._taskmaster.tasks[k].get.__doc__
-                elif function == "processing":
-                    docstring = self._taskmaster.tasks[k].process.__doc__
-                elif function == "importers_exporters":
-                    t = self._taskmaster.tasks[k]
-                    if hasattr(t,'load'):
-                        docstring = t.load.__doc__
-                    else:
-                        docstring = t.save.__doc__
-                else:
-                    docstring = self._taskmaster.tasks[k].__doc__
-                endpoint.__doc__  = docstring
-                endpoint.__name__ = leaf_class.__name__
+        Parameters
+        ----
+        tasktype : string
+            The type of task, such as 'scrapers' or 'processing'
+        task : string
+            The name of the task, e.g. 'nu' or 'twitter_create_app'
 
-                setattr(function_class,taskname,endpoint)
+        Returns
+            function, or None if there is no such task
+        """
+        self._construct_endpoints()
+        endpoint = self._endpoints.get((tasktype, task))
+        return endpoint and self._bind(endpoint)
 
 
     def _summary(self):
         summary = ''
         summary += '\nTop 10 document types currently in database:\n'
         contents = self.database.list_doctypes().items()
-        for k,v in sorted(self.database.list_doctypes().items(), key=lambda x: x[1], reverse=True)[:10]:
+        for k,v in sorted(contents, key=lambda x: x[1], reverse=True)[:10]:
             summary += "{k:30} : {v:10}\n".format(**locals())
         if len(contents)>10:
             summary += "...\n"
         return summary
 
+class _BoundTasks():
+    """The endpoints of a tasktype (such as `Inca.scrapers`) as seen from an
+    Inca object: the shared endpoints, calling tasks with the prompt of that
+    object"""
+
+    def __init__(self, tasks, inca):
+        self._tasks = tasks
+        self._inca  = inca
+        self.__doc__ = tasks.__doc__
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_tasks', '_inca'):
+            raise AttributeError(name)
+        attribute = getattr(self._tasks, name)
+        if not hasattr(attribute, 'call'):
+            return attribute
+        bound = self._inca._bind(attribute)
+        setattr(self, name, bound)
+        return bound
+
+    def __dir__(self):
+        return sorted(set(dir(self._tasks)) | set(self.__dict__))
+
 ### COMMANDLINE SPECIFICATION ###
 
 def commandline():
@@ -305,15 +348,12 @@ def commandline():
     tasktype = args[0]
     task     = args[1]
 
-    try:
-        tasktype_ob = getattr(inca,tasktype)
-    except:
+    if not tasktype in inca._tasktypes:
         print("Tasktype '{tasktype}' not found! Should be 'rssscrapers', 'scrapers' or 'processing'".format(**locals()))
         return
-    try:
-        task_func   = getattr(tasktype_ob, task)
-    except:
-        tasklist    = ',\n'.join([t for t in dir(tasktype_ob) if '__' not in t])
+    task_func = inca.endpoint(tasktype, task)
+    if task_func is None:
+        tasklist    = ',\n'.join(sorted(name for function, name in inca._endpoints if function == tasktype))
         print("Unknown task '{task}' not found, for {tasktype} this should be in:\n{tasklist}".format(**locals()))
         return
 
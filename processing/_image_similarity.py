@@ -0,0 +1,199 @@
+'''
+This file contains the image similarity index used by the image processors.
+
+For every image in the image store, three perceptual hashes (average, phash
+and dhash) are kept as 64-bit integers in a compact append-only file
+(`imagehashes.bin` in the image store, 24 bytes per image). The average hash
+also names the image file (see `image_processing.hash2filepath`), so no
+filenames are stored.
+
+Images with a small Hamming distance between their hashes are (near)
+copies, e.g. the same press photo used by different outlets. `ImageIndex`
+keeps a BK-tree per hash, so these can be found without comparing against
+every stored image. The store grows as `download_images` saves new images
+(see `record`) and can be rebuilt from the images on disk (see `rebuild`).
+'''
+
+import logging
+import os
+import threading
+import numpy as np
+import imagehash
+from PIL import Image
+from core.database import config
+
+logger = logging.getLogger(__name__)
+
+IMAGEPATH = os.path.expanduser(config.get('imagestore','imagepath'))
+HASHSTORE = os.path.join(IMAGEPATH, 'imagehashes.bin')
+
+HASHES = {
+    'average' : imagehash.average_hash,
+    'phash'   : imagehash.phash,
+    'dhash'   : imagehash.dhash,
+}
+HASH_DTYPE = np.dtype([('average','<u8'), ('phash','<u8'), ('dhash','<u8')])
+
+_lock = threading.Lock()
+
+def hamming(a, b):
+    '''Returns the number of bits that differ between two hashes (as integers)'''
+    return bin(a ^ b).count('1')
+
+def hash2int(myhash):
+    '''Returns an imagehash as an integer'''
+    return int(str(myhash), 16)
+
+def hash2filename(average):
+    '''Returns the filename of an image given its average hash (as integer)'''
+    return '%016x.jpg' %average
+
+def compute_hashes(image):
+    '''Returns the hashes of a PIL image as a record of the hash store'''
+    record = np.zeros(1, dtype=HASH_DTYPE)
+    for kind, function in HASHES.items():
+        record[kind] = hash2int(function(image))
+    return record
+
+def record(image, path=HASHSTORE):
+    '''Adds the hashes of a (newly stored) PIL image to the hash store'''
+    data = compute_hashes(image).tobytes()
+    with _lock:
+        # a single small write in append mode, so concurrent processes do not interleave records
+        with open(path, mode='ab') as fo:
+            fo.write(data)
+
+def load(path=HASHSTORE, start=0):
+    '''Returns the records in the hash store, from record number `start` onwards'''
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=HASH_DTYPE)
+    with open(path, mode='rb') as fi:
+        fi.seek(start * HASH_DTYPE.itemsize)
+        data = fi.read()
+    # ignore a partially written last record
+    data = data[:len(data) - len(data) % HASH_DTYPE.itemsize]
+    return np.frombuffer(data, dtype=HASH_DTYPE)
+
+def rebuild(imagepath=IMAGEPATH, path=HASHSTORE):
+    '''Recomputes the hash store from the images in the image store, returns the number of images'''
+    records = []
+    for directory, subdirectories, filenames in os.walk(imagepath):
+        for filename in filenames:
+            if not filename.endswith('.jpg'): continue
+            try:
+                with Image.open(os.path.join(directory, filename)) as image:
+                    records.append(compute_hashes(image))
+            except Exception as e:
+                logger.warning("Could not hash {filename}: {e}".format(**locals()))
+            if len(records) % 1000 == 0 and records:
+                logger.info("hashed {n} images".format(n=len(records)))
+    records = np.concatenate(records) if records else np.zeros(0, dtype=HASH_DTYPE)
+    tmp = path + '.tmp'
+    with open(tmp, mode='wb') as fo:
+        fo.write(records.tobytes())
+    with _lock:
+        os.replace(tmp, path)
+    logger.info("stored the hashes of {n} images in {path}".format(n=len(records), **locals()))
+    return len(records)
+
+class BKTree():
+    '''A BK-tree of 64-bit hashes under the Hamming distance
+
+    Every node is a list [hash, items, children], where children maps the
+    distance to the child node. A query for hashes within distance r of h
+    only descends into children at distance d-r...d+r of a node at distance
+    d (triangle inequality).
+    '''
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, myhash, item):
+        myhash = int(myhash)
+        self.size += 1
+        if self.root is None:
+            self.root = [myhash, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(myhash, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [myhash, [item], {}]
+                return
+            node = child
+
+    def search(self, myhash, max_distance):
+        '''Returns a list of (distance, item) within max_distance of a hash, closest first'''
+        myhash = int(myhash)
+        found = []
+        todo = [self.root] if self.root is not None else []
+        while todo:
+            node = todo.pop()
+            distance = hamming(myhash, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    todo.append(child)
+        return sorted(found)
+
+class ImageIndex():
+    '''Finds similar images in the image store
+
+    Parameters
+    ----
+    kind : string (default='phash')
+        The hash to compare: 'average', 'phash' or 'dhash'
+    path : string (default=HASHSTORE)
+        The hash store
+    '''
+
+    def __init__(self, kind='phash', path=HASHSTORE):
+        assert kind in HASHES, "kind should be one of {}".format(sorted(HASHES))
+        self.kind = kind
+        self.path = path
+        self.tree = BKTree()
+        self.seen = set()
+        self.loaded = 0 # the number of records read from the store
+
+    def refresh(self):
+        '''Adds the images stored since the index was (last) loaded'''
+        if os.path.exists(self.path) and os.path.getsize(self.path) < self.loaded * HASH_DTYPE.itemsize:
+            # the store was rebuilt
+            self.__init__(self.kind, self.path)
+        records = load(self.path, start=self.loaded)
+        self.loaded += len(records)
+        for average, value in zip(records['average'].tolist(), records[self.kind].tolist()):
+            if average in self.seen: continue
+            self.seen.add(average)
+            self.tree.add(value, hash2filename(average))
+        return self
+
+    def similar(self, image, max_distance=6):
+        '''
+        Returns (distance, filename) of the stored images similar to an image, closest first
+
+        image can be a PIL image, the path of an image or the filename of an image in the image store
+        '''
+        if isinstance(image, str):
+            if not os.path.exists(image):
+                from processing.image_processing import hash2filepath
+                image = os.path.join(*hash2filepath(image[:-len('.jpg')] if image.endswith('.jpg') else image))
+            with Image.open(image) as fi:
+                myhash = hash2int(HASHES[self.kind](fi))
+        else:
+            myhash = hash2int(HASHES[self.kind](image))
+        return self.tree.search(myhash, max_distance)
+
+_indexes = {}
+
+def get_index(kind='phash'):
+    '''Returns the (per process) index of the image store, updated with newly stored images'''
+    if kind not in _indexes:
+        _indexes[kind] = ImageIndex(kind)
+    return _indexes[kind].refresh()
@@ -14,7 +14,8 @@ import logging
 import string
 import shlex
 import json
-import pandas
+import zlib
+import base64
 from core.database import config
 
 logger = logging.getLogger(__name__)
@@ -27,7 +28,7 @@ if sys.version_info.major==2:
 CMD_PARSE    = ["bin/Alpino", "end_hook=dependencies", "-parse"]
 CMD_TOKENIZE = ["Tokenization/tok"]
 ALPINO_HOME  = config.get("alpino", "alpino.home")
-os.environ['ALPINO_HOME'] = os.path.join(os.getcwd(),ALPINO_HOME)
+os.environ['ALPINO_HOME'] = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),ALPINO_HOME)
 
 QUOTE_PAIRS = [("„","“"),("“","”"),("‘","’"),("‛","’"),("«","»"),("‚","’"),("“","”"),("‹","›"),("‘","’"),
                ('„','“')]
@@ -49,8 +50,10 @@ def split_lines(text):
     return lines
 
 class alpino(Processer):
-    def process(self, document_field, splitlines=True):
-        """Alpino based tokenization and dependency parsing of Dutch texts"""
+    cacheable = True
+
+    def process(self, document_field, splitlines=True, compact=False):
+        """Alpino based tokenization and dependency parsing of Dutch texts, optionally compactly encoded (see encode_parses)"""
 
         if splitlines:
             document_field = split_lines(document_field)
@@ -93,6 +96,8 @@ class alpino(Processer):
             p.terminate()
             tree   = interpret_parse(parsed[0])
             line_parses.append(tree)
+        if compact:
+            return encode_parses(line_parses)
         return line_parses
 
     def _test_function(self):
@@ -265,261 +270,360 @@ _POSMAP = {"pronoun": 'O',
            'sbar': '?',
            '--': '?',
            }
+COMPACT_VERSION = 1
+_COMPACT_TOKEN_FIELDS = ['word', 'lemma', 'pos', 'offset', 'pos_major', 'pos_minor', 'pos1', 'sentence', 'id']
+_COMPACT_CODED_FIELDS = set(['pos', 'pos_major', 'pos_minor', 'pos1'])
+
+def encode_parses(line_parses):
+    '''
+    Encodes the parses of a document (as returned by `alpino.process`) compactly.
+
+    Tokens and dependencies are stored per line as columns, with POS tags and
+    relations as codes in a vocabulary shared by the lines, and the header is
+    stored once. The result is compressed and base64 encoded, so it can be
+    stored in a binary field: fields ending in `_compact` are mapped as binary
+    (see schema.json), e.g. `new_key='text_alpino_compact'`.
+    '''
+    vocabulary = {}
+    code = lambda value: vocabulary.setdefault(value, len(vocabulary))
+    header = None
+    lines = []
+    for parse in line_parses:
+        if not parse:
+            lines.append(None)
+            continue
+        header = header or parse.get('header')
+        tokens = parse.get('tokens', [])
+        dependencies = parse.get('dependencies', [])
+        line = {field: [code(token.get(field)) for token in tokens] if field in _COMPACT_CODED_FIELDS
+                else [token.get(field) for token in tokens] for field in _COMPACT_TOKEN_FIELDS}
+        line['child']    = [dep['child'] for dep in dependencies]
+        line['parent']   = [dep['parent'] for dep in dependencies]
+        line['relation'] = [code(dep['relation']) for dep in dependencies]
+        lines.append(line)
+    compact = {'version':COMPACT_VERSION, 'header':header, 'lines':lines,
+               'vocabulary':sorted(vocabulary, key=vocabulary.get)}
+    return base64.b64encode(zlib.compress(json.dumps(compact, separators=(',',':')).encode('utf-8'))).decode('ascii')
+
+def _is_compact(value):
+    '''Whether a field holds a compact encoding, elasticsearch returns it as str, other sources may give bytes'''
+    return isinstance(value, (str, bytes))
+
+def _decode_compact(value):
+    compact = json.loads(zlib.decompress(base64.b64decode(value)).decode('utf-8'))
+    if compact.get('version') != COMPACT_VERSION:
+        raise ValueError("Unknown compact parse version {}".format(compact.get('version')))
+    return compact
+
+def decode_parses(value):
+    '''Returns the parses (as returned by `alpino.process`) of a compact encoding, see `encode_parses`.
+    Parses that are not encoded are returned as they are.'''
+    if not _is_compact(value):
+        return value
+    compact = _decode_compact(value)
+    vocabulary = compact['vocabulary']
+    parses = []
+    for line in compact['lines']:
+        if line is None:
+            parses.append({})
+            continue
+        columns = [[vocabulary[code] for code in line[field]] if field in _COMPACT_CODED_FIELDS else line[field]
+                   for field in _COMPACT_TOKEN_FIELDS]
+        tokens = [dict(zip(_COMPACT_TOKEN_FIELDS, values)) for values in zip(*columns)]
+        dependencies = [dict(child=child, parent=parent, relation=vocabulary[relation])
+                        for child, parent, relation in zip(line['child'], line['parent'], line['relation'])]
+        parses.append(dict(header=compact['header'], dependencies=dependencies, tokens=tokens))
+    return parses
+
 #drawn from  van Atteveldt, Sheaferm, Shenhav 2015: "Clause analysis: using syntactic information to enrich frequency-based automatic content analysis"
 
 SPEACH_VERBS = ["accepteer", "antwoord", "beaam", "bedenk", "bedoel", "begrijp", "beken", "beklemtoon", "bekrachtig", "belijd", "beluister", "benadruk", "bereken", "bericht", "beschouw", "beschrijf", "besef", "betuig", "bevestig", "bevroed", "beweer", "bewijs", "bezweer", "biecht", "breng", "brul", "concludeer", "confirmeer", "constateer", "debiteer", "declareer", "demonstreer", "denk", "draag_uit", "email", "erken", "expliceer", "expliciteer", "fantaseer", "formuleer", "geef_aan", "geloof", "hoor", "hamer", "herinner", "houd_vol", "kondig_aan", "kwetter", "licht_toe", "maak_bekend", "maak_hard", "meld", "merk", "merk_op", "motiveer", "noem", "nuanceer", "observeer", "onderschrijf", "onderstreep", "onthul", "ontsluier", "ontval", "ontvouw", "oordeel", "parafraseer", "postuleer", "preciseer", "presumeer", "pretendeer", "publiceer", "rapporteer", "realiseer", "redeneer", "refereer", "reken", "roep", "roer_aan", "ruik", "schat", "schets", "schilder", "schreeuw", "schrijf", "signaleer", "snap", "snater", "specificeer", "spreek_uit", "staaf", "stel", "stip_aan", "suggereer", "tater", "teken_aan", "toon_aan", "twitter", "verbaas", "verhaal", "verklaar", "verklap", "verkondig", "vermoed", "veronderstel", "verraad", "vertel", "vertel_na", "verwacht", "verwittig", "verwonder", "verzeker", "vind", "voel", "voel_aan", "waarschuw", "wed", "weet", "wijs_aan", "wind", "zeg", "zet_uiteen", "zie", "twitter"]
 ANAPHORAS    = ["hij","zij","hun"]
-class alpino_to_quote(Processer):
-    '''Takes alpino output and extracts quotes'''
-
-    def process(self, alpino_result):
-        '''takes an alpino result and returns a list of {speaker:name,using:verb,quote:text} dicts'''
+_SPEECH_VERBS = frozenset(SPEACH_VERBS)
+_QUOTE_MARK   = re.compile(r'["“”„:]|,{2,2}\'|\'[^s]')
+_RELATIONS    = {} # dependency relation -> small int code, shared by all parses
 
-        quotes = []
-        for num,line in enumerate(alpino_result):
-            mapped, tokens = self.map_parse(line)
-            line_quotes= []
-            line_quotes.extend(self.type_a(mapped, tokens))
-            line_quotes.extend(self.type_b(mapped, tokens))
-            line_quotes.extend(self.type_c(mapped, tokens))
-            line_quotes.extend(self.type_d(mapped, tokens))
-            line_quotes.extend(self.type_e(mapped, tokens))
-            [q.update({'line':num}) for q in line_quotes]
-            if line_quotes: quotes.append(line_quotes[0])
-        return quotes
+def _relation_codes(relations):
+    return None if relations is None else set(_RELATIONS.setdefault(r, len(_RELATIONS)) for r in relations)
 
-    # map dependency & token list
-    def map_parse(self, alpino_parse):
-        if not alpino_parse.get('tokens',[]): return pandas.DataFrame(), pandas.DataFrame()
-        tokens       = pandas.DataFrame(alpino_parse['tokens'])
-        dependencies = pandas.DataFrame(alpino_parse['dependencies'])
-        mapped = dependencies.merge(tokens[['id','lemma']], left_on='child', right_on='id', suffixes=('','lemma'))
-        mapped.columns = ['child','parent','relation','child_id','child_lemma']
-        mapped = mapped.merge(tokens[['id','lemma']], left_on='parent', right_on='id', suffixes=('','lemma'))
-        mapped.columns = ['child', 'parent', 'relation', 'child_id','child_lemma','parent_id', 'parent_lemma']
-        return mapped, tokens
-
-    # relational parser
-    def get_relation(self, mapped, child=True, relation=True, parent=True):
-        id_type = lambda x: type(x)!=str
-        if type(relation) not in [list,bool]:
-            relation = [relation]
-        if id_type(child):
-            child_condition = type(child) == bool and (True) or (mapped.child_id ==int(child))
-        else:
-            child_condition    = type(child)  == bool and True or (mapped.child_lemma==child)
+class AlpinoParse():
+    '''
+    Indexes an alpino parse (see `interpret_parse`) for the quote rules.
 
-        relation_condition = type(relation)     == bool and True or (mapped.relation.isin(relation))
+    Tokens are kept in lists in the order of the parse, with their position
+    per token id. Dependencies are kept as lists of (token id, relation code)
+    per parent and per child, so the rules only look at the dependencies of
+    the tokens they visit. Dependencies between unknown tokens are ignored.
+    '''
 
-        if id_type(parent):
-            parent_condition = type(parent) == bool and (True) or (mapped.parent_id == int(parent))
+    def __init__(self, alpino_parse):
+        tokens = alpino_parse.get('tokens', []) if alpino_parse else []
+        dependencies = alpino_parse.get('dependencies', []) if tokens else []
+        self._build([t['id'] for t in tokens], [t.get('word') for t in tokens], [t.get('lemma') for t in tokens],
+                    [t.get('pos') for t in tokens], [t.get('offset') for t in tokens],
+                    [(dep['child'], dep['parent'], dep['relation']) for dep in dependencies])
+
+    @classmethod
+    def from_compact(cls, line, vocabulary):
+        '''Indexes a line of a compact encoding (see `encode_parses`) without creating token dicts'''
+        parse = cls.__new__(cls)
+        if not line:
+            parse._build([], [], [], [], [], [])
         else:
-            parent_condition   = type(parent) == bool and True or (mapped.parent_lemma==parent)
-
-        return mapped[ (mapped.child==mapped.child) & child_condition & relation_condition & parent_condition]
-
-    def get_literal(self, tokens):
-        if tokens.empty: return []
-        r = re.compile(r'["“”„:]|,{2,2}\'|\'[^s]')
-        tokens["hasquote"] = [getattr(r.search(w),'group',lambda:None)() for w in tokens.word]
-        quotes = [q for q in tokens[[hq!=None for hq in tokens.hasquote]].sort_values('offset')[['offset','hasquote','word']].itertuples()]
-        indices = []
-        startq  = None
-        colpos  = None
-        for q in quotes:
+            parse._build(line['id'], line['word'], line['lemma'], [vocabulary[code] for code in line['pos']],
+                         line['offset'], zip(line['child'], line['parent'],
+                                             [vocabulary[code] for code in line['relation']]))
+        return parse
+
+    def _build(self, ids, word, lemma, pos, offset, dependencies):
+        self.ids    = ids
+        self.word   = word
+        self.lemma  = lemma
+        self.pos    = pos
+        self.offset = offset
+        self.index  = {token_id:num for num, token_id in enumerate(self.ids)}
+        by_offset   = sorted(range(len(ids)), key=self.offset.__getitem__)
+        self.rank   = {num:rank for rank, num in enumerate(by_offset)}
+        self.by_offset = by_offset
+        self.children  = {}
+        self.parents   = {}
+        self.n_dependencies = 0
+        for child, parent, relation in (dependencies if ids else []):
+            if child not in self.index or parent not in self.index: continue
+            code = _RELATIONS.setdefault(relation, len(_RELATIONS))
+            self.children.setdefault(parent, []).append((child, code))
+            self.parents.setdefault(child, []).append((parent, code))
+            self.n_dependencies += 1
+
+    @property
+    def empty(self):
+        return not self.ids or not self.n_dependencies
+
+    def get(self, field, token_id):
+        return getattr(self, field)[self.index[token_id]]
+
+    def related(self, token_id, direction='down', relations=None):
+        '''Returns the children (down) or parents (up) of a token, optionally only for some relations'''
+        codes = _relation_codes(relations)
+        edges = (direction == 'up' and self.parents or self.children).get(token_id, [])
+        return [other for other, code in edges if codes is None or code in codes]
+
+    def with_lemma(self, lemmas, pos=None):
+        '''Returns the ids of the tokens with one of these lemmas (in parse order)'''
+        return [token_id for token_id, lemma, token_pos in zip(self.ids, self.lemma, self.pos)
+                if lemma in lemmas and (pos is None or token_pos == pos)]
+
+    def trace(self, token_id, direction='up', relations=None, prev=[]):
+        '''Returns the tokens reachable from a token, following parents (up) or children (down)'''
+        trace = []
+        related = self.related(token_id, direction, relations)
+        if related:
+            trace.extend(related)
+            for other in related:
+                if other not in prev:
+                    trace.extend(self.trace(other, direction, relations, prev=trace+prev))
+        return trace
+
+    def words(self, token_ids):
+        '''Returns the words of a set of tokens, in the order of the text'''
+        positions = set(self.index[token_id] for token_id in token_ids if token_id in self.index)
+        return [self.word[num] for num in sorted(positions, key=self.rank.__getitem__)]
+
+    def literals(self):
+        '''Returns lists of token ids between quotation marks, or after a colon'''
+        marks = []
+        for num in self.by_offset:
+            mark = _QUOTE_MARK.search(self.word[num])
+            if mark:
+                marks.append((self.offset[num], mark.group(), self.word[num]))
+        spans  = []
+        startq = None
+        colpos = None
+        for offset, mark, word in marks:
             if not startq:
-                if q[2]==':':
-                    colpos=q[1]
+                if mark == ':':
+                    colpos = offset
                     continue
-                if len(r.findall(q[3]))>1:
-                    indices.append((q[1],q[1]))
+                if len(_QUOTE_MARK.findall(word)) > 1:
+                    spans.append((offset, offset))
                     continue
-                startq=q
+                startq = (offset, mark)
                 colpos = None
             else:
-                if q[2]!=startq[2]: continue
-                if len(r.findall(q[3]))>1:
-                    indices.append((startq,q[1]))
-                    startq=q[1]
-                    continue
-                indices.append((startq[1],q[1]))
-                startq = None
+                if mark != startq[1]: continue
+                spans.append((startq[0], offset))
+                # a token that closes a quote can also open the next one
+                startq = len(_QUOTE_MARK.findall(word)) > 1 and (offset, mark) or None
         if colpos:
-            indices.append((colpos, max(tokens.offset)))
-        get_indices = lambda start,stop: list(range(start,stop+1))
-        get_ids     = lambda start,stop: list(tokens.id[tokens.offset.isin(get_indices(start,stop))])
-        quote_lists = [get_ids(*indi) for indi in indices]
-        return quote_lists
+            spans.append((colpos, max(self.offset)))
+        return [[token_id for token_id, offset in zip(self.ids, self.offset) if start <= offset <= stop]
+                for start, stop in spans]
 
-    def get_series(self, tokens, start=0, end=False):
-        if not end:
-            end = max(tokens.offset)
-        return ' '.join(tokens.sort_values('offset')[(tokens.offset>=start)&(tokens.offset<=end)].word)
+class alpino_to_quote(Processer):
+    '''Takes alpino output and extracts quotes'''
+    cacheable = True
 
-    def get_list(self, tokens, indices, pos_major=''):
-        return tokens[tokens.id.isin(indices)].sort_values('offset').word
+    def process(self, alpino_result):
+        '''takes an alpino result (or its compact encoding) and returns a list of {speaker:name,using:verb,quote:text} dicts'''
 
-    def tracer(self, mapped, wordid, direction="up", relations=True, prev=[]):
-        trace = []
-        if direction=="up":
-            parent = self.get_relation(mapped, relation=relations, child=wordid).parent.values
-        else:
-            parent = self.get_relation(mapped, relation=relations, parent=wordid).child.values
-        if parent.any():
-            trace.extend([p for p in parent])
-            [trace.extend(self.tracer(mapped,p, direction,relations=relations, prev=trace+prev)) for p in parent if p not in prev]
-        return trace
+        quotes = []
+        for num, parse in enumerate(self.map_parses(alpino_result)):
+            line_quotes= []
+            line_quotes.extend(self.type_a(parse))
+            line_quotes.extend(self.type_b(parse))
+            line_quotes.extend(self.type_c(parse))
+            line_quotes.extend(self.type_d(parse))
+            line_quotes.extend(self.type_e(parse))
+            [q.update({'line':num}) for q in line_quotes]
+            if line_quotes: quotes.append(line_quotes[0])
+        return quotes
+
+    # index the dependencies & tokens of all lines at once
+    def map_parses(self, alpino_result):
+        if _is_compact(alpino_result):
+            compact = _decode_compact(alpino_result)
+            return [AlpinoParse.from_compact(line, compact['vocabulary']) for line in compact['lines']]
+        return [self.map_parse(line) for line in alpino_result]
+
+    def map_parse(self, alpino_parse):
+        return AlpinoParse(alpino_parse)
 
     # extract relations where necessary
-    def get_source(self, mapped, tokens, verb_id):
-        subject = tokens[tokens.id.isin(self.get_relation(mapped, relation='su', parent=verb_id).child)]
-        if subject.empty:
+    def get_source(self, parse, verb_id):
+        subject = set(parse.related(verb_id, 'down', ['su']))
+        subject = [token_id for token_id in parse.ids if token_id in subject]
+        if not subject:
             return ''
-        elif subject.lemma.values[0]=='en':
-            return ';'.join(self.get_list(tokens, self.tracer(mapped,subject.id,'down')))
+        elif parse.get('lemma', subject[0])=='en':
+            return ';'.join(parse.words(parse.trace(subject[0],'down')))
         else:
-            return ''.join(subject.word)
+            return ''.join(parse.get('word', token_id) for token_id in subject)
 
-    def type_c(self, mapped,tokens):
-        if mapped.empty or tokens.empty: return []
-        verbs = tokens[tokens.lemma.isin(SPEACH_VERBS)]
+    def type_c(self, parse):
+        if parse.empty: return []
         quotes = []
-        for verb_id in verbs.id:
-            type_c_relation    = self.get_relation(mapped, child='dat',relation='vc',parent=verb_id)
-            if type_c_relation.empty: return []
-            #    type_c_2_relation  = self.get_relation(mapped, child='hoop', relation='obj1', parent=verb_id)
-            #    if type_c_2_relation.empty: continue
-            #    type_c_2b_relation = self.get_relation(mapped, child='dat', relation='vc', parent=type_c_2_relation.child)
-            #    if type_c_2b_relation.empty:continue
-            #    body = self.get_list(diltokens,self.tracer(mapped,type_c_2b_relation.child,'down'))
-            #else:
-            body = self.get_list(tokens, self.tracer(mapped,type_c_relation.child, 'down'))
-            verb_word  = tokens[tokens.id==verb_id].word.values[0]
-            verb_lemma = tokens[tokens.id==verb_id].lemma.values[0]
-            source = self.get_source(mapped,tokens, verb_id)
+        for verb_id in parse.with_lemma(_SPEECH_VERBS):
+            type_c_relation = [child for child in parse.related(verb_id, 'down', ['vc'])
+                               if parse.get('lemma', child)=='dat']
+            if not type_c_relation: return []
+            body = parse.words(parse.trace(type_c_relation[0], 'down'))
+            source = self.get_source(parse, verb_id)
             quotes.append({
                 'type':'C',
                 'literal':'no',
-                'verb_lemma': verb_lemma,
-                'verb_word': verb_word,
+                'verb_lemma': parse.get('lemma', verb_id),
+                'verb_word': parse.get('word', verb_id),
                 'source':source,
                 'body':' '.join(body)
             })
         return quotes
 
-    def type_a(self, mapped, tokens):
-        if tokens.empty or mapped.empty: return []
+    def type_a(self, parse):
+        if parse.empty: return []
         quotes = []
-        verbs = tokens[tokens.lemma=="blijk"]
-        if verbs.empty: return []
-        type_a_relation = self.get_relation(mapped, child='uit', relation='pc', parent=verbs.id.values[0])
-        if type_a_relation.empty: return []
-        source = ' '.join(self.get_list(tokens,self.tracer(mapped,type_a_relation.child.values[0],'down')))
-        type_a_body_relation = self.get_relation(mapped, relation='su', parent=verbs.id.values[0])
-        if type_a_body_relation.empty:
+        verbs = parse.with_lemma(['blijk'])
+        if not verbs: return []
+        type_a_relation = [child for child in parse.related(verbs[0], 'down', ['pc'])
+                           if parse.get('lemma', child)=='uit']
+        if not type_a_relation: return []
+        source = ' '.join(parse.words(parse.trace(type_a_relation[0],'down')))
+        type_a_body_relation = parse.related(verbs[0], 'down', ['su'])
+        if not type_a_body_relation:
             body = ""
         else:
-            body  = self.get_list(tokens, self.tracer(mapped,type_a_body_relation.child,'down'))
-            if body.empty:
-                body = ''
-                pass #Should solve for 'dat' reference
-            else:
-                body = ' '.join(body)
+            body = ' '.join(parse.words(parse.trace(type_a_body_relation[0],'down')))
         quotes.append({
             'type':'A',
             'literal':'no',
             'verb_lemma':'blijk',
-            'verb_word':verbs.word.values[0],
+            'verb_word':parse.get('word', verbs[0]),
             'source':source,
             'body':body
         })
         return quotes
 
-    def pivot(self, mapped, series):
+    def pivot(self, parse, series):
         pivots = set()
         for element in series:
             if not pivots:
-                pivots = set(self.tracer(mapped,element,'up'))
+                pivots = set(parse.trace(element,'up'))
             else:
-                pivots = pivots.intersection(set(self.tracer(mapped,element,'up')))
+                pivots = pivots.intersection(set(parse.trace(element,'up')))
         return pivots
 
-    def type_b(self, mapped,tokens):
-        if mapped.empty or tokens.empty: return []
-        accordings = tokens[tokens.lemma.isin(['volgens','aldus'])]
-        if accordings.empty: return []
+    def type_b(self, parse):
+        if parse.empty: return []
         quotes = []
-        for acc in accordings.id:
-            type_b_quote_relation = pandas.concat([self.get_relation(mapped, relation="tag",child=acc),
-                                                  self.get_relation(mapped, relation="mod", child=acc)])
-            source_ids = self.tracer(mapped,acc,'down')
-            pivot = set(self.tracer(mapped,acc,'up')).intersection(set(self.tracer(mapped,type_b_quote_relation.parent,'up')))
-            quote_ids  = [id for id in self.tracer(mapped,min(pivot),'down') if
+        for acc in parse.with_lemma(['volgens','aldus']):
+            type_b_quote_relation = parse.related(acc, 'up', ['tag']) + parse.related(acc, 'up', ['mod'])
+            if not type_b_quote_relation: continue
+            source_ids = parse.trace(acc,'down')
+            pivot = set(parse.trace(acc,'up')).intersection(set(parse.trace(type_b_quote_relation[0],'up')))
+            if not pivot: continue
+            quote_ids  = [id for id in parse.trace(min(pivot),'down') if
                           id not in source_ids + [acc]]
             quotes.append({
                 'type':'B',
                 'literal':'no',
-                'verb_lemma':tokens.lemma[tokens.id==acc].values[0],
-                'verb_word': tokens.word[tokens.id == acc].values[0],
-                'source':' '.join(self.get_list(tokens,source_ids)),
-                'body':' '.join(self.get_list(tokens,quote_ids))
+                'verb_lemma':parse.get('lemma', acc),
+                'verb_word': parse.get('word', acc),
+                'source':' '.join(parse.words(source_ids)),
+                'body':' '.join(parse.words(quote_ids))
             })
         return quotes
 
-    def type_d(self, mapped, tokens):
+    def type_d(self, parse):
         quotes = []
-        literals = self.get_literal(tokens)
-        merged_literals = []
-        for literal in literals: merged_literals.extend(literal)
+        literals = parse.literals()
+        merged_literals = set()
+        for literal in literals: merged_literals.update(literal)
+        outside = [num for num, token_id in enumerate(parse.ids) if token_id not in merged_literals]
         for literal in  literals:
-            name = tokens.word[(tokens.pos=='name')&(tokens.id.isin(merged_literals)==False)]
-            pron = tokens.word[(tokens.pos=='pron')&(tokens.id.isin(merged_literals)==False)]
+            name = [parse.word[num] for num in outside if parse.pos[num]=='name']
+            pron = [parse.word[num] for num in outside if parse.pos[num]=='pron']
+            verb = [num for num in outside if parse.lemma[num] in _SPEECH_VERBS]
 
-            verb = tokens[(tokens.lemma.isin(SPEACH_VERBS))&(tokens.id.isin(merged_literals)==False)]
-
-            if not name.empty:
+            if name:
                 source = ' '.join(name)
             else:
                 source = ' '.join(pron)
             quotes.append({
                 'type':'D',
                 'literal':'yes',
-                'verb_lemma':' '.join(verb.lemma),
-                'verb_word':' '.join(verb.word),
+                'verb_lemma':' '.join(parse.lemma[num] for num in verb),
+                'verb_word':' '.join(parse.word[num] for num in verb),
                 'source':source,
-                'body':' '.join(self.get_list(tokens,literal))
+                'body':' '.join(parse.words(literal))
             })
         return quotes
 
-    def type_e(self, mapped,tokens):
-        if mapped.empty or tokens.empty: return []
+    def type_e(self, parse):
+        if parse.empty: return []
         quotes = []
-        verbs = tokens[(tokens.lemma.isin(SPEACH_VERBS))&(tokens.pos=='verb')]
-        for token in verbs.id:
-            verb = tokens[(tokens.lemma.isin(SPEACH_VERBS))]
-
-            verb_sub = self.get_relation(mapped, relation='su', parent=token)
-            if verb_sub.empty:
+        verb = parse.with_lemma(_SPEECH_VERBS)
+        for token in parse.with_lemma(_SPEECH_VERBS, pos='verb'):
+            verb_sub = parse.related(token, 'down', ['su'])
+            if not verb_sub:
                 return []
-            verb_source = self.tracer(mapped,verb_sub.child,'down',relations=["det","de","mod"]) + list(verb_sub.child)
-
-            verb_obj = self.get_relation(mapped, relation='obj1', parent=token)
-            if verb_obj.empty:
-                verb_obj = self.get_relation(mapped, relation='nucl', parent=token)
-            if verb_obj.empty:
-                verb_obj = self.get_relation(mapped, relation='dp', parent=token)
-            if not verb_obj.empty:
-                verb_body = self.tracer(mapped,verb_obj.child,'down')+list(verb_obj.child)
+            verb_source = parse.trace(verb_sub[0],'down',relations=["det","de","mod"]) + verb_sub
+
+            verb_obj = parse.related(token, 'down', ['obj1'])
+            if not verb_obj:
+                verb_obj = parse.related(token, 'down', ['nucl'])
+            if not verb_obj:
+                verb_obj = parse.related(token, 'down', ['dp'])
+            if verb_obj:
+                verb_body = parse.trace(verb_obj[0],'down')+verb_obj
             else:
                 verb_body = []
 
             quotes.append({
                 'type':'E',
                 'literal':'no',
-                'verb_lemma': ' '.join(verb.lemma),
-                'verb_word':' '.join(verb.word),
-                'source': ' '.join(self.get_list(tokens,verb_source)),
-                'body': ' '.join(self.get_list(tokens, verb_body))
+                'verb_lemma': ' '.join(parse.get('lemma', token_id) for token_id in verb),
+                'verb_word':' '.join(parse.get('word', token_id) for token_id in verb),
+                'source': ' '.join(parse.words(verb_source)),
+                'body': ' '.join(parse.words(verb_body))
             })
         return quotes
 
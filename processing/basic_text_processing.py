@@ -25,6 +25,7 @@ import unicodedata
 
 class clean_whitespace(Processer):
     '''Changes multiple whitespace to single whitespace'''
+    cacheable = True
 
     def process(self, document_field):
         '''multiple whitespaces were folded to single whitespaces'''
@@ -45,6 +46,7 @@ class split_texts(Processer):
             
 class njr(Processer):
     '''Keeps only nouns (N), adjectives (J), and adverbs (R) (N, J, R are Penn Treebank tags)'''
+    cacheable = True
 
     def process(self, document_field):
         '''everything except nouns, adjectives, and adverbs was removed'''
@@ -58,6 +60,7 @@ class njr(Processer):
 
 class remove_punctuation(Processer):
     '''removes all punctuation. "Bla. Bla bla+" -> "Bla Bla bla". "Willem-Alexander" -> WillemAlexander'''
+    cacheable = True
     try:  #assume python2
         tbl = dict.fromkeys(i for i in xrange(maxunicode) if unicodedata.category(unichr(i)).startswith('P'))
     except:   #but do this in python3
@@ -70,6 +73,7 @@ class remove_punctuation(Processer):
 
 class lowercase(Processer):
     '''converts to lowercase'''
+    cacheable = True
     def process(self, document_field):
         '''converted to lowercase'''
         return document_field.lower()
@@ -155,6 +159,7 @@ class remove_stopwords(Processer):
 Example for stopwords_list Dutch language: 
 import requests
 stopwords = requests.get("https://raw.githubusercontent.com/stopwords-iso/stopwords-nl/master/stopwords-nl.txt").text.splitlines()'''
+    cacheable = True
 
     def process(self, document_field, **kwargs):
         '''removes stopwords'''
@@ -186,6 +191,7 @@ stopwords = requests.get("https://raw.githubusercontent.com/stopwords-iso/stopwo
 
 class stemming(Processer):
     '''Stems all the words in a document, based on nltk snowball stemming. Expects the keyword 'language' with the language  of the document as string as input, for example "dutch".'''
+    cacheable = True
 
     def process(self, document_field, language = ""):
         from nltk.stem.snowball import SnowballStemmer
@@ -1,20 +1,28 @@
 # -*- coding: utf-8 -*-
 from core.processor_class import Processer
 from core.database import config
+from processing import _image_similarity
 # from core.basic_utils import dotkeys
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image
 import imagehash
+import io
 import os
-import sys
-
-IS_PYTHON3 = sys.version_info[0]==3 and sys.version_info[1]>=2
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 
-IMAGEPATH = config.get('imagestore','imagepath')
+IMAGEPATH = os.path.expanduser(config.get('imagestore','imagepath'))
+THREADS   = int(config.get('imagestore', 'threads', fallback='8'))
+TIMEOUT   = float(config.get('imagestore', 'timeout', fallback='10'))
+MAXBYTES  = int(config.get('imagestore', 'maxsize', fallback='20')) * 1024 * 1024 # in MB
+URLINDEX  = os.path.join(IMAGEPATH, 'urlindex.sqlite')
+RETRY_STATUS = {408, 429} # client errors that may not occur when trying again later
 
 
 def hash2filepath(myhash):
@@ -22,49 +30,197 @@ def hash2filepath(myhash):
     Returns a tuple consisting of the directory in which the image is to be stored
     and the filename itself. The filename is identical to the hash.
     '''
-    hashstr = str(myhash) 
+    hashstr = str(myhash)
     path = os.path.join(IMAGEPATH,hashstr[:4],hashstr[4:8],hashstr[8:12],hashstr[12:])
     filename = hashstr + '.jpg'
     return path,filename
 
 
+class DownloadError(Exception):
+    '''Raised for images that cannot be downloaded at all, e.g. because they no longer exist'''
+
+    def __init__(self, url, status):
+        super().__init__("{url} returned status {status}".format(**locals()))
+        self.url = url
+        self.status = status
+
+def _is_permanent(status):
+    '''Whether an HTTP status means that downloading again will not help'''
+    return 400 <= status < 500 and status not in RETRY_STATUS
+
+class _UrlIndex():
+    '''Remembers the hash of every downloaded url, so images are downloaded only once,
+    and the status of urls that cannot be downloaded'''
+
+    def __init__(self, path=URLINDEX):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite connections should not be shared between threads or (forked) processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS failed (url TEXT PRIMARY KEY, status INTEGER)")
+            connection.commit()
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, url):
+        row = self._connection().execute("SELECT hash FROM urls WHERE url=?", (url,)).fetchone()
+        return row and row[0]
+
+    def set(self, url, myhash):
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO urls (url, hash) VALUES (?,?)", (url, str(myhash)))
+
+    def failed(self, url):
+        '''Returns the status of a url that could not be downloaded, if any'''
+        row = self._connection().execute("SELECT status FROM failed WHERE url=?", (url,)).fetchone()
+        return row and row[0]
+
+    def set_failed(self, url, status):
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO failed (url, status) VALUES (?,?)", (url, status))
+
+_session = None
+_session_pid = None
+_urlindex = None
+_lock = threading.Lock()
+
+def _get_session():
+    '''Returns a session (shared by the download threads) that keeps connections to image hosts open'''
+    global _session, _session_pid, _urlindex
+    with _lock:
+        # connections should not be shared with (forked) processes
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=THREADS, pool_maxsize=THREADS, max_retries=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+            _session_pid = os.getpid()
+            _urlindex = _UrlIndex()
+    return _session
 
 
 class download_images(Processer):
-    
+
     '''Downloads and stores images'''
     def process(self, document_field):
         '''
         document_field is expected to be a list of dicts, with each dict having at least
         the key 'url'
         '''
-        document_field_new = []
-        for image in document_field:
-            filename = self.download(image["url"])
-            image_new = image.copy()
-            image_new['filename'] = filename
-            document_field_new.append(image_new)
-        return document_field_new
+        return self.process_batch([document_field])[0]
+
+    def process_batch(self, document_fields):
+        '''Downloads the images of a batch of documents concurrently, each url only once
+
+        Images that cannot be downloaded at all (see DownloadError) get the HTTP status under
+        'error' instead of a filename. Returns None for documents of which an image could not
+        be downloaded for another reason (e.g. a timeout), so their images are downloaded again
+        in a next run (downloaded images are not downloaded twice).
+        '''
+        urls = list({image["url"] for document_field in document_fields for image in document_field})
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            filenames = dict(zip(urls, executor.map(self._download_or_log, urls)))
+        results = []
+        for document_field in document_fields:
+            if not all(filenames[image["url"]] for image in document_field):
+                results.append(None)
+                continue
+            document_field_new = []
+            for image in document_field:
+                image_new = image.copy()
+                if isinstance(filenames[image["url"]], DownloadError):
+                    image_new['error'] = filenames[image["url"]].status
+                else:
+                    image_new['filename'] = filenames[image["url"]]
+                document_field_new.append(image_new)
+            results.append(document_field_new)
+        return results
+
+    def _download_or_log(self, url):
+        '''Returns the filename of an image, the DownloadError if it cannot be downloaded at all, or None'''
+        try:
+            return self.download(url)
+        except DownloadError as e:
+            logger.info("Could not download image {url}: {e}".format(**locals()))
+            return e
+        except Exception as e:
+            logger.warning("Could not download image {url}: {e}".format(**locals()))
 
     def download(self,url):
-        response = requests.get(url, stream=True)
-        imagecontent = Image.open(response.raw)
+        '''Downloads an image (unless it was downloaded before) and returns its filename
+
+        Raises a DownloadError if the url returned a client error (such as 404), also when
+        it did so before.
+        '''
+        session = _get_session()
+        myhash = _urlindex.get(url)
+        if myhash:
+            directory, filename = hash2filepath(myhash)
+            if os.path.exists(os.path.join(directory,filename)):
+                return filename
+        status = _urlindex.failed(url)
+        if status:
+            raise DownloadError(url, status)
+
+        response = session.get(url, stream=True, timeout=TIMEOUT)
+        if _is_permanent(response.status_code):
+            _urlindex.set_failed(url, response.status_code)
+            raise DownloadError(url, response.status_code)
+        response.raise_for_status()
+        content = response.raw.read(MAXBYTES + 1, decode_content=True)
+        if len(content) > MAXBYTES:
+            raise ValueError("image is larger than {MAXBYTES} bytes".format(MAXBYTES=MAXBYTES))
+        imagecontent = Image.open(io.BytesIO(content))
         myhash = imagehash.average_hash(imagecontent)
         directory, filename =  hash2filepath(myhash)
-        if IS_PYTHON3:
+        target = os.path.join(directory,filename)
+        if not os.path.exists(target):
             os.makedirs(directory, exist_ok=True)
-        else:
-            # In py2, we use this try/except construction to avoiud
-            # race conditions and to minimize disk usage 
-            try:
-                os.makedirs(path)
-            except OSError:
-                if not os.path.isdir(path):
-                    raise
-        #with open(os.path.join(directory,filename),mode='wb') as fo:
-            #fo.write(imagecontent)
-        imagecontent.save(os.path.join(directory,filename))
+            # write to a temporary file first, so other threads or processes never see half an image
+            tmp = "{target}.{pid}.{thread}.tmp".format(pid=os.getpid(), thread=threading.get_ident(), **locals())
+            if imagecontent.format == 'JPEG':
+                with open(tmp, mode='wb') as fo:
+                    fo.write(content)
+            else:
+                imagecontent.convert('RGB').save(tmp, format='JPEG')
+            os.replace(tmp, target)
+            _image_similarity.record(imagecontent)
+        _urlindex.set(url, myhash)
 
         return filename
 
 
+class similar_images(Processer):
+    '''Finds stored images that are (near) copies of the images of a document'''
+
+    def process(self, document_field, kind='phash', max_distance=6):
+        '''
+        document_field is expected to be a list of dicts as added by download_images. The filenames
+        of similar images (within max_distance bits of the `kind` hash, see _image_similarity) are
+        added to every image under 'similar', without the image itself.
+        '''
+        if document_field is None: # the images could not be downloaded
+            return None
+        index = _image_similarity.get_index(kind)
+        document_field_new = []
+        for image in document_field:
+            image_new = image.copy()
+            if image.get('filename'):
+                try:
+                    image_new['similar'] = [{'filename':filename, 'distance':distance}
+                                            for distance, filename in index.similar(image['filename'], max_distance)
+                                            if filename != image['filename']]
+                except (IOError, OSError) as e:
+                    logger.warning("Could not read image {image[filename]}: {e}".format(**locals()))
+            document_field_new.append(image_new)
+        return document_field_new
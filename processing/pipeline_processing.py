@@ -0,0 +1,196 @@
+'''
+This file contains a processor that chains other processors, so a field
+can be cleaned, normalized and stemmed in a single pass over the documents.
+
+Steps are given by the names of processors, optionally with their arguments,
+for instance:
+
+    steps = ['clean_whitespace', 'remove_punctuation', 'lowercase',
+             ['remove_stopwords', {'language':'dutch'}],
+             ['stemming', {'language':'dutch'}]]
+
+Each document is read once, all steps are applied in memory (batch by batch,
+using the `process_batch` of every step) and only the requested outputs are
+written, as one bulk partial update per batch.
+'''
+
+import datetime
+import importlib
+import logging
+from elasticsearch import helpers
+from core.processor_class import Processer, _doctype_query_or_list, _batcher
+from core.database import get_document
+import core.database
+import core.plugin_registry
+
+logger = logging.getLogger(__name__)
+
+def get_processor(name):
+    '''Returns an instance of the processor with this (class or task) name, e.g. 'lowercase' '''
+    for task in core.plugin_registry.tasks('processing'):
+        if name in (task['classname'], task['name']):
+            module = importlib.import_module(task['module'])
+            return getattr(module, task['classname'])()
+    raise KeyError("No processor named {name}".format(**locals()))
+
+class pipeline(Processer):
+    '''Applies a chain of processors to a field in a single pass'''
+
+    def _steps(self, steps):
+        '''Returns (name, processor, kwargs) per step, see the module docstring for the format of steps'''
+        parsed = []
+        for step in steps:
+            if isinstance(step, str):
+                name, kwargs = step, {}
+            else:
+                name, kwargs = step[0], (step[1] if len(step) > 1 else {})
+            parsed.append((name, get_processor(name), kwargs))
+        return parsed
+
+    def _output_keys(self, field, steps, keep=(), new_key=None):
+        '''Returns the keys to write per step number
+
+        The output of a step is named as when the processors would be run one
+        after the other, e.g. text_lowercase_stemming. Only the output of the
+        last step (named `new_key`, if given) and of the steps named in `keep`
+        are written.
+        '''
+        keys = {}
+        key  = field
+        for num, (name, processor, kwargs) in enumerate(steps):
+            key = "%s_%s" %(key, type(processor).__name__)
+            if name in keep or num in keep:
+                keys[num] = key
+        keys[len(steps) - 1] = new_key or key
+        return keys
+
+    def _apply(self, document_fields, steps, output_keys, cache=None):
+        '''Returns a dict of {key:result} per field with the requested outputs
+
+        Fields for which a step fails (returns None) are not processed further.
+        '''
+        outputs = [{} for document_field in document_fields]
+        todo    = list(range(len(document_fields)))
+        values  = list(document_fields)
+        for num, (name, processor, kwargs) in enumerate(steps):
+            if not todo: break
+            if processor._use_cache(cache):
+                results = processor._process_batch_cached(values, **kwargs)
+            else:
+                results = processor.process_batch(values, **kwargs)
+            failed = sum(result is None for result in results)
+            if failed:
+                logger.warning("{name} failed for {failed} documents".format(**locals()))
+            todo   = [index for index, result in zip(todo, results) if result is not None]
+            values = [result for result in results if result is not None]
+            if num in output_keys:
+                for index, result in zip(todo, values):
+                    outputs[index][output_keys[num]] = result
+        return outputs
+
+    def _partial(self, steps, output_keys, output, arguments):
+        '''Returns the partial document with outputs and their metadata'''
+        partial = dict(output)
+        partial['META'] = {}
+        for num, key in output_keys.items():
+            if key in output:
+                name, processor, kwargs = steps[num]
+                partial['META'][key] = processor._metadata(PIPELINE=arguments, **kwargs)
+        return partial
+
+    def process(self, document_field, steps, **kwargs):
+        '''the field was processed by a chain of processors'''
+        steps = self._steps(steps)
+        output = self._apply([document_field], steps, {len(steps) - 1:'result'}, cache=kwargs.get('cache'))[0]
+        return output.get('result')
+
+    def run(self, document, field, steps, new_key=None, save=False, force=False, keep=(), cache=None):
+        '''
+        Run a chain of processors on a single document.
+
+        Input
+        ---
+        document: dict or str
+            document (or its id) to be processed
+        field: str
+            key of the field to be processed
+        steps: list
+            the processors to apply, see the module docstring
+        new_key: str
+            if specified, the output of the last step is stored under this key
+        save: boolean
+            indicates whether the result will be stored in the database
+        force: boolean
+            whether documents should be processed when the outputs (of the current version of
+            their step) already exist
+        keep: list
+            names (or numbers) of steps whose output should be stored as well
+        cache: boolean
+            whether steps reuse results from the result cache (see Processer.run)
+        '''
+        if field is None: # This path is used to run examples
+            return self.process(document, steps, cache=cache)
+        return list(self._run_batch([document], field, steps, new_key=new_key, save=save,
+                                    force=force, keep=keep, cache=cache))[0][0]
+
+    def _run_batch(self, documents, field, steps, new_key=None, save=True, force=False, keep=(),
+                   cache=None, bulksize=500):
+        arguments   = {'steps':steps, 'field':field, 'keep':list(keep)}
+        steps       = self._steps(steps)
+        output_keys = self._output_keys(field, steps, keep, new_key)
+        for num, batch in enumerate(_batcher(documents, batchsize=bulksize)):
+            batch = [doc if type(doc)==dict else get_document(doc) for doc in batch]
+            masked = [not '_source' in doc for doc in batch]
+            batch = [{'_source':doc} if mask else doc for doc, mask in zip(batch, masked)]
+            todo  = [doc for doc in batch if field in doc['_source'] and
+                     (force or not all(steps[num][1]._is_done(doc['_source'], key)
+                                       for num, key in output_keys.items()))]
+            outputs = self._apply([doc['_source'][field] for doc in todo], steps, output_keys, cache=cache)
+            actions = []
+            for doc, output in zip(todo, outputs):
+                if not output: continue
+                partial = self._partial(steps, output_keys, output, arguments)
+                doc['_source'].update(output)
+                doc['_source'].setdefault('META', {}).update(partial['META'])
+                if save and '_id' in doc:
+                    actions.append({'_op_type':'update', '_index':doc.get('_index', core.database.elastic_index),
+                                    '_type':doc['_type'], '_id':doc['_id'], 'doc':partial})
+            if actions:
+                helpers.bulk(core.database.client, actions)
+            now = datetime.datetime.now()
+            logger.info("processed batch {num} {now}".format(**locals()))
+            yield [doc['_source'] if mask else doc for doc, mask in zip(batch, masked)]
+
+    def runwrap(self, docs_or_query, action='batch', *args, **kwargs):
+        '''
+        Run the pipeline on a list of documents, a query or a doctype.
+
+        Input
+        ---
+        docs_or_query:
+            either a list of documents, an elasticsearch query or a string specifying the doctype
+        action: one of ['batch', 'run', 'delay']
+            'batch' (and 'run') process and save bulksize documents at once,
+            'delay' sends each document to a celery worker
+        field, steps, new_key, force, keep, cache, bulksize:
+            see run
+        incremental: bool (default=False)
+            only process documents added since the last run, see Processer.runwrap
+        '''
+        incremental = kwargs.pop('incremental', False)
+        if args:
+            kwargs.update(zip(['field', 'steps'], args))
+            args = ()
+        steps       = self._steps(kwargs['steps'])
+        output_keys = self._output_keys(kwargs['field'], steps, kwargs.get('keep', ()), kwargs.get('new_key'))
+        documents = _doctype_query_or_list(docs_or_query, force=kwargs.get('force', False),
+                                           field=kwargs['field'], new_key=output_keys[max(output_keys)],
+                                           version=steps[-1][1].version, incremental=incremental)
+        if action == 'delay':
+            for doc in documents:
+                yield self.delay(doc, **kwargs)
+            return
+        kwargs.setdefault('save', True)
+        for batch in self._run_batch(documents, **kwargs):
+            for doc in batch:
+                yield doc
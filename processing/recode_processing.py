@@ -7,10 +7,113 @@ from core.processor_class import Processer
 from core.database import update_document, get_document, check_exists
 from dateutil import parser
 import datetime
+import functools
 import logging
 
 logger = logging.getLogger(__name__)
 
+CACHE_SIZE = 100000 # the number of distinct date strings remembered per parser
+
+# formats tried (in this order) to find a fast strptime equivalent of dateutil's result
+CANDIDATE_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S%z', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%Y%m%d',
+    '%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M', '%d-%m-%Y', '%m-%d-%Y',
+    '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M', '%m/%d/%Y',
+    '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y',
+    '%a %b %d %H:%M:%S %z %Y', '%a, %d %b %Y %H:%M:%S %z', '%a, %d %b %Y %H:%M:%S',
+    '%d %B %Y %H:%M', '%d %B %Y', '%d %b %Y', '%B %d, %Y', '%b %d, %Y', '%A %d %B %Y',
+    ]
+
+_strptime = functools.lru_cache(maxsize=CACHE_SIZE)(datetime.datetime.strptime)
+
+def _day_month_order(fmt):
+    '''Returns 'dm' or 'md' for formats with a numeric day and month, None otherwise'''
+    if '%d' not in fmt or '%m' not in fmt:
+        return None
+    return fmt.index('%d') < fmt.index('%m') and 'dm' or 'md'
+
+class DateParser():
+    '''
+    Parses date strings like dateutil.parser.parse, but fast for the (few)
+    formats that occur in a collection.
+
+    The first strings are parsed by dateutil. For each of them, the parser
+    looks for a format in `formats` that gives the same datetime with strptime,
+    and tries the formats learned this way (most used first) before falling
+    back to dateutil. Results are cached per string.
+
+    Strings in which the day and month are both numbers up to 12 are only
+    parsed with a learned format if the order of the format matches
+    `dayfirst`, so results are the same as those of dateutil.
+
+    Parameters
+    ----------
+    yearfirst, dayfirst, fuzzy: bool (default=False)
+        passed to dateutil.parser.parse
+    formats: list (default=CANDIDATE_FORMATS)
+        strptime formats that may be learned
+    cache_size: int (default=CACHE_SIZE)
+        the number of distinct strings to remember
+    kwargs:
+        other keyword arguments to pass to dateutil.parser.parse
+    '''
+
+    def __init__(self, yearfirst=False, dayfirst=False, fuzzy=False, formats=None, cache_size=CACHE_SIZE, **kwargs):
+        self.options = dict(yearfirst=yearfirst, dayfirst=dayfirst, fuzzy=fuzzy, **kwargs)
+        self.candidates = list(formats or CANDIDATE_FORMATS)
+        self.preferred_order = dayfirst and 'dm' or 'md'
+        self.learned = [] # [format, day-month order, hits], most hits first
+        self.fallbacks = 0
+        self.parse = functools.lru_cache(maxsize=cache_size)(self._parse)
+
+    def _parse(self, string):
+        for num, entry in enumerate(self.learned):
+            fmt, order, hits = entry
+            try:
+                result = datetime.datetime.strptime(string, fmt)
+            except ValueError:
+                continue
+            if order and order != self.preferred_order and result.day <= 12 and result.day != result.month:
+                break # ambiguous, let dateutil decide
+            entry[2] += 1
+            if num and entry[2] > self.learned[num-1][2]:
+                self.learned[num-1], self.learned[num] = entry, self.learned[num-1]
+            return result
+        return self._fallback(string)
+
+    def _fallback(self, string):
+        result = parser.parse(string, **self.options)
+        self.fallbacks += 1
+        known = set(entry[0] for entry in self.learned)
+        for fmt in self.candidates:
+            if fmt in known: continue
+            try:
+                parsed = datetime.datetime.strptime(string, fmt)
+            except ValueError:
+                continue
+            # aware and naive datetimes are never equal, so this also checks the timezone handling
+            if parsed == result and parsed.utcoffset() == result.utcoffset():
+                logger.debug("learned date format {fmt} from {string}".format(**locals()))
+                self.learned.append([fmt, _day_month_order(fmt), 0])
+                break
+        return result
+
+    def parse_many(self, strings):
+        '''Parses a list of strings, parsing each distinct string once'''
+        parsed = {}
+        return [parsed[string] if string in parsed else parsed.setdefault(string, self.parse(string))
+                for string in strings]
+
+_parsers = {}
+
+def get_date_parser(yearfirst=False, dayfirst=False, fuzzy=False, **kwargs):
+    '''Returns the (shared) DateParser for these options, so formats and results are learned once per process'''
+    key = (yearfirst, dayfirst, fuzzy, repr(sorted(kwargs.items())))
+    if key not in _parsers:
+        _parsers[key] = DateParser(yearfirst=yearfirst, dayfirst=dayfirst, fuzzy=fuzzy, **kwargs)
+    return _parsers[key]
+
 class datetime_string_to_date(Processer):
     '''
     Takes a specified date-format and outputs ISO-datetimes
@@ -43,7 +146,12 @@ class datetime_string_to_date(Processer):
 
     def process(self, document_field, input_format):
         '''standardized datetime format'''
-        return datetime.datetime.strptime(document_field,input_format)
+        return _strptime(document_field,input_format)
+
+    def process_batch(self, document_fields, input_format):
+        parsed = {}
+        return [parsed[string] if string in parsed else parsed.setdefault(string, _strptime(string, input_format))
+                for string in document_fields]
 
 class dateutil_string_to_date(Processer):
     '''
@@ -67,12 +175,20 @@ class dateutil_string_to_date(Processer):
     Returns
     -------
         Datetime
+
+    Notes
+    -----
+    Formats are learned per combination of arguments, see DateParser
     '''
 
     def process(self, document_field, year_first=False, day_first=False, fuzzy=False, **kwargs):
         '''Extracted datetime from string'''
-        return parser.parse(document_field, yearfirst=year_first,
-                            dayfirst=day_first, fuzzy=fuzzy, **kwargs)
+        return get_date_parser(yearfirst=year_first, dayfirst=day_first,
+                               fuzzy=fuzzy, **kwargs).parse(document_field)
+
+    def process_batch(self, document_fields, year_first=False, day_first=False, fuzzy=False, **kwargs):
+        return get_date_parser(yearfirst=year_first, dayfirst=day_first,
+                               fuzzy=fuzzy, **kwargs).parse_many(document_fields)
 
 class rename_field(Processer):
     '''
@@ -23,6 +23,7 @@ except:
 
 class sentiment_vader_en(Processer):
     '''Sentiment-analyses English-language texts using Vader'''
+    cacheable = True
 
     def process(self, document_field):
         '''Added sentiment based on Vader'''
@@ -38,6 +39,7 @@ class sentiment_vader_en(Processer):
 
 class sentiment_pattern(Processer):
     '''Sentiment-analyses using Pattern'''
+    cacheable = True
         
     def process(self, document_field, *args, **kwargs):
         '''Added sentiment based on Pattern'''
@@ -0,0 +1,271 @@
+'''
+The quote rules of alpino_to_quote as they were implemented with pandas
+(one DataFrame of tokens and dependencies per line), kept as a reference
+for alpino_to_quote_tests. The only changes are those needed to run it with
+recent versions of pandas (see _int, map_parse and get_literal).
+'''
+import re
+import pandas
+from processing.alpino_processing import SPEACH_VERBS
+
+def _int(value):
+    # int() of a single-element Series, which recent versions of pandas no longer allow
+    if isinstance(value, pandas.Series):
+        if len(value) != 1: raise TypeError("cannot convert the series")
+        return int(value.iloc[0])
+    return int(value)
+
+class alpino_to_quote():
+    '''Takes alpino output and extracts quotes (pandas reference implementation)'''
+
+    def process(self, alpino_result):
+        '''takes an alpino result and returns a list of {speaker:name,using:verb,quote:text} dicts'''
+
+        quotes = []
+        for num,line in enumerate(alpino_result):
+            mapped, tokens = self.map_parse(line)
+            line_quotes= []
+            line_quotes.extend(self.type_a(mapped, tokens))
+            line_quotes.extend(self.type_b(mapped, tokens))
+            line_quotes.extend(self.type_c(mapped, tokens))
+            line_quotes.extend(self.type_d(mapped, tokens))
+            line_quotes.extend(self.type_e(mapped, tokens))
+            [q.update({'line':num}) for q in line_quotes]
+            if line_quotes: quotes.append(line_quotes[0])
+        return quotes
+
+    # map dependency & token list
+    def map_parse(self, alpino_parse):
+        if not alpino_parse.get('tokens',[]): return pandas.DataFrame(), pandas.DataFrame()
+        tokens       = pandas.DataFrame(alpino_parse['tokens'])
+        dependencies = pandas.DataFrame(alpino_parse['dependencies'])[['child','parent','relation']]
+        mapped = dependencies.merge(tokens[['id','lemma']], left_on='child', right_on='id', suffixes=('','lemma'))
+        mapped.columns = ['child','parent','relation','child_id','child_lemma']
+        mapped = mapped.merge(tokens[['id','lemma']], left_on='parent', right_on='id', suffixes=('','lemma'))
+        mapped.columns = ['child', 'parent', 'relation', 'child_id','child_lemma','parent_id', 'parent_lemma']
+        return mapped, tokens
+
+    # relational parser
+    def get_relation(self, mapped, child=True, relation=True, parent=True):
+        id_type = lambda x: type(x)!=str
+        if type(relation) not in [list,bool]:
+            relation = [relation]
+        if id_type(child):
+            child_condition = type(child) == bool and (True) or (mapped.child_id ==_int(child))
+        else:
+            child_condition    = type(child)  == bool and True or (mapped.child_lemma==child)
+
+        relation_condition = type(relation)     == bool and True or (mapped.relation.isin(relation))
+
+        if id_type(parent):
+            parent_condition = type(parent) == bool and (True) or (mapped.parent_id == _int(parent))
+        else:
+            parent_condition   = type(parent) == bool and True or (mapped.parent_lemma==parent)
+
+        return mapped[ (mapped.child==mapped.child) & child_condition & relation_condition & parent_condition]
+
+    def get_literal(self, tokens):
+        if tokens.empty: return []
+        r = re.compile(r'["“”„:]|,{2,2}\'|\'[^s]')
+        tokens["hasquote"] = pandas.Series([getattr(r.search(w),'group',lambda:None)() for w in tokens.word],
+                                           dtype=object, index=tokens.index)
+        quotes = [q for q in tokens[[hq!=None for hq in tokens.hasquote]].sort_values('offset')[['offset','hasquote','word']].itertuples()]
+        indices = []
+        startq  = None
+        colpos  = None
+        for q in quotes:
+            if not startq:
+                if q[2]==':':
+                    colpos=q[1]
+                    continue
+                if len(r.findall(q[3]))>1:
+                    indices.append((q[1],q[1]))
+                    continue
+                startq=q
+                colpos = None
+            else:
+                if q[2]!=startq[2]: continue
+                if len(r.findall(q[3]))>1:
+                    indices.append((startq,q[1]))
+                    startq=q[1]
+                    continue
+                indices.append((startq[1],q[1]))
+                startq = None
+        if colpos:
+            indices.append((colpos, max(tokens.offset)))
+        get_indices = lambda start,stop: list(range(start,stop+1))
+        get_ids     = lambda start,stop: list(tokens.id[tokens.offset.isin(get_indices(start,stop))])
+        quote_lists = [get_ids(*indi) for indi in indices]
+        return quote_lists
+
+    def get_series(self, tokens, start=0, end=False):
+        if not end:
+            end = max(tokens.offset)
+        return ' '.join(tokens.sort_values('offset')[(tokens.offset>=start)&(tokens.offset<=end)].word)
+
+    def get_list(self, tokens, indices, pos_major=''):
+        return tokens[tokens.id.isin(indices)].sort_values('offset').word
+
+    def tracer(self, mapped, wordid, direction="up", relations=True, prev=[]):
+        trace = []
+        if direction=="up":
+            parent = self.get_relation(mapped, relation=relations, child=wordid).parent.values
+        else:
+            parent = self.get_relation(mapped, relation=relations, parent=wordid).child.values
+        if parent.any():
+            trace.extend([p for p in parent])
+            [trace.extend(self.tracer(mapped,p, direction,relations=relations, prev=trace+prev)) for p in parent if p not in prev]
+        return trace
+
+    # extract relations where necessary
+    def get_source(self, mapped, tokens, verb_id):
+        subject = tokens[tokens.id.isin(self.get_relation(mapped, relation='su', parent=verb_id).child)]
+        if subject.empty:
+            return ''
+        elif subject.lemma.values[0]=='en':
+            return ';'.join(self.get_list(tokens, self.tracer(mapped,subject.id,'down')))
+        else:
+            return ''.join(subject.word)
+
+    def type_c(self, mapped,tokens):
+        if mapped.empty or tokens.empty: return []
+        verbs = tokens[tokens.lemma.isin(SPEACH_VERBS)]
+        quotes = []
+        for verb_id in verbs.id:
+            type_c_relation    = self.get_relation(mapped, child='dat',relation='vc',parent=verb_id)
+            if type_c_relation.empty: return []
+            #    type_c_2_relation  = self.get_relation(mapped, child='hoop', relation='obj1', parent=verb_id)
+            #    if type_c_2_relation.empty: continue
+            #    type_c_2b_relation = self.get_relation(mapped, child='dat', relation='vc', parent=type_c_2_relation.child)
+            #    if type_c_2b_relation.empty:continue
+            #    body = self.get_list(diltokens,self.tracer(mapped,type_c_2b_relation.child,'down'))
+            #else:
+            body = self.get_list(tokens, self.tracer(mapped,type_c_relation.child, 'down'))
+            verb_word  = tokens[tokens.id==verb_id].word.values[0]
+            verb_lemma = tokens[tokens.id==verb_id].lemma.values[0]
+            source = self.get_source(mapped,tokens, verb_id)
+            quotes.append({
+                'type':'C',
+                'literal':'no',
+                'verb_lemma': verb_lemma,
+                'verb_word': verb_word,
+                'source':source,
+                'body':' '.join(body)
+            })
+        return quotes
+
+    def type_a(self, mapped, tokens):
+        if tokens.empty or mapped.empty: return []
+        quotes = []
+        verbs = tokens[tokens.lemma=="blijk"]
+        if verbs.empty: return []
+        type_a_relation = self.get_relation(mapped, child='uit', relation='pc', parent=verbs.id.values[0])
+        if type_a_relation.empty: return []
+        source = ' '.join(self.get_list(tokens,self.tracer(mapped,type_a_relation.child.values[0],'down')))
+        type_a_body_relation = self.get_relation(mapped, relation='su', parent=verbs.id.values[0])
+        if type_a_body_relation.empty:
+            body = ""
+        else:
+            body  = self.get_list(tokens, self.tracer(mapped,type_a_body_relation.child,'down'))
+            if body.empty:
+                body = ''
+                pass #Should solve for 'dat' reference
+            else:
+                body = ' '.join(body)
+        quotes.append({
+            'type':'A',
+            'literal':'no',
+            'verb_lemma':'blijk',
+            'verb_word':verbs.word.values[0],
+            'source':source,
+            'body':body
+        })
+        return quotes
+
+    def pivot(self, mapped, series):
+        pivots = set()
+        for element in series:
+            if not pivots:
+                pivots = set(self.tracer(mapped,element,'up'))
+            else:
+                pivots = pivots.intersection(set(self.tracer(mapped,element,'up')))
+        return pivots
+
+    def type_b(self, mapped,tokens):
+        if mapped.empty or tokens.empty: return []
+        accordings = tokens[tokens.lemma.isin(['volgens','aldus'])]
+        if accordings.empty: return []
+        quotes = []
+        for acc in accordings.id:
+            type_b_quote_relation = pandas.concat([self.get_relation(mapped, relation="tag",child=acc),
+                                                  self.get_relation(mapped, relation="mod", child=acc)])
+            source_ids = self.tracer(mapped,acc,'down')
+            pivot = set(self.tracer(mapped,acc,'up')).intersection(set(self.tracer(mapped,type_b_quote_relation.parent,'up')))
+            quote_ids  = [id for id in self.tracer(mapped,min(pivot),'down') if
+                          id not in source_ids + [acc]]
+            quotes.append({
+                'type':'B',
+                'literal':'no',
+                'verb_lemma':tokens.lemma[tokens.id==acc].values[0],
+                'verb_word': tokens.word[tokens.id == acc].values[0],
+                'source':' '.join(self.get_list(tokens,source_ids)),
+                'body':' '.join(self.get_list(tokens,quote_ids))
+            })
+        return quotes
+
+    def type_d(self, mapped, tokens):
+        quotes = []
+        literals = self.get_literal(tokens)
+        merged_literals = []
+        for literal in literals: merged_literals.extend(literal)
+        for literal in  literals:
+            name = tokens.word[(tokens.pos=='name')&(tokens.id.isin(merged_literals)==False)]
+            pron = tokens.word[(tokens.pos=='pron')&(tokens.id.isin(merged_literals)==False)]
+
+            verb = tokens[(tokens.lemma.isin(SPEACH_VERBS))&(tokens.id.isin(merged_literals)==False)]
+
+            if not name.empty:
+                source = ' '.join(name)
+            else:
+                source = ' '.join(pron)
+            quotes.append({
+                'type':'D',
+                'literal':'yes',
+                'verb_lemma':' '.join(verb.lemma),
+                'verb_word':' '.join(verb.word),
+                'source':source,
+                'body':' '.join(self.get_list(tokens,literal))
+            })
+        return quotes
+
+    def type_e(self, mapped,tokens):
+        if mapped.empty or tokens.empty: return []
+        quotes = []
+        verbs = tokens[(tokens.lemma.isin(SPEACH_VERBS))&(tokens.pos=='verb')]
+        for token in verbs.id:
+            verb = tokens[(tokens.lemma.isin(SPEACH_VERBS))]
+
+            verb_sub = self.get_relation(mapped, relation='su', parent=token)
+            if verb_sub.empty:
+                return []
+            verb_source = self.tracer(mapped,verb_sub.child,'down',relations=["det","de","mod"]) + list(verb_sub.child)
+
+            verb_obj = self.get_relation(mapped, relation='obj1', parent=token)
+            if verb_obj.empty:
+                verb_obj = self.get_relation(mapped, relation='nucl', parent=token)
+            if verb_obj.empty:
+                verb_obj = self.get_relation(mapped, relation='dp', parent=token)
+            if not verb_obj.empty:
+                verb_body = self.tracer(mapped,verb_obj.child,'down')+list(verb_obj.child)
+            else:
+                verb_body = []
+
+            quotes.append({
+                'type':'E',
+                'literal':'no',
+                'verb_lemma': ' '.join(verb.lemma),
+                'verb_word':' '.join(verb.word),
+                'source': ' '.join(self.get_list(tokens,verb_source)),
+                'body': ' '.join(self.get_list(tokens, verb_body))
+            })
+        return quotes
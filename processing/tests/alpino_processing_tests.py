@@ -0,0 +1,44 @@
+'''
+TESTS FOR the compact encoding of parses in alpino_processing
+'''
+import base64
+import json
+import os
+import zlib
+import pytest
+from processing.alpino_processing import encode_parses, decode_parses
+
+TESTDATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'testdata', 'parsed_DE_8.json')
+
+@pytest.fixture(scope='module')
+def testset():
+    with open(TESTDATA) as fileobj:
+        return json.load(fileobj)
+
+def test_round_trip(testset):
+    lines = testset + [{}, None]
+    decoded = decode_parses(encode_parses(lines))
+    assert len(decoded) == len(lines)
+    for original, line in zip(testset, decoded):
+        assert line['tokens'] == original['tokens']
+        assert line['dependencies'] == original['dependencies']
+        assert line['header'] == testset[0]['header'] # the header is stored once
+    assert decoded[-2:] == [{}, {}]
+
+def test_compact(testset):
+    encoded = encode_parses(testset)
+    assert isinstance(encoded, str)
+    assert len(encoded) < len(json.dumps(testset)) / 4
+
+def test_bytes(testset):
+    encoded = encode_parses(testset)
+    assert decode_parses(encoded.encode('ascii')) == decode_parses(encoded)
+
+def test_not_encoded(testset):
+    assert decode_parses(testset) is testset
+    assert decode_parses(None) is None
+
+def test_unknown_version():
+    encoded = base64.b64encode(zlib.compress(json.dumps({'version':-1}).encode('utf-8'))).decode('ascii')
+    with pytest.raises(ValueError):
+        decode_parses(encoded)
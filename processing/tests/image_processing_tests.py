@@ -0,0 +1,145 @@
+'''
+TESTS FOR image_processing
+'''
+import io
+import os
+import imagehash
+import pytest
+from PIL import Image
+from processing import image_processing
+
+def test_failed_downloads_are_retried(monkeypatch):
+    failing = {'http://example.com/b.jpg'}
+    def download(self, url):
+        if url in failing:
+            raise IOError("no connection")
+        return os.path.basename(url)
+    monkeypatch.setattr(image_processing.download_images, 'download', download)
+    fields = [[{'url':'http://example.com/a.jpg'}],
+              [{'url':'http://example.com/a.jpg'}, {'url':'http://example.com/b.jpg'}]]
+    processor = image_processing.download_images()
+    assert processor.process_batch(fields) == [[{'url':'http://example.com/a.jpg', 'filename':'a.jpg'}], None]
+    assert not processor._is_done({'images':None}, 'images')
+    failing.clear()
+    assert processor.process(fields[1]) == [{'url':'http://example.com/a.jpg', 'filename':'a.jpg'},
+                                            {'url':'http://example.com/b.jpg', 'filename':'b.jpg'}]
+    # nothing to compare for documents without downloaded images
+    assert image_processing.similar_images().process(None) is None
+
+def test_session_per_process(monkeypatch):
+    session = image_processing._get_session()
+    assert image_processing._get_session() is session
+    monkeypatch.setattr(os, 'getpid', lambda: -1)
+    assert image_processing._get_session() is not session
+
+class _raw():
+    def __init__(self, content):
+        self.content = content
+
+    def read(self, amount, decode_content=False):
+        return self.content[:amount]
+
+class _response():
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.raw = _raw(content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise image_processing.requests.HTTPError("status {}".format(self.status_code))
+
+class _session():
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def get(self, url, stream=False, timeout=None):
+        self.requests.append(url)
+        return self.responses[url]
+
+def image_bytes(color, format='JPEG'):
+    fileobj = io.BytesIO()
+    image = Image.new('RGB', (32, 32), color)
+    image.putpixel((0, 0), (255 - color[0], 0, 0))
+    image.save(fileobj, format=format)
+    return fileobj.getvalue()
+
+JPEG = image_bytes((200, 10, 10))
+PNG  = image_bytes((10, 10, 200), format='PNG')
+
+@pytest.fixture
+def session(tmpdir, monkeypatch):
+    session = _session({'http://a/red.jpg':_response(200, JPEG), 'http://b/red.jpg':_response(200, JPEG),
+                        'http://a/blue.png':_response(200, PNG), 'http://a/gone.jpg':_response(404),
+                        'http://a/busy.jpg':_response(503)})
+    monkeypatch.setattr(image_processing, 'IMAGEPATH', str(tmpdir))
+    monkeypatch.setattr(image_processing, '_session', session)
+    monkeypatch.setattr(image_processing, '_session_pid', os.getpid())
+    monkeypatch.setattr(image_processing, '_urlindex', image_processing._UrlIndex(str(tmpdir.join('urlindex.sqlite'))))
+    session.recorded = []
+    monkeypatch.setattr(image_processing._image_similarity, 'record', session.recorded.append)
+    return session
+
+def stored(filename):
+    return os.path.join(*image_processing.hash2filepath(filename[:-len('.jpg')]))
+
+def test_download(session, monkeypatch):
+    replaced = []
+    replace = os.replace
+    def record_replace(source, target):
+        assert os.path.exists(source) and source.endswith('.tmp')
+        replaced.append(target)
+        replace(source, target)
+    monkeypatch.setattr(os, 'replace', record_replace)
+    processor = image_processing.download_images()
+    filename = processor.download('http://a/red.jpg')
+    # stored by its hash, written to a temporary file first
+    assert filename == str(imagehash.average_hash(Image.open(io.BytesIO(JPEG)))) + '.jpg'
+    assert replaced == [stored(filename)]
+    assert len(session.recorded) == 1
+    # JPEG images are stored as they are
+    with open(stored(filename), 'rb') as fileobj:
+        assert fileobj.read() == JPEG
+    assert not [name for name in os.listdir(os.path.dirname(stored(filename))) if name.endswith('.tmp')]
+    # other images are converted
+    with Image.open(stored(processor.download('http://a/blue.png'))) as image:
+        assert image.format == 'JPEG'
+
+def test_download_once(session, monkeypatch):
+    processor = image_processing.download_images()
+    filename = processor.download('http://a/red.jpg')
+    # urls are looked up in the url index
+    assert processor.download('http://a/red.jpg') == filename
+    assert session.requests == ['http://a/red.jpg']
+    # the same image at another url is not stored again
+    replace = os.replace
+    monkeypatch.setattr(os, 'replace', lambda source, target: pytest.fail("image stored twice"))
+    assert processor.download('http://b/red.jpg') == filename
+    assert len(session.recorded) == 1
+    monkeypatch.setattr(os, 'replace', replace)
+    # unless it was removed from the image store
+    os.remove(stored(filename))
+    assert processor.download('http://a/red.jpg') == filename
+    assert os.path.exists(stored(filename))
+
+def test_maximum_size(session, monkeypatch):
+    monkeypatch.setattr(image_processing, 'MAXBYTES', len(JPEG) - 1)
+    with pytest.raises(ValueError):
+        image_processing.download_images().download('http://a/red.jpg')
+    assert image_processing.download_images().process([{'url':'http://a/red.jpg'}]) is None
+    monkeypatch.setattr(image_processing, 'MAXBYTES', len(JPEG))
+    assert image_processing.download_images().download('http://a/red.jpg')
+
+def test_failed_urls(session):
+    processor = image_processing.download_images()
+    fields = [[{'url':'http://a/red.jpg'}, {'url':'http://a/gone.jpg'}], [{'url':'http://a/busy.jpg'}]]
+    gone, busy = processor.process_batch(fields)
+    # urls that do not exist are marked, other failures are retried in a next run
+    assert gone[1] == {'url':'http://a/gone.jpg', 'error':404}
+    assert gone[0]['filename']
+    assert busy is None
+    # and not requested again
+    assert processor.process_batch(fields) == [gone, None]
+    assert session.requests.count('http://a/gone.jpg') == 1
+    assert session.requests.count('http://a/busy.jpg') == 2
+    assert image_processing.similar_images().process(gone[1:]) == gone[1:]
@@ -0,0 +1,66 @@
+'''
+TESTS FOR _image_similarity
+'''
+import random
+import numpy as np
+import pytest
+from PIL import Image
+from processing import _image_similarity
+from processing._image_similarity import BKTree, ImageIndex, hamming
+
+def random_hashes(n, seed=42):
+    generator = random.Random(seed)
+    hashes = [generator.getrandbits(64) for i in range(n)]
+    # add near copies, flipping a few bits
+    for myhash in hashes[:n // 4]:
+        for bits in range(1, 8):
+            hashes.append(myhash ^ sum(1 << bit for bit in generator.sample(range(64), bits)))
+    return hashes
+
+def test_hamming():
+    assert hamming(0, 0) == 0
+    assert hamming(0b1011, 0b0001) == 2
+    assert hamming(2**64 - 1, 0) == 64
+
+@pytest.mark.parametrize('max_distance', [0, 3, 6, 10])
+def test_search_same_as_brute_force(max_distance):
+    hashes = random_hashes(400)
+    tree = BKTree()
+    for item, myhash in enumerate(hashes):
+        tree.add(myhash, item)
+    assert tree.size == len(hashes)
+    for query in hashes[:50] + random_hashes(50, seed=1):
+        expected = sorted((hamming(query, myhash), item) for item, myhash in enumerate(hashes)
+                          if hamming(query, myhash) <= max_distance)
+        assert tree.search(query, max_distance) == expected
+
+def test_search_duplicates_and_empty_tree():
+    assert BKTree().search(123, 64) == []
+    tree = BKTree()
+    tree.add(5, 'a')
+    tree.add(5, 'b')
+    tree.add(np.uint64(7), 'c')
+    assert tree.search(5, 0) == [(0, 'a'), (0, 'b')]
+    assert tree.search(5, 1) == [(0, 'a'), (0, 'b'), (1, 'c')]
+
+def test_record_and_index(tmpdir):
+    path = str(tmpdir.join('imagehashes.bin'))
+    assert len(_image_similarity.load(path)) == 0
+    generator = np.random.RandomState(0)
+    images = [Image.fromarray(generator.randint(0, 255, (32, 32, 3)).astype('uint8')) for i in range(3)]
+    for image in images:
+        _image_similarity.record(image, path=path)
+    # a partially written record is ignored
+    with open(path, mode='ab') as fo:
+        fo.write(b'\0' * 5)
+    records = _image_similarity.load(path)
+    assert len(records) == 3
+    assert len(_image_similarity.load(path, start=2)) == 1
+    index = ImageIndex('dhash', path=path).refresh()
+    assert index.loaded == 3
+    distance, filename = index.similar(images[1], max_distance=0)[0]
+    assert distance == 0
+    assert filename == _image_similarity.hash2filename(int(records['average'][1]))
+    # a slightly changed copy is found
+    copy = images[1].resize((64, 64)).resize((32, 32))
+    assert filename in [found for distance, found in index.similar(copy, max_distance=10)]
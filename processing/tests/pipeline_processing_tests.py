@@ -0,0 +1,108 @@
+'''
+TESTS FOR pipeline_processing
+'''
+import pytest
+from core.processor_class import Processer
+from processing import pipeline_processing
+
+class upper(Processer):
+    '''the field in upper case'''
+    version = '0.1'
+    def process(self, document_field):
+        '''the field in upper case'''
+        return document_field.upper()
+
+class suffix(Processer):
+    '''the field with a suffix'''
+    version = '0.1'
+    def process(self, document_field, suffix='!'):
+        '''the field with a suffix'''
+        if document_field.startswith('FAIL'):
+            return None
+        return document_field + suffix
+
+PROCESSORS = {'upper':upper, 'suffix':suffix}
+
+@pytest.fixture
+def bulk(monkeypatch):
+    monkeypatch.setattr(pipeline_processing, 'get_processor', lambda name: PROCESSORS[name]())
+    actions = []
+    monkeypatch.setattr(pipeline_processing.helpers, 'bulk', lambda client, batch: actions.extend(batch))
+    return actions
+
+STEPS = ['upper', ['suffix', {'suffix':'?'}]]
+
+def make_documents(*texts):
+    return [{'_id':str(i), '_index':'inca', '_type':'news', '_source':{'text':text}}
+            for i, text in enumerate(texts)]
+
+def run(documents, steps=STEPS, **kwargs):
+    return [doc for batch in pipeline_processing.pipeline()._run_batch(documents, 'text', steps, **kwargs)
+            for doc in batch]
+
+def test_chains_steps(bulk):
+    assert pipeline_processing.pipeline().process('a', STEPS) == 'A?'
+    doc, = run(make_documents('a'))
+    assert doc['_source']['text_upper_suffix'] == 'A?'
+    # intermediate outputs are not written, unless kept
+    assert 'text_upper' not in doc['_source']
+    assert doc['_source']['META']['text_upper_suffix']['ADDED_USING'].endswith("suffix'>")
+
+def test_output_keys(bulk):
+    processor = pipeline_processing.pipeline()
+    steps = processor._steps(STEPS)
+    assert processor._output_keys('text', steps) == {1:'text_upper_suffix'}
+    assert processor._output_keys('text', steps, keep=['upper']) == {0:'text_upper', 1:'text_upper_suffix'}
+    assert processor._output_keys('text', steps, keep=[0], new_key='out') == {0:'text_upper', 1:'out'}
+    doc, = run(make_documents('a'), keep=['upper'], new_key='out')
+    assert doc['_source']['text_upper'] == 'A'
+    assert doc['_source']['out'] == 'A?'
+
+def test_partial_update(bulk):
+    run(make_documents('a', 'b'), keep=['upper'])
+    assert [action['_id'] for action in bulk] == ['0', '1']
+    action = bulk[0]
+    assert action['_op_type'] == 'update'
+    assert (action['_index'], action['_type']) == ('inca', 'news')
+    # only the outputs and their metadata, not the processed field
+    assert sorted(action['doc']) == ['META', 'text_upper', 'text_upper_suffix']
+    assert sorted(action['doc']['META']) == ['text_upper', 'text_upper_suffix']
+    assert action['doc']['META']['text_upper_suffix']['FUNCTION_ARGUMENTS']['PIPELINE']['steps'] == STEPS
+    # not saved
+    bulk[:] = []
+    run(make_documents('a'), save=False)
+    assert bulk == []
+
+def test_failing_step(bulk):
+    docs = run(make_documents('fail', 'ok'), keep=['upper'])
+    # the output of the steps before the failure is kept
+    assert docs[0]['_source']['text_upper'] == 'FAIL'
+    assert 'text_upper_suffix' not in docs[0]['_source']
+    assert docs[1]['_source']['text_upper_suffix'] == 'OK?'
+    # documents without any output are not updated
+    bulk[:] = []
+    run(make_documents('fail'))
+    assert bulk == []
+
+def test_skips_documents_that_are_done(bulk, monkeypatch):
+    documents = make_documents('a', 'b', 'c')
+    run(documents)
+    bulk[:] = []
+    run(documents)
+    assert bulk == []
+    # a result of another version, or a failed (None) result, is processed again
+    documents[0]['_source']['META']['text_upper_suffix']['FUNCTION_VERSION'] = '0.0'
+    documents[1]['_source']['text_upper_suffix'] = None
+    run(documents)
+    assert [action['_id'] for action in bulk] == ['0', '1']
+    bulk[:] = []
+    monkeypatch.setattr(suffix, 'version', '0.2')
+    run(documents)
+    assert len(bulk) == 3
+    bulk[:] = []
+    run(documents, force=True)
+    assert len(bulk) == 3
+    # documents without the field are skipped
+    bulk[:] = []
+    run([{'_id':'4', '_type':'news', '_source':{'title':'a'}}])
+    assert bulk == []
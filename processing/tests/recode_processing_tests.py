@@ -0,0 +1,69 @@
+'''
+TESTS FOR the date parsing in recode_processing
+'''
+import datetime
+import random
+import pytest
+from dateutil import parser
+from processing.recode_processing import DateParser, get_date_parser, dateutil_string_to_date
+
+FORMATS = ['%Y-%m-%dT%H:%M:%S', '%d-%m-%Y', '%m/%d/%Y', '%d.%m.%Y %H:%M', '%a, %d %b %Y %H:%M:%S %z',
+           '%d %B %Y', '%Y-%m-%d']
+
+def date_strings(n=500, formats=FORMATS, seed=42):
+    generator = random.Random(seed)
+    start = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+    strings = []
+    for i in range(n):
+        date = start + datetime.timedelta(seconds=generator.randrange(3 * 365 * 24 * 60 * 60))
+        strings.append(date.strftime(generator.choice(formats)))
+    return strings
+
+@pytest.mark.parametrize('dayfirst', [False, True])
+def test_same_as_dateutil(dayfirst):
+    dateparser = DateParser(dayfirst=dayfirst)
+    strings = date_strings()
+    expected = [parser.parse(string, dayfirst=dayfirst) for string in strings]
+    assert [dateparser.parse(string) for string in strings] == expected
+    assert DateParser(dayfirst=dayfirst).parse_many(strings) == expected
+    # the formats are learned
+    assert dateparser.learned
+    assert dateparser.fallbacks < len(strings) / 2
+
+@pytest.mark.parametrize('dayfirst', [False, True])
+def test_ambiguous_day_and_month(dayfirst):
+    dateparser = DateParser(dayfirst=dayfirst)
+    # learn a format from unambiguous strings
+    assert dateparser.parse('25-12-2016') == datetime.datetime(2016, 12, 25)
+    assert dateparser.parse('12/25/2016') == datetime.datetime(2016, 12, 25)
+    for string in ['05-06-2017', '06/05/2017', '11-12-2016', '03-03-2017']:
+        assert dateparser.parse(string) == parser.parse(string, dayfirst=dayfirst)
+
+def test_learned_order_is_respected():
+    dateparser = DateParser(dayfirst=False)
+    dateparser.parse('25-12-2016')
+    assert [entry[:2] for entry in dateparser.learned] == [['%d-%m-%Y', 'dm']]
+    fallbacks = dateparser.fallbacks
+    # unambiguous, so strptime is used
+    assert dateparser.parse('13-06-2017') == datetime.datetime(2017, 6, 13)
+    assert dateparser.fallbacks == fallbacks
+    # ambiguous, dateutil reads month first
+    assert dateparser.parse('05-06-2017') == datetime.datetime(2017, 5, 6)
+    assert dateparser.fallbacks == fallbacks + 1
+
+def test_timezones():
+    dateparser = DateParser()
+    for string in ['2016-06-10T19:27:13+0000', '2016-06-10T19:27:13+0200', '2016-06-10T19:27:13']:
+        result = dateparser.parse(string)
+        assert result == parser.parse(string)
+        assert result.utcoffset() == parser.parse(string).utcoffset()
+
+def test_shared_parsers():
+    assert get_date_parser(dayfirst=True) is get_date_parser(dayfirst=True)
+    assert get_date_parser(dayfirst=True) is not get_date_parser(dayfirst=False)
+
+def test_processor():
+    processor = dateutil_string_to_date()
+    strings = ['05-06-2017', '25-12-2016', '05-06-2017']
+    assert processor.process_batch(strings, day_first=True) == [parser.parse(string, dayfirst=True) for string in strings]
+    assert processor.process(strings[0]) == datetime.datetime(2017, 5, 6)
@@ -7,6 +7,7 @@ logger = logging.getLogger(__name__)
 
 class xpath(Processer):
     '''Extract Xpath fields from html or xml documentsxs    '''
+    cacheable = True
 
     def process(self, document_field, extract_dict, **kwargs):
         '''XPath-based extraction was applied to this document '''